@@ -0,0 +1,200 @@
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from db import duplicate_key_errors, get_database
+from columns import numerical_cols, categorical_cols
+
+# Aggregate documents look like
+#   {"username": ..., "count": n, "sums": {col: total}, "counts": {col: {value: n}}, "updated_at": ...}
+# and are only ever changed with $inc, so concurrent submissions never lose updates.
+
+
+def field_key(value):
+    # Category values become field names, which may not be empty, contain "." or start with "$".
+    key = str(value).replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+    return key or "%00"
+
+
+MISSING_KEY = field_key(None)
+
+
+def field_value(key):
+    if key == "%00":
+        return ""
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def _numeric(value, strict_numeric):
+    if value is None:
+        return 0.0
+    if strict_numeric:
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def aggregate_increments(user_data, strict_numeric=True):
+    increments = {"count": 1}
+    for col in numerical_cols:
+        increments[f"sums.{col}"] = _numeric(user_data.get(col, 0), strict_numeric)
+    for col in categorical_cols:
+        increments[f"counts.{col}.{field_key(user_data.get(col))}"] = 1
+    return increments
+
+
+def merge_increments(increments, more):
+    for key, value in more.items():
+        increments[key] = increments.get(key, 0) + value
+    return increments
+
+
+def merge_update(update, more):
+    """Combine two update documents on the same target into one ($inc adds, $min/$max keep the extreme)."""
+    merged = {op: dict(fields) for op, fields in update.items()}
+    for op, fields in more.items():
+        target = merged.setdefault(op, {})
+        for field, value in fields.items():
+            if field not in target:
+                target[field] = value
+            elif op == "$inc":
+                target[field] += value
+            elif op == "$min":
+                target[field] = min(target[field], value)
+            elif op == "$max":
+                target[field] = max(target[field], value)
+            elif op != "$setOnInsert":
+                target[field] = value
+    return merged
+
+
+def aggregate_update(username, increments):
+    return {
+        "$inc": increments,
+        # Stamped by the server, so every writer's updates share one clock (see UserVectorIndex.sync).
+        "$currentDate": {"updated_at": True},
+        "$setOnInsert": {"username": username}
+    }
+
+
+def materialize_aggregate(doc):
+    """Turn a counter document into the mean/mode view the rest of the app reads."""
+    if not doc:
+        return {}
+    count = doc.get("count", 0) or 1
+    sums = doc.get("sums", {})
+    counts = doc.get("counts", {})
+    aggregated_data = {"username": doc.get("username")}
+    for col in numerical_cols:
+        aggregated_data[col] = round(sums.get(col, 0) / count, 2)
+    for col in categorical_cols:
+        value_counts = counts.get(col, {})
+        # max() keeps the first value on ties, like Counter.most_common.
+        mode = max(value_counts, key=value_counts.get) if value_counts else None
+        # Missing answers are counted under field_key(None); they read back as None, as before.
+        aggregated_data[col] = field_value(mode) if mode not in (None, MISSING_KEY) else None
+    aggregated_data["count"] = doc.get("count", 0)
+    if "updated_at" in doc:
+        aggregated_data["updated_at"] = doc["updated_at"]
+    return aggregated_data
+
+
+def apply_aggregate(collection, username, user_data, strict_numeric=True):
+    """Fold one submission into the user's aggregate in a single atomic round trip."""
+    update = aggregate_update(username, aggregate_increments(user_data, strict_numeric))
+    try:
+        doc = collection.find_one_and_update(
+            {"username": username}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race on the unique username index; the document exists now.
+        doc = collection.find_one_and_update(
+            {"username": username}, update, return_document=ReturnDocument.AFTER
+        )
+    return materialize_aggregate(doc)
+
+
+def apply_aggregates_bulk(collection, records, strict_numeric=True):
+    increments = {}
+    for record in records:
+        merge_increments(
+            increments.setdefault(record["username"], {}),
+            aggregate_increments(record["user_data"], strict_numeric)
+        )
+    if not increments:
+        return {}
+    updates = [(username, aggregate_update(username, user_increments)) for username, user_increments in increments.items()]
+    try:
+        collection.bulk_write([
+            UpdateOne({"username": username}, update, upsert=True) for username, update in updates
+        ], ordered=False)
+    except BulkWriteError as e:
+        errors = duplicate_key_errors(e)
+        if errors is None:
+            raise
+        # Lost upsert races on the unique username index (see apply_aggregate); those documents exist now.
+        collection.bulk_write([
+            UpdateOne({"username": updates[error["index"]][0]}, updates[error["index"]][1]) for error in errors
+        ], ordered=False)
+    return {
+        doc["username"]: materialize_aggregate(doc)
+        for doc in collection.find({"username": {"$in": list(increments)}})
+    }
+
+
+legacy_fields = numerical_cols + categorical_cols + [f"{col}_history" for col in categorical_cols]
+# Any document still carrying a legacy mean, mode or *_history field, whether or not
+# new-style counters have already been $inc'ed into it.
+legacy_selector = {"$or": [{field: {"$exists": True}} for field in legacy_fields]}
+
+
+def migrate_history_document(doc):
+    """Build the $inc/$unset that folds a legacy *_history document into its counters.
+
+    The legacy part is added with $inc, so counters that new submissions
+    already started on the same document are kept.
+    """
+    histories = {col: doc.get(f"{col}_history") for col in categorical_cols}
+    history_lengths = [len(h) for h in histories.values() if isinstance(h, list)]
+    # Legacy documents dropped the first submission from every history list.
+    count = max(history_lengths) + 1 if history_lengths else 1
+    increments = {"count": count}
+    for col in numerical_cols:
+        try:
+            increments[f"sums.{col}"] = float(doc.get(col) or 0) * count
+        except (TypeError, ValueError):
+            increments[f"sums.{col}"] = 0.0
+    for col in categorical_cols:
+        history = histories[col]
+        if not isinstance(history, list) or not history:
+            history = [doc.get(col)]
+        for value in history:
+            key = f"counts.{col}.{field_key(value)}"
+            increments[key] = increments.get(key, 0) + 1
+    return {
+        "$inc": increments,
+        "$currentDate": {"updated_at": True},
+        "$unset": {field: "" for field in legacy_fields}
+    }
+
+
+def migrate_aggregates(collection, batch_size=500):
+    writes = []
+    migrated = 0
+    for doc in collection.find(legacy_selector):
+        # Matching on the legacy fields again keeps a concurrent migration from folding them in twice.
+        writes.append(UpdateOne({"_id": doc["_id"], "$or": legacy_selector["$or"]}, migrate_history_document(doc)))
+        if len(writes) >= batch_size:
+            collection.bulk_write(writes, ordered=False)
+            migrated += len(writes)
+            writes = []
+    if writes:
+        collection.bulk_write(writes, ordered=False)
+        migrated += len(writes)
+    return migrated
+
+
+if __name__ == '__main__':
+    # MONGO_URI / MONGO_DB select the database, as for the service.
+    db = get_database()
+    print(f"Migrated {migrate_aggregates(db['aggregate'])} aggregate documents")
@@ -1,41 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-import pandas as pd
 import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from sklearn.metrics.pairwise import cosine_similarity
-from pymongo import MongoClient
-from collections import Counter
-from confluent_kafka import Producer
-import json
-from datetime import datetime
-
-now = datetime.now()
-month = now.strftime("%B")  # e.g., "April"
-year = now.year     
+import os
+import uuid
+import hmac
+import atexit
+import random
+from features import parse_features
+from instrumentation import MetricsRegistry, RequestProfiler, StartupReport
+from reference_index import build_reference_index
+from multi_hot import expand_multi_hot
+from snapshot import load_or_build_snapshot, stream_build, content_hash
+from neighbors import make_backend, normalize_queries, footprints_from_neighbours
+from micro_batcher import MicroBatcher
+from model_registry import ModelRegistry
+from prediction_cache import ResultCache, make_cache_backend
+
+# Optional subsystems (see features.py); their heavy dependencies are only imported when enabled,
+# so FEATURES=none gives a prediction-only service without Mongo, Kafka, pandas or sklearn.
+features = parse_features(os.environ.get("FEATURES"))
+# STRICT_NUMERIC=0 reads unparseable numeric answers as 0 instead of rejecting the request.
+STRICT_NUMERIC = os.environ.get("STRICT_NUMERIC", "1") == "1"
+# WRITE_PATH=inline stores, aggregates and analyzes each submission before /predict responds.
+# WRITE_PATH=events only scores and publishes the event; event_consumer.py does the writes.
+WRITE_PATH = os.environ.get("WRITE_PATH", "inline")
+if WRITE_PATH == "events" and "kafka" not in features:
+    raise ValueError("WRITE_PATH=events needs the kafka feature")
+startup = StartupReport(features)
+
 app = Flask(__name__)
 CORS(app)
 
-# MongoDB Setup
-client = MongoClient('mongodb://localhost:27017/')
-db = client['carbon_footprint_db']
-users_collection = db['users']
-aggregated_collection = db['aggregate']
-reduction_collection = db['reduction_insights']
-
-# Kafka Producer Setup
-kafka_conf = {
-    'bootstrap.servers': 'localhost:9092'
-}
-kafka_producer = Producer(kafka_conf)
-KAFKA_TOPIC = 'carbon-footprint-events'
-
-def kafka_delivery_callback(err, msg):
-    if err:
-        print(f"❌ Kafka Delivery Failed: {err}")
-    else:
-        print(f"✅ Kafka Message delivered to {msg.topic()} [{msg.partition()}]")
-
 # Utility Functions
 def convert_numpy_types(data):
     if isinstance(data, dict):
@@ -47,47 +42,102 @@ def convert_numpy_types(data):
     else:
         return data
 
-def calculate_aggregate(username, user_data=None):
-    if not user_data:
-        return {}
-
-    numerical_cols = [
-        "Monthly Grocery Bill", "Vehicle Monthly Distance Km", "Waste Bag Weekly Count",
-        "How Long TV PC Daily Hour", "How Many New Clothes Monthly", "How Long Internet Daily Hour"
-    ]
-    categorical_cols = [
-        "Body Type", "Sex", "Diet", "How Often Shower", "Heating Energy Source", "Transport",
-        "Vehicle Type", "Social Activity", "Frequency of Traveling by Air", "Waste Bag Size",
-        "Energy efficiency", "Recycling", "Cooking_With"
-    ]
+def prediction_event(username, user_data, predicted_footprint, month, year):
+    return {
+        "event_id": uuid.uuid4().hex,
+        "username": username,
+        "predicted_footprint": predicted_footprint,
+        "event_type": "prediction",
+        "user_data": convert_numpy_types(user_data),
+        "month": month,
+        "year": year
+    }
 
-    existing_aggregate = aggregated_collection.find_one({"username": username})
-    if existing_aggregate:
-        aggregated_data = existing_aggregate
-        for col in numerical_cols:
-            new_value = float(user_data.get(col, 0))
-            past_value = float(aggregated_data.get(col, 0))
-            aggregated_data[col] = round((past_value + new_value) / 2, 2)
-
-        for col in categorical_cols:
-            past_values = existing_aggregate.get(f"{col}_history", [])
-            new_value = user_data.get(col)
-            if not isinstance(past_values, list):
-                past_values = [past_values]
-            past_values.append(new_value)
-            aggregated_data[f"{col}_history"] = past_values
-            aggregated_data[col] = Counter(past_values).most_common(1)[0][0]
-    else:
-        aggregated_data = {"username": username}
-        for col in numerical_cols:
-            aggregated_data[col] = float(user_data.get(col, 0))
-        for col in categorical_cols:
-            aggregated_data[col] = user_data.get(col)
+# MongoDB Setup
+if "storage" in features:
+    with startup.step("storage"):
+        from db import get_database, ensure_indexes, WriteBehindBuffer
+        from aggregates import apply_aggregate, apply_aggregates_bulk
+        db = get_database()
+        ensure_indexes(db)
+        users_collection = db['users']
+        aggregated_collection = db['aggregate']
+        reduction_collection = db['reduction_insights']
+        rollups_collection = db['footprint_rollups']
+        if "trends" in features:
+            from rollups import apply_rollups, trend_options, footprint_trend
+
+    def refresh_derived(docs):
+        # Monthly/yearly rollups and reduction insights follow every stored batch of submissions.
+        # Each runs on its own, so a failed rollup write does not also skip the reductions.
+        failures = []
+        if "trends" in features:
+            try:
+                apply_rollups(rollups_collection, docs)
+            except Exception as e:
+                print(f"Rollup update for {len(docs)} submissions failed: {e}")
+                failures.append(e)
+        if "reductions" in features:
+            for username in dict.fromkeys(doc["username"] for doc in docs):
+                try:
+                    analyze_reducing_attributes(username)
+                except Exception as e:
+                    print(f"Reduction refresh for {username} failed: {e}")
+                    failures.append(e)
+        if failures:
+            # Still counted by users_writer as a failed follow-up.
+            raise failures[0]
+
+    # Prediction inserts go through the write-behind buffer (see MONGO_DURABILITY)
+    users_writer = WriteBehindBuffer(users_collection, on_flush=refresh_derived, sequences=db['user_sequences'])
+
+    def calculate_aggregate(username, user_data=None):
+        if not user_data:
+            return {}
+        return convert_numpy_types(apply_aggregate(aggregated_collection, username, user_data, STRICT_NUMERIC))
+
+    def calculate_aggregates_bulk(records):
+        return convert_numpy_types(apply_aggregates_bulk(aggregated_collection, records, STRICT_NUMERIC))
+
+if features & {"storage", "kafka"}:
+    from periods import submission_period
 
-    return convert_numpy_types(aggregated_data)
+# Kafka Producer Setup
+KAFKA_TOPIC = 'carbon-footprint-events'
+event_consumers = None
+if "kafka" in features:
+    with startup.step("kafka"):
+        from event_emitter import EventEmitter, InMemoryProducer, InMemoryBroker, InMemoryConsumer
+        kafka_conf = {
+            'bootstrap.servers': os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092"),
+            'linger.ms': 20,
+            'batch.num.messages': 1000,
+            'queue.buffering.max.messages': 100000
+        }
+        if WRITE_PATH == "events":
+            # Events are the only record of a submission: no duplicates or reordering on producer retries.
+            kafka_conf['enable.idempotence'] = True
+        # Set KAFKA_PRODUCER=memory to run without a broker; with WRITE_PATH=events the
+        # consumer workers then run in this process against an in-memory broker.
+        if os.environ.get("KAFKA_PRODUCER", "kafka") == "memory":
+            event_broker = InMemoryBroker()
+            kafka_producer = InMemoryProducer(kafka_conf, event_broker)
+            if WRITE_PATH == "events" and "storage" in features:
+                from event_consumer import ConsumerGroup, consumer_conf
+                event_consumers = ConsumerGroup(
+                    lambda: InMemoryConsumer(event_broker, consumer_conf()), db,
+                    workers=int(os.environ.get("CONSUMER_WORKERS", 2)), topic=KAFKA_TOPIC, poll_timeout=0.1
+                ).start()
+                atexit.register(event_consumers.close)
+        else:
+            from confluent_kafka import Producer
+            kafka_producer = Producer(kafka_conf)
+        event_emitter = EventEmitter(kafka_producer, KAFKA_TOPIC, max_queue_size=10000).start()
+        atexit.register(event_emitter.close)
 
 # Dataset & Preprocessing
-dataset_path = "cleaned_individual_footprint.csv"
+# REFERENCE_DATASET may also point at a raw "Carbon Emission.csv" export when REFERENCE_INGEST=stream
+dataset_path = os.environ.get("REFERENCE_DATASET", "cleaned_individual_footprint.csv")
 all_cols = [
     "Body Type", "Sex", "Diet", "How Often Shower", "Heating Energy Source",
     "Transport", "Vehicle Type", "Social Activity", "Monthly Grocery Bill",
@@ -97,53 +147,233 @@ all_cols = [
     "Total_Carbon_Footprint", "Footprint_Category"
 ]
 
+# pandas and sklearn are only needed to build a snapshot, not to serve one
 def load_data(file_path):
+    import pandas as pd
     try:
         return pd.read_csv(file_path)
     except FileNotFoundError:
         return None
 
 def preprocess_data(df):
+    from sklearn.preprocessing import LabelEncoder
     if df is None:
-        return None, None
+        return None, None, None
+    df, multi_hot = expand_multi_hot(df)
     label_encoders = {}
     categorical_cols = [col for col in all_cols if col in df.columns and df[col].dtype == 'object']
     for col in categorical_cols:
         label_encoders[col] = LabelEncoder()
         df[col] = label_encoders[col].fit_transform(df[col])
     df.fillna(0, inplace=True)
-    return df, label_encoders
+    return df, label_encoders, multi_hot
+
+def encode_new_user(user_data, encoder):
+    return encoder.encode(user_data)
+
+def encode_new_users(user_data_list, encoder):
+    return encoder.encode_batch(user_data_list)
+
+def first_unencodable(user_data_list, encoder):
+    """(position, reason) of the first record the encoder rejects, e.g. a non-numeric answer under STRICT_NUMERIC."""
+    for i, user_data in enumerate(user_data_list):
+        try:
+            encoder.encode(user_data)
+        except (TypeError, ValueError) as e:
+            return i, str(e)
+    return None
+
+def predict_carbon_footprint_batch(encoded_matrix, backend, k=1, weighted=False):
+    idx, scores = backend.search(normalize_queries(encoded_matrix), k)
+    predicted_footprints = footprints_from_neighbours(backend.index.targets, idx, scores, weighted)
+    return predicted_footprints.tolist(), idx, scores
+
+def describe_neighbours(targets, idx_row, scores_row):
+    return [
+        {"index": int(i), "similarity": float(score), "footprint": float(targets[i])}
+        for i, score in zip(idx_row, scores_row)
+    ]
 
-def compute_similarity_matrix(df):
-    if df is None:
-        return None
-    numeric_df = df.drop(columns=["Total_Carbon_Footprint", "Footprint_Category"], errors='ignore')
-    return cosine_similarity(numeric_df)
-
-def encode_new_user(user_data, label_encoders, df):
-    encoded_data = {}
-    for col in df.columns:
-        if col in label_encoders:
-            if user_data.get(col) in label_encoders[col].classes_:
-                encoded_data[col] = label_encoders[col].transform([user_data[col]])[0]
-            else:
-                encoded_data[col] = 0
-        elif col in user_data:
-            encoded_data[col] = float(user_data[col])
-        else:
-            encoded_data[col] = 0
-    return convert_numpy_types(encoded_data)
+def predict_carbon_footprint(new_user_data, backend, k=1, weighted=False):
+    predicted_footprints, idx, scores = predict_carbon_footprint_batch([new_user_data], backend, k, weighted)
+    return predicted_footprints[0], describe_neighbours(backend.index.targets, idx[0], scores[0])
 
-def predict_carbon_footprint(new_user_data, df, similarity_matrix):
-    df_numeric = df.drop(columns=["Total_Carbon_Footprint", "Footprint_Category"], errors='ignore')
-    new_user_df = pd.DataFrame([new_user_data], columns=df_numeric.columns)
-    similarity_scores = cosine_similarity(new_user_df, df_numeric)
-    most_similar_user_idx = np.argmax(similarity_scores)
-    return float(df.iloc[most_similar_user_idx]["Total_Carbon_Footprint"]), similarity_scores[0]
+def build_reference_from_csv():
+    df = load_data(dataset_path)
+    df, label_encoders, multi_hot = preprocess_data(df)
+    return build_reference_index(df, label_encoders, multi_hot)
 
-df = load_data(dataset_path)
-df, label_encoders = preprocess_data(df)
-similarity_matrix = compute_similarity_matrix(df)
+with startup.step("reference_model"):
+    # REFERENCE_INGEST=stream encodes the dataset chunk by chunk straight to disk, for sets larger than memory
+    if os.environ.get("REFERENCE_INGEST") == "stream":
+        reference_index = load_or_build_snapshot(dataset_path, all_cols, lambda: stream_build(dataset_path))
+    else:
+        reference_index = load_or_build_snapshot(dataset_path, all_cols, build_reference_from_csv)
+    if reference_index.version is None:
+        reference_index.version = content_hash(reference_index)
+
+# Nearest-neighbour search: NN_BACKEND is one of exact, balltree, quantized
+NN_BACKEND = os.environ.get("NN_BACKEND", "exact")
+NN_TOP_K = int(os.environ.get("NN_TOP_K", 1))
+NN_WEIGHTED = os.environ.get("NN_WEIGHTED", "0") == "1"
+
+def score_encoded_rows(encoded_rows, model):
+    predicted_footprints, idx, scores = predict_carbon_footprint_batch(encoded_rows, model.backend, NN_TOP_K, NN_WEIGHTED)
+    return [
+        (predicted_footprint, describe_neighbours(model.backend.index.targets, idx[n], scores[n]))
+        for n, predicted_footprint in enumerate(predicted_footprints)
+    ]
+
+def score_model_rows(items):
+    # A window can straddle a model swap: each row is scored by the model its request holds.
+    rows_by_model = {}
+    for n, (model, encoded_row) in enumerate(items):
+        rows_by_model.setdefault(model, []).append(n)
+    results = [None] * len(items)
+    for model, positions in rows_by_model.items():
+        for n, result in zip(positions, score_encoded_rows([items[n][1] for n in positions], model)):
+            results[n] = result
+    return results
+
+# Concurrent /predict calls share one search per window (PREDICT_BATCH_MAX_WAIT_US=0 disables waiting)
+predict_batcher = MicroBatcher(
+    score_model_rows,
+    max_batch_size=int(os.environ.get("PREDICT_BATCH_MAX_SIZE", 64)),
+    max_wait_us=int(os.environ.get("PREDICT_BATCH_MAX_WAIT_US", 500))
+).start()
+atexit.register(predict_batcher.close)
+
+# Result caches, scoped to the reference version; CACHE_URL=redis://... shares them between workers
+CACHE_URL = os.environ.get("CACHE_URL")
+reference_version = reference_index.version
+prediction_cache = ResultCache(make_cache_backend(
+    CACHE_URL,
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("PREDICTION_CACHE_TTL", 3600)),
+    prefix="prediction"
+), reference_version)
+recommendation_cache = ResultCache(make_cache_backend(
+    CACHE_URL,
+    max_entries=int(os.environ.get("RECOMMENDATION_CACHE_SIZE", 2000)),
+    ttl=float(os.environ.get("RECOMMENDATION_CACHE_TTL", 30)),
+    prefix="recommendation"
+), reference_version)
+
+def swap_cache_versions(model):
+    prediction_cache.set_version(model.version)
+    recommendation_cache.set_version(model.version)
+
+# Reference model registry: POST /admin/reload or a new snapshot published to CURRENT
+# (checked every MODEL_WATCH_INTERVAL seconds, 0 disables) swaps it in without downtime.
+# The /admin routes are refused unless ADMIN_TOKEN is set and sent as X-Admin-Token.
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", 30))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+with startup.step("nn_backend"):
+    model_registry = ModelRegistry(
+        all_cols, lambda index: make_backend(NN_BACKEND, index),
+        on_swap=swap_cache_versions, strict_numeric=STRICT_NUMERIC
+    )
+    model_registry.install(reference_index)
+if MODEL_WATCH_INTERVAL > 0:
+    model_registry.start_watch(MODEL_WATCH_INTERVAL)
+
+def prediction_key(model, encoded_user_data):
+    return prediction_cache.key(model.version, encoded_user_data, NN_BACKEND, NN_TOP_K, NN_WEIGHTED)
+
+def predict_cached(model, encoded_user_data):
+    key = prediction_key(model, encoded_user_data)
+    result = prediction_cache.get(key)
+    if result is None:
+        result = predict_batcher((model, encoded_user_data))
+        prediction_cache.set(key, result)
+    return result
+
+def predict_cached_batch(model, encoded_matrix):
+    keys = [prediction_key(model, row) for row in encoded_matrix]
+    results = [prediction_cache.get(key) for key in keys]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        for i, result in zip(misses, score_encoded_rows(encoded_matrix[misses], model)):
+            prediction_cache.set(keys[i], result)
+            results[i] = result
+    return results
+
+if "reductions" in features:
+    with startup.step("reductions"):
+        from reduction_tracker import ReductionTracker
+        reduction_tracker = ReductionTracker(users_collection, reduction_collection)
+
+    def analyze_reducing_attributes(username):
+        return reduction_tracker.update(username)
+
+if "recommendations" in features:
+    with startup.step("recommendations"):
+        from aggregates import (
+            materialize_aggregate, numerical_cols as aggregate_numerical_cols,
+            categorical_cols as aggregate_categorical_cols
+        )
+        from user_index import UserVectorIndex
+        from reduction_tracker import recommend_actions
+        # Similar-user index, built once and kept current on every aggregate upsert
+        user_index = UserVectorIndex.from_collection(
+            aggregated_collection, aggregate_numerical_cols, aggregate_categorical_cols, transform=materialize_aggregate
+        )
+        # Setting the returned event stops the background sync.
+        user_index_sync = user_index.start_sync(aggregated_collection, transform=materialize_aggregate)
+        atexit.register(user_index_sync.set)
+
+    def recommend_cached(similar_usernames):
+        key = recommendation_cache.key(*similar_usernames)
+        recommended_actions = recommendation_cache.get(key)
+        if recommended_actions is None:
+            reduction_entries = list(reduction_collection.find({"username": {"$in": similar_usernames}})) if similar_usernames else []
+            recommended_actions = recommend_actions(similar_usernames, reduction_entries)
+            recommendation_cache.set(key, recommended_actions)
+        return recommended_actions
+
+# Instrumentation: stage histograms on /metrics. A Server-Timing header is added for
+# TRACE_SAMPLE_RATE of requests (or any request sent with "X-Trace: 1"), and
+# PROFILE_SAMPLE_RATE of requests are cProfiled into PROFILE_DIR.
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+metrics_registry = MetricsRegistry()
+metrics_registry.add_gauges("predict_batcher", predict_batcher.metrics)
+metrics_registry.add_gauges("prediction_cache", prediction_cache.metrics)
+if "recommendations" in features:
+    metrics_registry.add_gauges("recommendation_cache", recommendation_cache.metrics)
+if "kafka" in features:
+    metrics_registry.add_gauges("events", event_emitter.metrics)
+if "storage" in features:
+    metrics_registry.add_gauges("users_writer", users_writer.metrics)
+if event_consumers is not None:
+    metrics_registry.add_gauges("consumer", event_consumers.metrics)
+metrics_registry.add_gauges("model", model_registry.status)
+request_profiler = RequestProfiler(
+    float(os.environ.get("PROFILE_SAMPLE_RATE", 0)), os.environ.get("PROFILE_DIR", "profiles")
+)
+
+@app.before_request
+def start_trace():
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    sampled = request.headers.get("X-Trace") == "1" or random.random() < TRACE_SAMPLE_RATE
+    g.trace = metrics_registry.trace(route, sampled)
+    g.profile = request_profiler.start()
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        trace.finish(response.status_code)
+        if trace.sampled:
+            response.headers["Server-Timing"] = trace.server_timing()
+            response.headers["X-Trace-Id"] = trace.trace_id
+    return response
+
+@app.teardown_request
+def finish_profile(error=None):
+    # after_request is skipped when a view raises; teardown always runs, so the profiler is released.
+    profile = g.pop("profile", None)
+    if profile is not None:
+        request_profiler.stop(profile, request.url_rule.rule if request.url_rule else "unmatched")
 
 # Routes
 @app.route('/predict', methods=['POST'])
@@ -155,146 +385,235 @@ def predict_carbon():
         if not user_data or not username:
             return jsonify({"error": "Invalid input"}), 400
 
-        encoded_user_data = encode_new_user(user_data, label_encoders, df)
-        predicted_footprint, similarity_scores = predict_carbon_footprint(encoded_user_data, df, similarity_matrix)
-
-        # Store to Mongo
-        users_collection.insert_one({
-            "username": username,
-            "user_data": convert_numpy_types(user_data),
-            "predicted_footprint": predicted_footprint,
-            "month": month,
-    "year": year
-        })
-
-        # Send to Kafka
-        kafka_event = {
-            "username": username,
+        trace = g.trace
+        with model_registry.acquire() as model:
+            with trace.span("encode"):
+                encoded_user_data = encode_new_user(user_data, model.encoder)
+            with trace.span("predict"):
+                predicted_footprint, neighbours = predict_cached(model, encoded_user_data)
+
+        aggregated_data = None
+        if features & {"storage", "kafka"}:
+            month, year = submission_period()
+            kafka_event = prediction_event(username, user_data, predicted_footprint, month, year)
+        if WRITE_PATH == "events":
+            with trace.span("emit"):
+                if not event_emitter.emit(username, kafka_event):
+                    return jsonify({"error": "Event queue full, retry later"}), 503
+        else:
+            if "storage" in features:
+                # Store to Mongo
+                with trace.span("store"):
+                    users_writer.insert({
+                        "username": username,
+                        "user_data": convert_numpy_types(user_data),
+                        "predicted_footprint": predicted_footprint,
+                        "month": month,
+                        "year": year
+                    })
+
+            if "kafka" in features:
+                # Send to Kafka
+                with trace.span("emit"):
+                    event_emitter.emit(username, kafka_event)
+
+            if "storage" in features:
+                with trace.span("aggregate"):
+                    aggregated_data = calculate_aggregate(username, user_data)
+
+        response = {
             "predicted_footprint": predicted_footprint,
-            "event_type": "prediction",
-            "user_data": convert_numpy_types(user_data)
+            "model_version": model.version
         }
-        kafka_producer.produce(KAFKA_TOPIC, key=username, value=json.dumps(kafka_event), callback=kafka_delivery_callback)
-        kafka_producer.flush()
-
-        aggregated_data = calculate_aggregate(username, user_data)
-        aggregated_collection.update_one(
-            {"username": username},
-            {"$set": aggregated_data},
-            upsert=True
-        )
+        if "recommendations" in features:
+            # In events mode the user's vector catches up once the consumer has updated the aggregate.
+            with trace.span("similar_users"):
+                if aggregated_data is not None:
+                    user_index.update(username, aggregated_data)
+                similar_usernames = user_index.top_k(username, k=3)
+            with trace.span("recommendations"):
+                response["recommendations"] = recommend_cached(similar_usernames)
+        if NN_TOP_K > 1:
+            response["neighbours"] = neighbours
+        return jsonify(response)
 
-        similar_users_recommendations = []
-        all_users = list(aggregated_collection.find({"username": {"$ne": username}}))
-        if all_users:
-            agg_df = pd.DataFrame(all_users)
-            usernames_list = agg_df["username"].tolist()
-            agg_df = agg_df.drop(columns=["username", "_id"], errors="ignore")
-            for col in agg_df.columns:
-                agg_df[col] = agg_df[col].apply(lambda x: Counter(x).most_common(1)[0][0] if isinstance(x, list) else x)
-
-            current_agg = aggregated_data.copy()
-            current_agg.pop("username", None)
-            current_agg = {k: Counter(v).most_common(1)[0][0] if isinstance(v, list) else v for k, v in current_agg.items()}
-            current_df = pd.DataFrame([current_agg])
-            full_df = pd.concat([agg_df, current_df], ignore_index=True)
-
-            for col in full_df.columns:
-                if full_df[col].dtype == object:
-                    le = LabelEncoder()
-                    full_df[col] = le.fit_transform(full_df[col].astype(str))
-
-            sim_matrix = cosine_similarity(full_df)
-            current_user_index = len(full_df) - 1
-            sim_scores = list(enumerate(sim_matrix[current_user_index][:-1]))
-            top_similar = sorted(sim_scores, key=lambda x: x[1], reverse=True)[:3]
-            similar_usernames = [usernames_list[idx] for idx, _ in top_similar]
-
-            for sim_user in similar_usernames:
-                reduction_entry = reduction_collection.find_one({"username": sim_user})
-                if reduction_entry:
-                    for item in reduction_entry.get("reducing_attributes", []):
-                        for attr, _ in item.items():
-                            similar_users_recommendations.append(attr)
-
-        recommended_actions = [
-            {"attribute": attr, "count": count}
-            for attr, count in Counter(similar_users_recommendations).most_common(5)
-        ]
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_carbon_batch():
+    try:
+        records = request.json.get("records", [])
+        if not records or not isinstance(records, list):
+            return jsonify({"error": "Invalid input"}), 400
+        for i, record in enumerate(records):
+            user_data = record.get("user_data") if isinstance(record, dict) else None
+            if not user_data or not isinstance(user_data, dict) or not record.get("username"):
+                return jsonify({"error": f"Invalid input at record {i}"}), 400
+
+        trace = g.trace
+        with model_registry.acquire() as model:
+            with trace.span("encode"):
+                user_data_list = [record["user_data"] for record in records]
+                try:
+                    encoded_matrix = encode_new_users(user_data_list, model.encoder)
+                except (TypeError, ValueError):
+                    # Encode record by record only on failure, to report which one is malformed.
+                    i, reason = first_unencodable(user_data_list, model.encoder)
+                    return jsonify({"error": f"Invalid input at record {i}: {reason}"}), 400
+            with trace.span("predict"):
+                predicted_footprints = [result[0] for result in predict_cached_batch(model, encoded_matrix)]
+
+        if features & {"storage", "kafka"}:
+            month, year = submission_period()
+        if WRITE_PATH == "events":
+            with trace.span("emit"):
+                queued = [
+                    event_emitter.emit(record["username"], prediction_event(
+                        record["username"], record["user_data"], predicted_footprint, month, year
+                    ))
+                    for record, predicted_footprint in zip(records, predicted_footprints)
+                ]
+            if not any(queued):
+                return jsonify({"error": "Event queue full, retry later"}), 503
+            return jsonify({
+                "results": [
+                    {"username": record["username"], "predicted_footprint": predicted_footprint, "queued": ok}
+                    for record, predicted_footprint, ok in zip(records, predicted_footprints, queued)
+                ],
+                "model_version": model.version
+            })
+
+        if "storage" in features:
+            with trace.span("store"):
+                users_writer.insert_many([
+                    {
+                        "username": record["username"],
+                        "user_data": convert_numpy_types(record["user_data"]),
+                        "predicted_footprint": predicted_footprint,
+                        "month": month,
+                        "year": year
+                    }
+                    for record, predicted_footprint in zip(records, predicted_footprints)
+                ])
+
+        if "kafka" in features:
+            with trace.span("emit"):
+                for record, predicted_footprint in zip(records, predicted_footprints):
+                    kafka_event = prediction_event(record["username"], record["user_data"], predicted_footprint, month, year)
+                    event_emitter.emit(record["username"], kafka_event)
+
+        if "storage" in features:
+            with trace.span("aggregate"):
+                aggregates = calculate_aggregates_bulk(records)
+            if "recommendations" in features:
+                with trace.span("similar_users"):
+                    for username, aggregated_data in aggregates.items():
+                        user_index.update(username, aggregated_data)
 
         return jsonify({
-            "predicted_footprint": predicted_footprint,
-            "recommendations": recommended_actions
+            "results": [
+                {"username": record["username"], "predicted_footprint": predicted_footprint}
+                for record, predicted_footprint in zip(records, predicted_footprints)
+            ],
+            "model_version": model.version
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/analyze_reduction/<username>', methods=['GET'])
-def analyze_reduction(username):
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/predict/metrics', methods=['GET'])
+def predict_metrics():
+    return jsonify(predict_batcher.metrics())
+
+@app.route('/cache/metrics', methods=['GET'])
+def cache_metrics():
+    return jsonify({
+        "prediction": prediction_cache.metrics(),
+        "recommendation": recommendation_cache.metrics()
+    })
+
+def admin_token_valid(token):
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def admin_authorized():
+    return admin_token_valid(request.headers.get("X-Admin-Token"))
+
+@app.route('/admin/model', methods=['GET'])
+def model_status():
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(model_registry.status())
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_model():
+    # Loads in the background; poll /admin/model for the outcome.
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    body = request.get_json(silent=True) or {}
     try:
-        analyze_reducing_attributes(username)
-        result = reduction_collection.find_one({"username": username}, {"_id": 0})
-        if result:
-            return jsonify(result)
-        else:
-            return jsonify({"message": "No reduction data found for this user."}), 404
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        started = model_registry.reload_async(body.get("version"), bool(body.get("force")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not started:
+        return jsonify({"error": "A reload is already in progress"}), 409
+    return jsonify({"reloading": body.get("version") or "CURRENT", "serving": model_registry.current.version}), 202
+
+@app.route('/admin/startup', methods=['GET'])
+def startup_status():
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(startup.summary())
+
+if "kafka" in features:
+    @app.route('/events/metrics', methods=['GET'])
+    def event_metrics():
+        return jsonify(event_emitter.metrics())
+
+if "trends" in features:
+    def trend_response(username):
+        # Answered from the precomputed rollups; ?period=month|year&limit=12&by=<categorical column>
+        try:
+            options = trend_options(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({
+            "username": username,
+            "period": options["period"],
+            "buckets": footprint_trend(rollups_collection, username, **options)
+        })
 
-def analyze_reducing_attributes(username):
-    user_entries = list(users_collection.find({"username": username}))
-    if len(user_entries) < 2:
-        return
-
-    user_entries.sort(key=lambda x: x['_id'])
-    total_reduction = 0
-    reducing_feature_contributions = {}
-
-    for i in range(len(user_entries)):
-        for j in range(i + 1, len(user_entries)):
-            entry_i = user_entries[i]
-            entry_j = user_entries[j]
-            fp_i = float(entry_i.get("predicted_footprint", 0))
-            fp_j = float(entry_j.get("predicted_footprint", 0))
-
-            if fp_j < fp_i:
-                reduction_amount = round(fp_i - fp_j, 2)
-                total_reduction += reduction_amount
-
-                data_i = entry_i.get("user_data", {})
-                data_j = entry_j.get("user_data", {})
-
-                for key in data_j:
-                    if key == "Sex":
-                        continue
-
-                    val_i = data_i.get(key)
-                    val_j = data_j.get(key)
-
-                    try:
-                        if float(val_i) != float(val_j):
-                            reducing_feature_contributions[key] = reducing_feature_contributions.get(key, 0) + reduction_amount
-                    except:
-                        if str(val_i).strip().lower() != str(val_j).strip().lower():
-                            reducing_feature_contributions[key] = reducing_feature_contributions.get(key, 0) + reduction_amount
-
-    percent_features = [
-        {k: round((v / total_reduction) * 100, 2)}
-        for k, v in sorted(reducing_feature_contributions.items(), key=lambda x: -x[1])[:5]
-    ] if total_reduction > 0 else []
-
-    reduction_collection.update_one(
-        {"username": username},
-        {
-            "$set": {
-                "username": username,
-                "reduced_amount": round(total_reduction, 2),
-                "reducing_attributes": percent_features
-            }
-        },
-        upsert=True
-    )
+    @app.route('/trends', methods=['GET'])
+    def global_trend():
+        return trend_response(None)
+
+    @app.route('/trends/<username>', methods=['GET'])
+    def user_trend(username):
+        return trend_response(username)
+
+if "reductions" in features:
+    @app.route('/analyze_reduction/<username>', methods=['GET'])
+    def analyze_reduction(username):
+        try:
+            trace = g.trace
+            with trace.span("reduction_lookup"):
+                result = reduction_collection.find_one({"username": username}, {"_id": 0})
+            if not result:
+                with trace.span("analyze_reduction"):
+                    if analyze_reducing_attributes(username):
+                        result = reduction_collection.find_one({"username": username}, {"_id": 0})
+            if result:
+                return jsonify(result)
+            else:
+                return jsonify({"message": "No reduction data found for this user."}), 404
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+startup.finish()
 
 if __name__ == '__main__':
     app.run(port=5001)
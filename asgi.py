@@ -0,0 +1,330 @@
+"""ASGI entry point for the prediction API.
+
+Serves the same /predict and /analyze_reduction/<username> contracts as
+app.py, but Mongo calls are awaited and nearest-neighbour search goes
+through the shared micro-batcher without blocking the event loop.
+
+    uvicorn asgi:app --port 5001 --workers 4
+"""
+import os
+import json
+import random
+import asyncio
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+import app as service
+
+features = service.features
+if "trends" in features:
+    from rollups import trend_options, footprint_trend
+
+WORKER_THREADS = int(os.environ.get("ASGI_WORKER_THREADS", os.cpu_count() or 4))
+
+worker_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="asgi-worker")
+
+
+async def offload(fn, *args):
+    """Run CPU-bound or blocking work on the worker pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(worker_pool, lambda: fn(*args))
+
+
+class AsyncCursor:
+    def __init__(self, cursor, executor):
+        self._cursor = cursor
+        self._executor = executor
+
+    async def to_list(self, length=None):
+        loop = asyncio.get_running_loop()
+        cursor = self._cursor.limit(length) if length else self._cursor
+        return await loop.run_in_executor(self._executor, list, cursor)
+
+
+class AsyncCollection:
+    """Awaitable wrapper over a pymongo (or mongomock) collection, for when motor is unavailable."""
+
+    def __init__(self, collection, executor):
+        self._collection = collection
+        self._executor = executor
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: method(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs):
+        return await self._call(self._collection.find_one, *args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self._collection.find(*args, **kwargs), self._executor)
+
+
+def async_database():
+    from db import MONGO_URI, MONGO_DB, mongo_pool_options
+    try:
+        if MONGO_URI.startswith("mongomock://"):
+            raise ImportError
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        io_pool = ThreadPoolExecutor(max_workers=mongo_pool_options["maxPoolSize"], thread_name_prefix="mongo-io")
+        return lambda name: AsyncCollection(service.db[name], io_pool)
+    motor_db = AsyncIOMotorClient(MONGO_URI, **mongo_pool_options)[MONGO_DB]
+    return lambda name: motor_db[name]
+
+
+if "storage" in features:
+    collection = async_database()
+    reduction_collection = collection('reduction_insights')
+
+
+async def store_submission(username, user_data, predicted_footprint, month, year, event, trace):
+    """The inline write path, through the same helpers as app.py; returns the new aggregate.
+
+    users_writer applies MONGO_DURABILITY and refreshes rollups and
+    reductions after the insert; calculate_aggregate handles upsert races.
+    """
+    with trace.span("store"):
+        await offload(service.users_writer.insert, {
+            "username": username,
+            "user_data": user_data,
+            "predicted_footprint": predicted_footprint,
+            "month": month,
+            "year": year
+        })
+
+    if "kafka" in features:
+        with trace.span("emit"):
+            service.event_emitter.emit(username, event)
+
+    with trace.span("aggregate"):
+        return await offload(service.calculate_aggregate, username, user_data)
+
+
+async def cache_get(cache, key):
+    # Redis lookups are network round trips; the in-process LRU is cheaper to call inline.
+    if cache.backend.blocking:
+        return await offload(cache.get, key)
+    return cache.get(key)
+
+
+async def cache_set(cache, key, value):
+    if cache.backend.blocking:
+        await offload(cache.set, key, value)
+    else:
+        cache.set(key, value)
+
+
+def similar_users(username, aggregated_data):
+    if aggregated_data is not None:
+        service.user_index.update(username, aggregated_data)
+    return service.user_index.top_k(username, k=3)
+
+
+async def recommend(username, aggregated_data, trace):
+    with trace.span("similar_users"):
+        similar_usernames = await offload(similar_users, username, aggregated_data)
+    with trace.span("recommendations"):
+        recommendation_key = service.recommendation_cache.key(*similar_usernames)
+        recommended_actions = await cache_get(service.recommendation_cache, recommendation_key)
+        if recommended_actions is None:
+            reduction_entries = await reduction_collection.find({"username": {"$in": similar_usernames}}).to_list(None) if similar_usernames else []
+            recommended_actions = service.recommend_actions(similar_usernames, reduction_entries)
+            await cache_set(service.recommendation_cache, recommendation_key, recommended_actions)
+    return recommended_actions
+
+
+async def predict_carbon(body, trace):
+    user_data = body.get("user_data", {})
+    username = body.get("username", "")
+    if not user_data or not username:
+        return 400, {"error": "Invalid input"}
+
+    with service.model_registry.acquire() as model:
+        with trace.span("encode"):
+            encoded_user_data = await offload(service.encode_new_user, user_data, model.encoder)
+        with trace.span("predict"):
+            key = service.prediction_key(model, encoded_user_data)
+            cached = await cache_get(service.prediction_cache, key)
+            if cached is None:
+                cached = await asyncio.wrap_future(service.predict_batcher.submit((model, encoded_user_data)))
+                await cache_set(service.prediction_cache, key, cached)
+            predicted_footprint, neighbours = cached
+    user_data = service.convert_numpy_types(user_data)
+    aggregated_data = None
+    if features & {"storage", "kafka"}:
+        month, year = service.submission_period()
+        event = service.prediction_event(username, user_data, predicted_footprint, month, year)
+
+    if service.WRITE_PATH == "events":
+        with trace.span("emit"):
+            if not service.event_emitter.emit(username, event):
+                return 503, {"error": "Event queue full, retry later"}
+    elif "storage" in features:
+        aggregated_data = await store_submission(username, user_data, predicted_footprint, month, year, event, trace)
+    elif "kafka" in features:
+        with trace.span("emit"):
+            service.event_emitter.emit(username, event)
+
+    response = {
+        "predicted_footprint": predicted_footprint,
+        "model_version": model.version
+    }
+    if "recommendations" in features:
+        response["recommendations"] = await recommend(username, aggregated_data, trace)
+    if service.NN_TOP_K > 1:
+        response["neighbours"] = neighbours
+    return 200, response
+
+
+async def analyze_reduction(username, trace):
+    with trace.span("reduction_lookup"):
+        result = await reduction_collection.find_one({"username": username}, {"_id": 0})
+    if not result:
+        with trace.span("analyze_reduction"):
+            if await offload(service.analyze_reducing_attributes, username):
+                result = await reduction_collection.find_one({"username": username}, {"_id": 0})
+    if result:
+        return 200, result
+    return 404, {"message": "No reduction data found for this user."}
+
+
+async def trend(username, query_string):
+    try:
+        options = trend_options(dict(parse_qsl(query_string.decode())))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    buckets = await offload(lambda: footprint_trend(service.rollups_collection, username, **options))
+    return 200, {"username": username, "period": options["period"], "buckets": buckets}
+
+
+def reload_model(body):
+    try:
+        started = service.model_registry.reload_async(body.get("version"), bool(body.get("force")))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    if not started:
+        return 409, {"error": "A reload is already in progress"}
+    return 202, {"reloading": body.get("version") or "CURRENT", "serving": service.model_registry.current.version}
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+cors_headers = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type, X-Admin-Token"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+]
+
+
+async def send_body(send, status, body, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())] + cors_headers + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, payload, headers=()):
+    await send_body(send, status, json.dumps(payload, default=str).encode(), b"application/json", headers)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            service.predict_batcher.close()
+            if "kafka" in features:
+                service.event_emitter.close()
+            if "storage" in features:
+                service.users_writer.close()
+            if "recommendations" in features:
+                service.user_index_sync.set()
+            worker_pool.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def route_of(method, path):
+    if path.startswith("/analyze_reduction/") and "reductions" in features:
+        return "/analyze_reduction/<username>"
+    if path.startswith("/trends/") and "trends" in features:
+        return "/trends/<username>"
+    if path == "/trends" and "trends" in features:
+        return path
+    if path in ("/predict", "/predict/metrics", "/cache/metrics", "/metrics", "/admin/model", "/admin/reload", "/admin/startup"):
+        return path
+    return "unmatched"
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS":
+        await send({"type": "http.response.start", "status": 204, "headers": cors_headers})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    if path == "/metrics" and method == "GET":
+        return await send_body(send, 200, service.metrics_registry.render().encode(), b"text/plain; version=0.0.4")
+
+    request_headers = dict(scope.get("headers", []))
+    sampled = request_headers.get(b"x-trace") == b"1" or random.random() < service.TRACE_SAMPLE_RATE
+    route = route_of(method, path)
+    trace = service.metrics_registry.trace(route, sampled)
+    admin_token = request_headers.get(b"x-admin-token")
+    admin_authorized = service.admin_token_valid(admin_token.decode("latin-1") if admin_token else None)
+    try:
+        if path in ("/predict", "/admin/reload") and method == "POST":
+            try:
+                body = json.loads(await read_body(receive) or b"{}")
+            except ValueError:
+                body = None
+            if path == "/admin/reload" and not admin_authorized:
+                status, payload = 401, {"error": "Unauthorized"}
+            elif body is None:
+                status, payload = 400, {"error": "Invalid JSON"}
+            elif path == "/admin/reload":
+                status, payload = reload_model(body)
+            else:
+                status, payload = await predict_carbon(body, trace)
+        elif path in ("/admin/model", "/admin/startup") and method == "GET":
+            if not admin_authorized:
+                status, payload = 401, {"error": "Unauthorized"}
+            elif path == "/admin/model":
+                status, payload = 200, service.model_registry.status()
+            else:
+                status, payload = 200, service.startup.summary()
+        elif path == "/predict/metrics" and method == "GET":
+            status, payload = 200, service.predict_batcher.metrics()
+        elif path == "/cache/metrics" and method == "GET":
+            status, payload = 200, {
+                "prediction": service.prediction_cache.metrics(),
+                "recommendation": service.recommendation_cache.metrics()
+            }
+        elif route == "/trends" and method == "GET":
+            status, payload = await trend(None, scope.get("query_string", b""))
+        elif route == "/trends/<username>" and method == "GET":
+            status, payload = await trend(path[len("/trends/"):], scope.get("query_string", b""))
+        elif route == "/analyze_reduction/<username>" and method == "GET":
+            status, payload = await analyze_reduction(path[len("/analyze_reduction/"):], trace)
+        else:
+            status, payload = 404, {"error": "Not found"}
+    except Exception as e:
+        status, payload = 500, {"error": str(e)}
+    trace.finish(status)
+    headers = []
+    if trace.sampled:
+        headers = [(b"server-timing", trace.server_timing().encode()), (b"x-trace-id", trace.trace_id.encode())]
+    await send_json(send, status, payload, headers)
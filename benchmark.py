@@ -0,0 +1,272 @@
+"""Latency/throughput benchmark for the prediction and recommendation hot paths.
+
+Builds a synthetic reference block and synthetic submission histories from
+the questionnaire schema, runs every stage against in-memory Mongo and Kafka
+stand-ins, and writes p50/p99 latency, throughput and peak RSS as JSON:
+
+    python benchmark.py --reference-rows 100000 --users 10000 --output baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+from encoder import CompiledEncoder
+from reference_index import ReferenceIndex, normalize_rows
+from neighbors import make_backend, normalize_queries, footprints_from_neighbours
+from multi_hot import MULTI_HOT_COLS, item_column, parse_items
+from aggregates import (
+    numerical_cols, categorical_cols, apply_aggregate, apply_aggregates_bulk, materialize_aggregate
+)
+from db import get_client, ensure_indexes, assign_sequences
+from event_emitter import EventEmitter, InMemoryProducer
+from user_index import UserVectorIndex
+from reduction_tracker import ReductionTracker, recommend_actions
+from instrumentation import peak_rss_mb
+
+operations = [
+    "encode_new_user", "predict_carbon_footprint", "predict_carbon_footprint_batch",
+    "calculate_aggregate", "similar_users", "analyze_reducing_attributes", "emit_event"
+]
+
+
+def load_schema(dataset_path):
+    """Column order, vocabularies and numeric ranges, from the dataset when it is available."""
+    columns = [col for col in categorical_cols if col not in MULTI_HOT_COLS] + numerical_cols + MULTI_HOT_COLS
+    vocabularies = {col: [f"{col} {i}" for i in range(4)] for col in categorical_cols if col not in MULTI_HOT_COLS}
+    multi_hot = {col: [f"item {i}" for i in range(5)] for col in MULTI_HOT_COLS}
+    ranges = {col: (0.0, 100.0) for col in numerical_cols}
+    target_range = (500.0, 5000.0)
+    if dataset_path and os.path.exists(dataset_path):
+        import pandas as pd
+        df = pd.read_csv(dataset_path)
+        columns = [col for col in df.columns if col in vocabularies or col in ranges or col in multi_hot]
+        for col in vocabularies:
+            if col in df.columns:
+                vocabularies[col] = sorted(str(value) for value in df[col].dropna().unique())
+        for col in multi_hot:
+            if col in df.columns:
+                multi_hot[col] = sorted({item for value in df[col].dropna() for item in parse_items(value)})
+        for col in ranges:
+            if col in df.columns:
+                ranges[col] = (float(df[col].min()), float(df[col].max()))
+        if "Total_Carbon_Footprint" in df.columns:
+            target_range = (float(df["Total_Carbon_Footprint"].min()), float(df["Total_Carbon_Footprint"].max()))
+    return columns, vocabularies, multi_hot, ranges, target_range
+
+
+def expanded_columns(columns, multi_hot):
+    expanded = []
+    for col in columns:
+        if col in multi_hot:
+            expanded.extend(item_column(col, item) for item in multi_hot[col])
+        else:
+            expanded.append(col)
+    return expanded
+
+
+def synthetic_reference(schema, rows, rng, chunk_size=500000):
+    columns, vocabularies, multi_hot, ranges, target_range = schema
+    feature_columns = expanded_columns(columns, multi_hot)
+    features = np.empty((rows, len(feature_columns)), dtype=np.float32)
+    for start in range(0, rows, chunk_size):
+        block = features[start:start + chunk_size]
+        j = 0
+        for col in columns:
+            if col in multi_hot:
+                width = len(multi_hot[col])
+                block[:, j:j + width] = rng.random((len(block), width)) < 0.4
+                j += width
+            else:
+                if col in vocabularies:
+                    block[:, j] = rng.integers(len(vocabularies[col]), size=len(block))
+                else:
+                    block[:, j] = rng.uniform(*ranges[col], size=len(block))
+                j += 1
+        normalize_rows(block)
+    targets = rng.uniform(*target_range, size=rows).astype(np.float32)
+    encoder = CompiledEncoder(feature_columns, vocabularies, multi_hot=multi_hot)
+    return ReferenceIndex(features, targets, feature_columns, encoder, version="synthetic")
+
+
+def synthetic_user_data(schema, rng):
+    columns, vocabularies, multi_hot, ranges, _ = schema
+    user_data = {}
+    for col in columns:
+        if col in multi_hot:
+            items = [item for item in multi_hot[col] if rng.random() < 0.4]
+            # Requests send both real lists and their string form.
+            user_data[col] = items if rng.random() < 0.5 else str(items)
+        elif col in vocabularies:
+            user_data[col] = vocabularies[col][rng.integers(len(vocabularies[col]))]
+        else:
+            user_data[col] = round(float(rng.uniform(*ranges[col])), 1)
+    return user_data
+
+
+def synthetic_histories(db, schema, users, submissions_per_user, rng, chunk_size=10000):
+    users_collection = db["users"]
+    docs = []
+
+    def flush():
+        users_collection.insert_many(assign_sequences(db["user_sequences"], docs), ordered=False)
+        apply_aggregates_bulk(db["aggregate"], docs)
+        docs.clear()
+
+    for n in range(submissions_per_user):
+        for u in range(users):
+            docs.append({
+                "username": f"user{u}",
+                "user_data": synthetic_user_data(schema, rng),
+                "predicted_footprint": float(rng.uniform(*schema[4])),
+                "month": "January",
+                "year": 2024 + n // 12
+            })
+            if len(docs) >= chunk_size:
+                flush()
+    if docs:
+        flush()
+
+
+def measure(fn, prepare, iterations, warmup, rows_per_call=1):
+    for i in range(warmup):
+        fn(prepare(i))
+    samples = np.empty(iterations, dtype=np.float64)
+    for i in range(iterations):
+        args = prepare(warmup + i)
+        started = time.perf_counter_ns()
+        fn(args)
+        samples[i] = time.perf_counter_ns() - started
+    total_seconds = samples.sum() / 1e9
+    result = {
+        "iterations": iterations,
+        "p50_us": round(float(np.percentile(samples, 50)) / 1e3, 2),
+        "p99_us": round(float(np.percentile(samples, 99)) / 1e3, 2),
+        "mean_us": round(float(samples.mean()) / 1e3, 2),
+        "max_us": round(float(samples.max()) / 1e3, 2),
+        "throughput_per_s": round(iterations / total_seconds, 1) if total_seconds else None,
+    }
+    if rows_per_call > 1:
+        result["rows_per_call"] = rows_per_call
+        result["rows_per_s"] = round(iterations * rows_per_call / total_seconds, 1) if total_seconds else None
+    return result
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    report = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "setup_seconds": {},
+        "results": {},
+    }
+
+    def stage(name, fn):
+        started = time.perf_counter()
+        value = fn()
+        report["setup_seconds"][name] = round(time.perf_counter() - started, 3)
+        print(f"{name}: {report['setup_seconds'][name]}s", file=sys.stderr)
+        return value
+
+    schema = stage("schema", lambda: load_schema(args.dataset))
+    index = stage("reference", lambda: synthetic_reference(schema, args.reference_rows, rng))
+    backend = stage("backend", lambda: make_backend(args.backend, index))
+
+    db = get_client("mongomock://")["benchmark"]
+    for name in ("users", "aggregate", "reduction_insights"):
+        db.drop_collection(name)
+    ensure_indexes(db)
+    stage("histories", lambda: synthetic_histories(db, schema, args.users, args.submissions_per_user, rng))
+    tracker = ReductionTracker(db["users"], db["reduction_insights"])
+    stage("reductions", tracker.rebuild_all)
+    user_index = stage("user_index", lambda: UserVectorIndex.from_collection(
+        db["aggregate"], numerical_cols, categorical_cols, transform=materialize_aggregate
+    ))
+    emitter = EventEmitter(InMemoryProducer(), "benchmark-events", max_queue_size=100000).start()
+
+    queries = [synthetic_user_data(schema, rng) for _ in range(args.query_pool)]
+    encoded = index.encoder.encode_batch(queries)
+    usernames = [f"user{u}" for u in rng.integers(args.users, size=args.query_pool)]
+    aggregates = {
+        doc["username"]: materialize_aggregate(doc)
+        for doc in db["aggregate"].find({"username": {"$in": list(set(usernames))}})
+    }
+
+    def predict_one(row):
+        idx, scores = backend.search(normalize_queries(row), args.k)
+        return footprints_from_neighbours(index.targets, idx, scores, args.weighted)
+
+    def similar_users(username):
+        user_index.update(username, aggregates[username])
+        similar_usernames = user_index.top_k(username, k=3)
+        reduction_entries = list(db["reduction_insights"].find({"username": {"$in": similar_usernames}}))
+        return recommend_actions(similar_usernames, reduction_entries)
+
+    def new_submission(i):
+        username = usernames[i % len(usernames)]
+        db["users"].insert_one(assign_sequences(db["user_sequences"], [{
+            "username": username,
+            "user_data": queries[i % len(queries)],
+            "predicted_footprint": float(rng.uniform(*schema[4]))
+        }])[0])
+        return username
+
+    pick = lambda pool: (lambda i: pool[i % len(pool)])
+    batch_rows = lambda i: encoded[np.arange(i * args.batch_size, (i + 1) * args.batch_size) % len(encoded)]
+    benchmarks = {
+        "encode_new_user": (index.encoder.encode, pick(queries), 1),
+        "predict_carbon_footprint": (predict_one, pick(encoded), 1),
+        "predict_carbon_footprint_batch": (predict_one, batch_rows, args.batch_size),
+        "calculate_aggregate": (lambda i: apply_aggregate(db["aggregate"], usernames[i % len(usernames)], queries[i % len(queries)]),
+                                lambda i: i, 1),
+        "similar_users": (similar_users, pick(usernames), 1),
+        "analyze_reducing_attributes": (tracker.update, new_submission, 1),
+        "emit_event": (lambda i: emitter.emit(usernames[i % len(usernames)], {"event_type": "prediction", "user_data": queries[i % len(queries)]}),
+                       lambda i: i, 1),
+    }
+    for name in args.only or operations:
+        fn, prepare, rows_per_call = benchmarks[name]
+        report["results"][name] = measure(fn, prepare, args.iterations, args.warmup, rows_per_call)
+        print(f"{name}: p50 {report['results'][name]['p50_us']}us p99 {report['results'][name]['p99_us']}us",
+              file=sys.stderr)
+    emitter.close()
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prediction and recommendation hot paths.")
+    parser.add_argument("--reference-rows", type=int, default=10000, help="synthetic reference rows (1k-10M)")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users with submission histories (1k-1M)")
+    parser.add_argument("--submissions-per-user", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--query-pool", type=int, default=1000, help="distinct synthetic requests to cycle through")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--backend", default="exact", help="nearest-neighbour backend (exact, balltree, quantized)")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--weighted", action="store_true")
+    parser.add_argument("--dataset", default="cleaned_individual_footprint.csv",
+                        help="take vocabularies and numeric ranges from this CSV when it exists")
+    parser.add_argument("--only", nargs="+", choices=operations)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,12 @@
+# Questionnaire answers, by how aggregates, rollups and the reference encoder treat them.
+# Kept free of database imports so ingestion and prediction-only services can read them.
+
+numerical_cols = [
+    "Monthly Grocery Bill", "Vehicle Monthly Distance Km", "Waste Bag Weekly Count",
+    "How Long TV PC Daily Hour", "How Many New Clothes Monthly", "How Long Internet Daily Hour"
+]
+categorical_cols = [
+    "Body Type", "Sex", "Diet", "How Often Shower", "Heating Energy Source", "Transport",
+    "Vehicle Type", "Social Activity", "Frequency of Traveling by Air", "Waste Bag Size",
+    "Energy efficiency", "Recycling", "Cooking_With"
+]
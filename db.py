@@ -0,0 +1,262 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from pymongo import MongoClient, ASCENDING, WriteConcern, ReturnDocument
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+
+# Connection settings; MONGO_URI=mongomock:// runs against an in-memory stand-in.
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.environ.get("MONGO_DB", "carbon_footprint_db")
+mongo_pool_options = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 50)),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 5)),
+    "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_MS", 60000)),
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000)),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+}
+# acknowledged: insert on the request thread (w=1)
+# majority: insert on the request thread, wait for a journaled majority
+# buffered: write-behind, coalesced into insert_many by a background thread
+MONGO_DURABILITY = os.environ.get("MONGO_DURABILITY", "acknowledged")
+# Attempts per write-behind batch before its documents are counted as dropped.
+MONGO_WRITE_RETRIES = int(os.environ.get("MONGO_WRITE_RETRIES", 5))
+
+DUPLICATE_KEY = 11000
+
+index_specs = {
+    "users": [
+        ([("username", ASCENDING)], {}),
+        ([("username", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("username", ASCENDING), ("seq", ASCENDING)], {}),
+        ([("year", ASCENDING), ("month", ASCENDING)], {}),
+        ([("event_id", ASCENDING)], {"unique": True, "sparse": True}),
+    ],
+    "aggregate": [
+        ([("username", ASCENDING)], {"unique": True}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "reduction_insights": [
+        ([("username", ASCENDING)], {"unique": True}),
+    ],
+    "footprint_rollups": [
+        ([("username", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING)], {"unique": True}),
+    ],
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(uri=None):
+    global _client
+    with _client_lock:
+        if _client is None:
+            uri = uri or MONGO_URI
+            if uri.startswith("mongomock://"):
+                import mongomock
+                _client = mongomock.MongoClient()
+            else:
+                _client = MongoClient(uri, **mongo_pool_options)
+        return _client
+
+
+def get_database(name=None):
+    return get_client()[name or MONGO_DB]
+
+
+def ensure_indexes(db):
+    for collection_name, specs in index_specs.items():
+        for keys, options in specs:
+            try:
+                db[collection_name].create_index(keys, background=True, **options)
+            except OperationFailure as e:
+                # Usually duplicate usernames left over from before the unique index.
+                print(f"Could not create index {keys} on {collection_name}: {e}")
+
+
+def assign_sequences(sequences, docs):
+    """Stamp docs with per-user sequence numbers ("seq"), allocated atomically from the sequences collection.
+
+    Every writer draws from the same counters, so seq orders a user's
+    submissions consistently across processes; docs that already carry a
+    seq keep it.
+    """
+    by_user = {}
+    for doc in docs:
+        if "seq" not in doc:
+            by_user.setdefault(doc["username"], []).append(doc)
+    for username, user_docs in by_user.items():
+        counter = sequences.find_one_and_update(
+            {"_id": username}, {"$inc": {"seq": len(user_docs)}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        first = counter["seq"] - len(user_docs) + 1
+        for n, doc in enumerate(user_docs):
+            doc["seq"] = first + n
+    return docs
+
+
+def duplicate_key_errors(error):
+    """The writeErrors of a BulkWriteError if every one of them is a duplicate key (E11000), else None.
+
+    Callers re-raise on None; duplicate keys usually mean a lost upsert race
+    or a write that already landed.
+    """
+    errors = error.details.get("writeErrors", [])
+    if any(write_error.get("code") != DUPLICATE_KEY for write_error in errors):
+        return None
+    return errors
+
+
+def with_durability(collection, durability=None):
+    if (durability or MONGO_DURABILITY) == "majority":
+        return collection.with_options(write_concern=WriteConcern(w="majority", j=True))
+    return collection
+
+
+class WriteBehindBuffer:
+    """Coalesces single-document inserts into insert_many calls.
+
+    In buffered mode insert() only enqueues; a background thread writes
+    batches of up to max_batch documents, waiting at most flush_interval
+    seconds for a batch to fill. Any other mode inserts on the caller's
+    thread. Either way on_flush(docs) runs after the documents are stored,
+    so follow-up work that reads them back sees them; an on_flush failure
+    is counted on its own and never undoes or repeats the insert. With a
+    sequences collection, documents get per-user sequence numbers
+    (assign_sequences) just before they are written.
+
+    A failed background batch is retried with backoff up to max_retries
+    times, then its documents are counted as dropped.
+    """
+
+    def __init__(self, collection, durability=None, max_batch=500, flush_interval=0.05,
+                 max_queue_size=50000, on_flush=None, sequences=None, max_retries=MONGO_WRITE_RETRIES):
+        self.durability = durability or MONGO_DURABILITY
+        self.collection = with_durability(collection, self.durability)
+        self.sequences = sequences
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches_written = 0
+        self.documents_written = 0
+        self.write_retries = 0
+        self.batches_failed = 0
+        self.documents_dropped = 0
+        self.on_flush_failures = 0
+        if self.durability == "buffered":
+            self._thread = threading.Thread(target=self._run, name="mongo-write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def insert(self, doc):
+        if self._thread is None:
+            self._write([doc])
+        else:
+            # Blocks only when the queue is full, which pushes back on callers.
+            self._queue.put(doc)
+
+    def insert_many(self, docs):
+        if self._thread is None:
+            self._write(list(docs))
+        else:
+            for doc in docs:
+                self._queue.put(doc)
+
+    def _insert(self, docs):
+        if self.sequences is not None:
+            assign_sequences(self.sequences, docs)
+        try:
+            if len(docs) == 1:
+                self.collection.insert_one(docs[0])
+            else:
+                self.collection.insert_many(docs, ordered=False)
+        except DuplicateKeyError:
+            # A retried insert_one that had already landed (the driver sets _id on the doc).
+            pass
+        except BulkWriteError as e:
+            # Same for the documents of a retried batch that made it the first time.
+            if duplicate_key_errors(e) is None:
+                raise
+
+    def _write(self, docs):
+        if not docs:
+            return
+        self._insert(docs)
+        with self._lock:
+            self.batches_written += 1
+            self.documents_written += len(docs)
+        if self.on_flush:
+            try:
+                self.on_flush(docs)
+            except Exception as e:
+                with self._lock:
+                    self.on_flush_failures += 1
+                print(f"Follow-up work for {len(docs)} stored documents failed: {e}")
+
+    def _write_with_retries(self, docs):
+        backoff = 0.1
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(docs)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.batches_failed += 1
+                        self.documents_dropped += len(docs)
+                    print(f"Write-behind insert of {len(docs)} documents failed, dropping them: {e}")
+                    return False
+                with self._lock:
+                    self.write_retries += 1
+                print(f"Write-behind insert of {len(docs)} documents failed, retrying in {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5)
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._write_with_retries(self._take_batch(self.flush_interval))
+
+    def flush(self):
+        batch = self._take_batch(0)
+        while batch:
+            self._write_with_retries(batch)
+            batch = self._take_batch(0)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "durability": self.durability,
+                "queue_depth": self._queue.qsize(),
+                "batches_written": self.batches_written,
+                "documents_written": self.documents_written,
+                "write_retries": self.write_retries,
+                "batches_failed": self.batches_failed,
+                "documents_dropped": self.documents_dropped,
+                "on_flush_failures": self.on_flush_failures,
+            }
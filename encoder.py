@@ -0,0 +1,94 @@
+import json
+import numpy as np
+from multi_hot import item_column, parse_items
+
+
+class CompiledEncoder:
+    """Fitted LabelEncoders flattened into per-column dict lookups.
+
+    Categorical values missing from the vocabulary encode to 0 and absent
+    numeric values to 0, matching encode_new_user. With strict_numeric off,
+    numeric values that do not parse also encode to 0 instead of raising.
+    multi_hot maps item-list columns to their items; each item sets its own
+    0/1 column and items outside the vocabulary are ignored.
+    """
+
+    def __init__(self, columns, vocabularies, strict_numeric=True, multi_hot=None):
+        self.columns = list(columns)
+        self.vocabularies = {col: list(classes) for col, classes in vocabularies.items()}
+        self.strict_numeric = strict_numeric
+        self.multi_hot = {col: list(items) for col, items in (multi_hot or {}).items()}
+        positions = {col: j for j, col in enumerate(self.columns)}
+        self._multi_hot_plan = [
+            (col, {item: positions[item_column(col, item)] for item in items if item_column(col, item) in positions})
+            for col, items in self.multi_hot.items()
+        ]
+        item_columns = {j for _, lookup in self._multi_hot_plan for j in lookup.values()}
+        self._plan = [
+            (j, col, {label: code for code, label in enumerate(self.vocabularies[col])}
+             if col in self.vocabularies else None)
+            for j, col in enumerate(self.columns) if j not in item_columns
+        ]
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders, columns, strict_numeric=True, multi_hot=None):
+        vocabularies = {
+            col: [str(label) for label in encoder.classes_]
+            for col, encoder in label_encoders.items() if col in columns
+        }
+        return cls(columns, vocabularies, strict_numeric, multi_hot)
+
+    def _numeric(self, value):
+        if value is None:
+            return 0.0
+        if self.strict_numeric:
+            return float(value)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def encode(self, user_data, out=None):
+        row = np.zeros(len(self.columns), dtype=np.float32) if out is None else out
+        for j, col, lookup in self._plan:
+            value = user_data.get(col)
+            if lookup is None:
+                row[j] = self._numeric(value)
+            else:
+                try:
+                    row[j] = lookup.get(value, 0)
+                except TypeError:
+                    row[j] = 0
+        for col, lookup in self._multi_hot_plan:
+            for item in parse_items(user_data.get(col)):
+                j = lookup.get(item)
+                if j is not None:
+                    row[j] = 1
+        return row
+
+    def encode_batch(self, user_data_list):
+        matrix = np.zeros((len(user_data_list), len(self.columns)), dtype=np.float32)
+        for i, user_data in enumerate(user_data_list):
+            self.encode(user_data, out=matrix[i])
+        return matrix
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "vocabularies": self.vocabularies,
+            "strict_numeric": self.strict_numeric,
+            "multi_hot": self.multi_hot
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["columns"], data["vocabularies"], data.get("strict_numeric", True), data.get("multi_hot"))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
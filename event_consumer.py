@@ -0,0 +1,428 @@
+"""Consumer worker for carbon-footprint-events.
+
+Reads prediction events in batches and does the writes /predict skips when
+WRITE_PATH=events: the raw submission insert, the per-user aggregate, the
+monthly/yearly rollups and the reduction insights. Offsets are committed
+only after a batch is written, and every write is idempotent, so a batch
+that is redelivered after a crash or rebalance changes nothing twice:
+
+- submissions are upserted on their event_id;
+- aggregate and rollup documents remember, per partition, the last offset
+  folded into them, and updates for offsets at or below it are dropped.
+
+Run one or more processes in the same consumer group; --workers adds
+consumer threads per process:
+
+    python event_consumer.py --workers 4 --metrics-port 9102
+"""
+import os
+import sys
+import json
+import time
+import math
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from aggregates import aggregate_increments, aggregate_update, merge_update, field_key
+from rollups import rollup_changes
+from periods import submission_period
+from db import assign_sequences, duplicate_key_errors
+from reduction_tracker import ReductionTracker
+from event_emitter import InMemoryConsumer, InMemoryTopicPartition
+
+KAFKA_BOOTSTRAP_SERVERS = os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_TOPIC = os.environ.get("KAFKA_TOPIC", "carbon-footprint-events")
+CONSUMER_GROUP = os.environ.get("CONSUMER_GROUP", "carbon-footprint-writers")
+CONSUMER_BATCH_SIZE = int(os.environ.get("CONSUMER_BATCH_SIZE", 500))
+# /healthz fails once any partition falls this many events behind, or a worker
+# has been retrying a failed batch for longer than CONSUMER_MAX_STALL seconds.
+CONSUMER_MAX_LAG = int(os.environ.get("CONSUMER_MAX_LAG", 10000))
+CONSUMER_MAX_STALL = float(os.environ.get("CONSUMER_MAX_STALL", 60))
+
+
+def consumer_conf(group=CONSUMER_GROUP):
+    return {
+        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+        "group.id": group,
+        "enable.auto.commit": False,
+        "auto.offset.reset": "earliest",
+    }
+
+
+def event_problem(event):
+    """Why a decoded event cannot be written, or None; such events are counted as invalid and skipped."""
+    if not isinstance(event, dict) or event.get("event_type") != "prediction":
+        return "not a prediction event"
+    if not isinstance(event.get("username"), str) or not event["username"]:
+        return "username must be a non-empty string"
+    footprint = event.get("predicted_footprint")
+    if isinstance(footprint, bool) or not isinstance(footprint, (int, float)) or not math.isfinite(footprint):
+        return "predicted_footprint must be a finite number"
+    if not isinstance(event.get("user_data"), dict):
+        return "user_data must be an object"
+    if "event_id" in event and not isinstance(event["event_id"], str):
+        return "event_id must be a string"
+    if "year" in event and (isinstance(event["year"], bool) or not isinstance(event["year"], int)):
+        return "year must be an integer"
+    if "month" in event and not isinstance(event["month"], str):
+        return "month must be a string"
+    return None
+
+
+def bulk_write_idempotent(collection, writes):
+    """bulk_write of $setOnInsert upserts, where a duplicate key means the document is already stored."""
+    if not writes:
+        return 0
+    try:
+        return collection.bulk_write(writes, ordered=False).upserted_count
+    except BulkWriteError as e:
+        if duplicate_key_errors(e) is None:
+            raise
+        return e.details.get("nUpserted", 0)
+
+
+def guarded_writes(collection, changes):
+    """Merge (guard, offset, filter, update) changes per target document, dropping already-applied offsets.
+
+    guard names the source partition; each document keeps the last offset
+    applied from it under offsets.<guard>, read once per batch and checked
+    again in the update filter in case another consumer got there first.
+    """
+    targets = {}
+    for guard, offset, target_filter, update in changes:
+        targets.setdefault(tuple(target_filter.items()), target_filter)
+    applied = {}
+    if targets:
+        key_fields = list(next(iter(targets.values())))
+        projection = dict({field: 1 for field in key_fields}, offsets=1, _id=0)
+        for doc in collection.find({"$or": list(targets.values())}, projection):
+            applied[tuple((field, doc.get(field)) for field in key_fields)] = doc.get("offsets", {})
+
+    merged = {}
+    skipped = 0
+    for guard, offset, target_filter, update in changes:
+        key = tuple(target_filter.items())
+        if applied.get(key, {}).get(guard, -1) >= offset:
+            skipped += 1
+            continue
+        if (key, guard) in merged:
+            first, _, merged_update = merged[(key, guard)]
+            merged[(key, guard)] = (first, offset, merge_update(merged_update, update))
+        else:
+            merged[(key, guard)] = (offset, offset, update)
+
+    updates = [
+        (dict(targets[key], **{f"offsets.{guard}": {"$not": {"$gte": first}}}),
+         merge_update(update, {"$max": {f"offsets.{guard}": last}}))
+        for (key, guard), (first, last, update) in merged.items()
+    ]
+    if not updates:
+        return 0, skipped
+    try:
+        collection.bulk_write([UpdateOne(*update, upsert=True) for update in updates], ordered=False)
+    except BulkWriteError as e:
+        errors = duplicate_key_errors(e)
+        if errors is None:
+            raise
+        # The upsert either lost a race to create the document (another partition's consumer
+        # made the same new bucket) or the document already has this offset. The server does
+        # not retry upserts whose filter carries the offsets guard, so re-issue them as plain
+        # updates: the first case applies, the second still matches nothing.
+        collection.bulk_write([UpdateOne(*updates[error["index"]]) for error in errors], ordered=False)
+    return len(updates), skipped
+
+
+class EventConsumer:
+    """One consumer-group member: consume a batch, write it idempotently, commit, repeat."""
+
+    def __init__(self, consumer, db, topic=KAFKA_TOPIC, batch_size=CONSUMER_BATCH_SIZE,
+                 poll_timeout=1.0, reduction_tracker=None):
+        self.consumer = consumer
+        self.topic = topic
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.users_collection = db["users"]
+        self.sequences = db["user_sequences"]
+        self.aggregated_collection = db["aggregate"]
+        self.rollups_collection = db["footprint_rollups"]
+        self.reduction_tracker = reduction_tracker or ReductionTracker(db["users"], db["reduction_insights"])
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.events = 0
+        self.invalid = 0
+        self.duplicates_skipped = 0
+        self.failed_batches = 0
+        self.last_batch_ms = 0.0
+        self.lag = {}
+        self.retrying_since = None
+        self.last_error = None
+
+    def topic_partition(self, topic, partition):
+        if isinstance(self.consumer, InMemoryConsumer):
+            return InMemoryTopicPartition(topic, partition)
+        from confluent_kafka import TopicPartition
+        return TopicPartition(topic, partition)
+
+    def decode(self, message):
+        try:
+            event = json.loads(message.value())
+        except (TypeError, ValueError):
+            return None
+        problem = event_problem(event)
+        if problem:
+            print(f"Skipping invalid event at {message.topic()}:{message.partition()}:{message.offset()}: {problem}")
+            return None
+        # Events from producers that predate event_id are keyed by their log position.
+        event.setdefault("event_id", f"{message.topic()}:{message.partition()}:{message.offset()}")
+        if "month" not in event or "year" not in event:
+            event["month"], event["year"] = submission_period()
+        return event
+
+    def process(self, messages):
+        events = []
+        for message in messages:
+            if message.error():
+                continue
+            event = self.decode(message)
+            if event is None:
+                with self._lock:
+                    self.invalid += 1
+                continue
+            guard = field_key(f"{message.topic()}:{message.partition()}")
+            events.append((guard, message.offset(), event))
+        if not events:
+            return 0
+
+        submissions = [
+            {
+                "event_id": event["event_id"],
+                "username": event["username"],
+                "user_data": event["user_data"],
+                "predicted_footprint": event["predicted_footprint"],
+                "month": event["month"],
+                "year": event["year"]
+            }
+            for _, _, event in events
+        ]
+        # Redelivered events draw fresh numbers but keep the seq stored on their first insert.
+        assign_sequences(self.sequences, submissions)
+        bulk_write_idempotent(self.users_collection, [
+            UpdateOne({"event_id": submission["event_id"]}, {"$setOnInsert": submission}, upsert=True)
+            for submission in submissions
+        ])
+        _, skipped_aggregates = guarded_writes(self.aggregated_collection, [
+            (guard, offset, {"username": event["username"]},
+             aggregate_update(event["username"], aggregate_increments(event["user_data"], strict_numeric=False)))
+            for guard, offset, event in events
+        ])
+        guarded_writes(self.rollups_collection, [
+            (guard, offset, rollup_filter, update)
+            for (guard, offset, _), submission in zip(events, submissions)
+            for rollup_filter, update in rollup_changes(submission)
+        ])
+        for username in dict.fromkeys(submission["username"] for submission in submissions):
+            self.reduction_tracker.update(username)
+
+        with self._lock:
+            self.duplicates_skipped += skipped_aggregates
+            self.events += len(events)
+        return len(events)
+
+    def update_lag(self, messages, processed=True):
+        """Lag per partition after messages were written, or while they are still pending (processed=False)."""
+        positions = {}
+        for message in messages:
+            if message.error():
+                continue
+            key = (message.topic(), message.partition())
+            if processed:
+                positions[key] = message.offset() + 1
+            else:
+                positions.setdefault(key, message.offset())
+        lag = {}
+        for (topic, partition), position in positions.items():
+            _, high = self.consumer.get_watermark_offsets(self.topic_partition(topic, partition), timeout=1.0)
+            lag[partition] = max(high - position, 0)
+        assigned = {tp.partition for tp in self.consumer.assignment()}
+        with self._lock:
+            self.lag.update(lag)
+            # Partitions handed to another member after a rebalance are no longer ours to report.
+            self.lag = {partition: value for partition, value in self.lag.items() if partition in assigned}
+
+    def run_once(self):
+        messages = self.consumer.consume(num_messages=self.batch_size, timeout=self.poll_timeout)
+        if not messages:
+            return 0
+        started = time.perf_counter()
+        backoff = 0.5
+        while True:
+            try:
+                count = self.process(messages)
+                break
+            except Exception as e:
+                # The batch is not committed; retry it rather than skip past it. Lag keeps
+                # growing in the meantime so a stuck partition shows up in metrics and /healthz.
+                with self._lock:
+                    self.failed_batches += 1
+                    self.last_error = str(e)
+                    if self.retrying_since is None:
+                        self.retrying_since = time.monotonic()
+                print(f"Event batch of {len(messages)} failed, retrying in {backoff}s: {e}")
+                try:
+                    self.update_lag(messages, processed=False)
+                except Exception as lag_error:
+                    print(f"Could not read partition watermarks: {lag_error}")
+                if self._stop.wait(backoff):
+                    return 0
+                backoff = min(backoff * 2, 30)
+        self.consumer.commit(asynchronous=False)
+        self.update_lag(messages)
+        with self._lock:
+            self.retrying_since = None
+            self.last_error = None
+            self.batches += 1
+            self.last_batch_ms = round((time.perf_counter() - started) * 1000, 3)
+        return count
+
+    def run(self):
+        self.consumer.subscribe([self.topic])
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+        finally:
+            self.consumer.close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="event-consumer", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "events": self.events,
+                "invalid": self.invalid,
+                "duplicates_skipped": self.duplicates_skipped,
+                "failed_batches": self.failed_batches,
+                "last_batch_ms": self.last_batch_ms,
+                "retrying_seconds": round(time.monotonic() - self.retrying_since, 3) if self.retrying_since else 0.0,
+                "last_error": self.last_error,
+                "lag": dict(self.lag),
+            }
+
+
+class ConsumerGroup:
+    """Several EventConsumers in one process, sharing a reduction tracker."""
+
+    def __init__(self, make_consumer, db, workers=1, **options):
+        tracker = ReductionTracker(db["users"], db["reduction_insights"])
+        self.members = [
+            EventConsumer(make_consumer(), db, reduction_tracker=tracker, **options) for _ in range(workers)
+        ]
+
+    def start(self):
+        for member in self.members:
+            member.start()
+        return self
+
+    def close(self):
+        for member in self.members:
+            member.close()
+
+    def metrics(self):
+        totals = {"workers": len(self.members), "batches": 0, "events": 0, "invalid": 0,
+                  "duplicates_skipped": 0, "failed_batches": 0}
+        lag = {}
+        retrying_seconds = 0.0
+        errors = []
+        for member in self.members:
+            member_metrics = member.metrics()
+            for key in totals:
+                if key != "workers":
+                    totals[key] += member_metrics[key]
+            lag.update(member_metrics["lag"])
+            retrying_seconds = max(retrying_seconds, member_metrics["retrying_seconds"])
+            if member_metrics["last_error"]:
+                errors.append(member_metrics["last_error"])
+        totals["retrying_seconds"] = retrying_seconds
+        totals["last_errors"] = errors
+        totals["lag_total"] = sum(lag.values())
+        totals["lag_max"] = max(lag.values(), default=0)
+        totals["lag_by_partition"] = {str(partition): lag[partition] for partition in sorted(lag)}
+        return totals
+
+    def healthy(self, max_lag=CONSUMER_MAX_LAG, max_stall=CONSUMER_MAX_STALL):
+        metrics = self.metrics()
+        return metrics["lag_max"] <= max_lag and metrics["retrying_seconds"] <= max_stall
+
+
+def serve_metrics(group, port, registry):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                status, body, content_type = 200, registry.render(), "text/plain; version=0.0.4"
+            elif self.path == "/healthz":
+                metrics = group.metrics()
+                status = 200 if group.healthy() else 503
+                body, content_type = json.dumps(metrics), "application/json"
+            else:
+                status, body, content_type = 404, "", "text/plain"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, name="consumer-metrics", daemon=True).start()
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Apply carbon-footprint-events to Mongo.")
+    parser.add_argument("--workers", type=int, default=1, help="consumer threads in this process")
+    parser.add_argument("--group", default=CONSUMER_GROUP)
+    parser.add_argument("--topic", default=KAFKA_TOPIC)
+    parser.add_argument("--batch-size", type=int, default=CONSUMER_BATCH_SIZE)
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("CONSUMER_METRICS_PORT", 9102)),
+                        help="serve /metrics and /healthz here (0 disables)")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    from confluent_kafka import Consumer
+    from db import get_database, ensure_indexes
+    from instrumentation import MetricsRegistry
+
+    args = parse_args()
+    db = get_database()
+    ensure_indexes(db)
+    conf = consumer_conf(args.group)
+    group = ConsumerGroup(lambda: Consumer(conf), db, args.workers, topic=args.topic, batch_size=args.batch_size)
+    registry = MetricsRegistry()
+    registry.add_gauges("consumer", group.metrics)
+    if args.metrics_port:
+        serve_metrics(group, args.metrics_port, registry)
+    group.start()
+    print(f"Consuming '{args.topic}' as '{args.group}' with {args.workers} worker(s)", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(30)
+            metrics = group.metrics()
+            print(f"{metrics['events']} events, lag {metrics['lag_total']} (max {metrics['lag_max']})", file=sys.stderr)
+    except KeyboardInterrupt:
+        group.close()
@@ -0,0 +1,304 @@
+import json
+import queue
+import threading
+import time
+import zlib
+
+
+class InMemoryMessage:
+    def __init__(self, topic, key, value, partition=0, offset=0):
+        self._topic = topic
+        self._key = key
+        self._value = value
+        self._partition = partition
+        self._offset = offset
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def error(self):
+        return None
+
+
+class InMemoryTopicPartition:
+    def __init__(self, topic, partition, offset=-1001):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+
+
+class InMemoryBroker:
+    """Partitioned topic logs with consumer-group offsets, for running producer and consumers in one process.
+
+    Keys are hashed to partitions like Kafka's default partitioner, so all
+    events for a user land on one partition in order. Each group's members
+    split a topic's partitions round-robin and are rebalanced on join/leave;
+    a rebalanced partition restarts from the group's committed offset.
+    """
+
+    def __init__(self, partitions=4):
+        self.partitions = partitions
+        self._logs = {}
+        self._committed = {}
+        self._members = {}
+        self._condition = threading.Condition()
+
+    def _log(self, topic):
+        if topic not in self._logs:
+            self._logs[topic] = [[] for _ in range(self.partitions)]
+        return self._logs[topic]
+
+    def append(self, topic, key, value):
+        key_bytes = key.encode() if isinstance(key, str) else (key or b"")
+        with self._condition:
+            log = self._log(topic)
+            partition = zlib.crc32(key_bytes) % self.partitions if key else sum(map(len, log)) % self.partitions
+            message = InMemoryMessage(topic, key, value, partition, len(log[partition]))
+            log[partition].append(message)
+            self._condition.notify_all()
+        return message
+
+    def _rebalance(self, group, topic):
+        members = self._members.get((group, topic), [])
+        for n, consumer in enumerate(members):
+            partitions = [p for p in range(self.partitions) if p % len(members) == n]
+            consumer._positions = {
+                (topic, p): self._committed.get((group, topic, p), 0) for p in partitions
+            }
+
+    def join(self, group, topic, consumer):
+        with self._condition:
+            self._log(topic)
+            self._members.setdefault((group, topic), []).append(consumer)
+            self._rebalance(group, topic)
+
+    def leave(self, group, topic, consumer):
+        with self._condition:
+            members = self._members.get((group, topic), [])
+            if consumer in members:
+                members.remove(consumer)
+            consumer._positions = {}
+            self._rebalance(group, topic)
+
+    def fetch(self, consumer, max_messages, timeout):
+        deadline = time.monotonic() + max(timeout, 0)
+        with self._condition:
+            while True:
+                batch = []
+                for (topic, partition), position in consumer._positions.items():
+                    available = self._logs[topic][partition][position:position + max_messages - len(batch)]
+                    batch.extend(available)
+                    consumer._positions[(topic, partition)] = position + len(available)
+                    if len(batch) >= max_messages:
+                        break
+                remaining = deadline - time.monotonic()
+                if batch or remaining <= 0:
+                    return batch
+                self._condition.wait(remaining)
+
+    def commit(self, group, positions):
+        with self._condition:
+            for (topic, partition), position in positions.items():
+                self._committed[(group, topic, partition)] = position
+
+    def watermarks(self, topic, partition):
+        with self._condition:
+            return 0, len(self._log(topic)[partition])
+
+
+class InMemoryProducer:
+    """Stand-in for confluent_kafka.Producer that keeps delivered messages in a list.
+
+    With a broker, delivered messages are also appended to its topic logs
+    so InMemoryConsumers can read them.
+    """
+
+    def __init__(self, conf=None, broker=None):
+        self.conf = conf or {}
+        self.broker = broker
+        self.messages = []
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def produce(self, topic, key=None, value=None, callback=None):
+        with self._lock:
+            self._pending.append((InMemoryMessage(topic, key, value), callback))
+
+    def poll(self, timeout=0):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for message, callback in pending:
+            if self.broker is not None:
+                message = self.broker.append(message.topic(), message.key(), message.value())
+            else:
+                message._offset = len(self.messages)
+            self.messages.append(message)
+            if callback:
+                callback(None, message)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll(0)
+        return 0
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class InMemoryConsumer:
+    """Stand-in for confluent_kafka.Consumer (manual commits) over an InMemoryBroker."""
+
+    def __init__(self, broker, conf=None):
+        self.broker = broker
+        self.conf = conf or {}
+        self.group = self.conf.get("group.id", "default")
+        self._topics = []
+        self._positions = {}
+
+    def subscribe(self, topics):
+        for topic in topics:
+            self.broker.join(self.group, topic, self)
+        self._topics.extend(topics)
+
+    def consume(self, num_messages=1, timeout=-1):
+        return self.broker.fetch(self, num_messages, 3600 if timeout < 0 else timeout)
+
+    def commit(self, message=None, asynchronous=True):
+        self.broker.commit(self.group, dict(self._positions))
+
+    def assignment(self):
+        return [InMemoryTopicPartition(topic, partition) for topic, partition in self._positions]
+
+    def get_watermark_offsets(self, partition, timeout=None, cached=False):
+        return self.broker.watermarks(partition.topic, partition.partition)
+
+    def close(self):
+        for topic in self._topics:
+            self.broker.leave(self.group, topic, self)
+        self._topics = []
+
+
+class EventEmitter:
+    """Bounded queue in front of a Kafka producer, drained by a background pump thread.
+
+    emit() never waits on the broker: when the queue is full the event is
+    dropped and counted, so Kafka slowness shows up in metrics() rather than
+    in request latency.
+    """
+
+    def __init__(self, producer, topic, max_queue_size=10000, batch_size=500, poll_interval=0.05):
+        self.producer = producer
+        self.topic = topic
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._delivered = 0
+        self._failed = 0
+        self._dropped = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="kafka-event-pump", daemon=True)
+            self._thread.start()
+        return self
+
+    def emit(self, key, event):
+        try:
+            self._queue.put_nowait((key, json.dumps(event), time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def _delivery_callback(self, enqueued_at):
+        def callback(err, msg):
+            latency = time.monotonic() - enqueued_at
+            with self._lock:
+                if err:
+                    self._failed += 1
+                else:
+                    self._delivered += 1
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+            if err:
+                print(f"❌ Kafka Delivery Failed: {err}")
+        return callback
+
+    def _produce(self, key, value, enqueued_at):
+        while True:
+            try:
+                self.producer.produce(self.topic, key=key, value=value,
+                                      callback=self._delivery_callback(enqueued_at))
+                return
+            except BufferError:
+                # librdkafka's local queue is full; serve callbacks until it drains.
+                self.producer.poll(self.poll_interval)
+
+    def _drain(self, first=None):
+        batch = [first] if first else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for key, value, enqueued_at in batch:
+            self._produce(key, value, enqueued_at)
+        return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                first = None
+            if first:
+                self._drain(first)
+            self.producer.poll(0)
+
+    def flush(self, timeout=10):
+        while self._drain():
+            pass
+        return self.producer.flush(timeout)
+
+    def close(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        return self.flush(timeout)
+
+    def metrics(self):
+        with self._lock:
+            delivered = self._delivered
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "producer_in_flight": len(self.producer),
+                "enqueued": self._enqueued,
+                "delivered": delivered,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "delivery_latency_avg_ms": round(self._latency_total / delivered * 1000, 3) if delivered else 0.0,
+                "delivery_latency_max_ms": round(self._latency_max * 1000, 3),
+            }
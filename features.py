@@ -0,0 +1,32 @@
+"""Optional subsystems of the prediction service, switched on with FEATURES.
+
+FEATURES is a comma-separated list, "all" (the default) or "none"; with
+"none" the service only scores requests and never touches Mongo or Kafka.
+
+    storage          store submissions and per-user aggregates in Mongo
+    kafka            publish prediction events
+    trends           monthly/yearly rollups and the /trends endpoints
+    reductions       reduction insights and /analyze_reduction
+    recommendations  similar-user recommendations in /predict responses
+"""
+all_features = ("storage", "kafka", "trends", "reductions", "recommendations")
+
+requirements = {
+    "trends": ("storage",),
+    "reductions": ("storage",),
+    "recommendations": ("storage", "reductions"),
+}
+
+
+def parse_features(value):
+    if value is None or value.strip() == "all":
+        return set(all_features)
+    names = {name.strip() for name in value.split(",") if name.strip() and name.strip() != "none"}
+    unknown = names - set(all_features)
+    if unknown:
+        raise ValueError(f"Unknown FEATURES {sorted(unknown)}; choose from {list(all_features)}")
+    for name in sorted(names):
+        missing = [required for required in requirements.get(name, ()) if required not in names]
+        if missing:
+            raise ValueError(f"Feature '{name}' needs {missing} enabled as well")
+    return names
@@ -0,0 +1,124 @@
+"""Streaming ingestion of large reference CSVs into the snapshot layout.
+
+Two passes over the file in chunks: the first counts rows and collects the
+category vocabularies and multi-hot items, the second encodes each chunk and
+writes it straight into memory-mapped features.npy / targets.npy. Peak
+memory is a few chunks, independent of the file size.
+
+Accepts the cleaned dataset and raw "Carbon Emission.csv" exports, whose
+target column is CarbonEmission; like the cleaning notebook, rows with
+missing values are dropped.
+"""
+import os
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from encoder import CompiledEncoder
+from multi_hot import MULTI_HOT_COLS, item_column, parse_items
+from columns import numerical_cols, categorical_cols
+from reference_index import TARGET_COL, normalize_rows, save_index_metadata, load_reference_index
+
+raw_column_names = {"CarbonEmission": TARGET_COL}
+label_cols = [col for col in categorical_cols if col not in MULTI_HOT_COLS]
+
+
+def read_columns(dataset_path):
+    """Map the file's column names to canonical ones, keeping file order; unknown columns are skipped."""
+    known = set(label_cols) | set(MULTI_HOT_COLS) | set(numerical_cols) | {TARGET_COL}
+    header = pd.read_csv(dataset_path, nrows=0).columns
+    columns = {}
+    for name in header:
+        canonical = raw_column_names.get(name, name)
+        if canonical in known:
+            columns[name] = canonical
+    missing = known - set(columns.values())
+    if missing:
+        raise ValueError(f"'{dataset_path}' is missing columns: {sorted(missing)}")
+    return columns
+
+
+def read_chunks(dataset_path, columns, chunk_size):
+    # Compact dtypes: strings become per-chunk categoricals, numbers float32.
+    dtypes = {
+        name: "float32" if canonical in numerical_cols or canonical == TARGET_COL else "category"
+        for name, canonical in columns.items()
+    }
+    for chunk in pd.read_csv(dataset_path, usecols=list(columns), dtype=dtypes, chunksize=chunk_size):
+        yield chunk.rename(columns=columns).dropna()
+
+
+def collect_vocabularies(dataset_path, columns, chunk_size):
+    rows = 0
+    labels = {col: set() for col in label_cols}
+    item_values = {col: set() for col in MULTI_HOT_COLS}
+    for chunk in read_chunks(dataset_path, columns, chunk_size):
+        rows += len(chunk)
+        for col in label_cols:
+            labels[col].update(chunk[col].cat.remove_unused_categories().cat.categories)
+        for col in MULTI_HOT_COLS:
+            item_values[col].update(chunk[col].cat.remove_unused_categories().cat.categories)
+    # Sorted like LabelEncoder.classes_, so codes match the in-memory path.
+    vocabularies = {col: sorted(str(label) for label in values) for col, values in labels.items()}
+    multi_hot = {
+        col: sorted({item for value in values for item in parse_items(value)})
+        for col, values in item_values.items()
+    }
+    return rows, vocabularies, multi_hot
+
+
+def feature_layout(columns, multi_hot):
+    # Same order as expand_multi_hot: item columns replace their source column.
+    layout = []
+    for col in columns.values():
+        if col == TARGET_COL:
+            continue
+        if col in multi_hot:
+            layout.extend(item_column(col, item) for item in multi_hot[col])
+        else:
+            layout.append(col)
+    return layout
+
+
+def encode_chunk(chunk, layout, vocabularies, multi_hot):
+    block = np.zeros((len(chunk), len(layout)), dtype=np.float32)
+    position = {col: j for j, col in enumerate(layout)}
+    for col in label_cols:
+        codes = chunk[col].cat.set_categories(vocabularies[col]).cat.codes.to_numpy()
+        block[:, position[col]] = codes
+    for col in numerical_cols:
+        block[:, position[col]] = chunk[col].to_numpy(dtype=np.float32)
+    for col, items in multi_hot.items():
+        # Parse each distinct string once, then scatter bits by category code.
+        values = chunk[col].cat.remove_unused_categories()
+        bits = np.zeros((len(values.cat.categories), len(items)), dtype=np.float32)
+        item_position = {item: j for j, item in enumerate(items)}
+        for c, value in enumerate(values.cat.categories):
+            for item in parse_items(value):
+                bits[c, item_position[item]] = 1
+        start = position[item_column(col, items[0])] if items else None
+        if start is not None:
+            block[:, start:start + len(items)] = bits[values.cat.codes.to_numpy()]
+    return block
+
+
+def stream_reference_index(dataset_path, index_dir, chunk_size=200000):
+    """Encode dataset_path into index_dir without holding the whole dataset in memory."""
+    columns = read_columns(dataset_path)
+    rows, vocabularies, multi_hot = collect_vocabularies(dataset_path, columns, chunk_size)
+    layout = feature_layout(columns, multi_hot)
+
+    os.makedirs(index_dir, exist_ok=True)
+    features = open_memmap(os.path.join(index_dir, "features.npy"), mode="w+", dtype=np.float32, shape=(rows, len(layout)))
+    targets = open_memmap(os.path.join(index_dir, "targets.npy"), mode="w+", dtype=np.float32, shape=(rows,))
+    start = 0
+    for chunk in read_chunks(dataset_path, columns, chunk_size):
+        block = normalize_rows(encode_chunk(chunk, layout, vocabularies, multi_hot))
+        features[start:start + len(block)] = block
+        targets[start:start + len(block)] = chunk[TARGET_COL].to_numpy(dtype=np.float32)
+        start += len(block)
+    features.flush()
+    targets.flush()
+    del features, targets
+
+    save_index_metadata(index_dir, layout, CompiledEncoder(layout, vocabularies, multi_hot=multi_hot))
+    return load_reference_index(index_dir)
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import uuid
+import random
+import cProfile
+import resource
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; Prometheus "le" buckets, +Inf is implicit.
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+class RequestTrace:
+    """Times the stages of one request; spans are kept only when the request is sampled."""
+
+    def __init__(self, registry, route, sampled=False):
+        self.registry = registry
+        self.route = route
+        self.sampled = sampled
+        self.trace_id = uuid.uuid4().hex[:16] if sampled else None
+        self.spans = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.registry.count_error(self.route, stage)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.registry.observe_stage(self.route, stage, elapsed)
+            if self.sampled:
+                self.spans.append((stage, elapsed))
+
+    def finish(self, status):
+        elapsed = time.perf_counter() - self.started
+        self.registry.observe_request(self.route, status, elapsed)
+        return elapsed
+
+    def server_timing(self):
+        # Server-Timing header value, durations in milliseconds.
+        return ", ".join(f"{stage};dur={elapsed * 1000:.3f}" for stage, elapsed in self.spans)
+
+
+class MetricsRegistry:
+    """Per-process stage/request histograms rendered in the Prometheus text format."""
+
+    def __init__(self, namespace="carbon", buckets=default_buckets):
+        self.namespace = namespace
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+        self._request_counts = {}
+        self._errors = {}
+        self._gauges = []
+
+    def trace(self, route, sampled=False):
+        return RequestTrace(self, route, sampled)
+
+    def observe_stage(self, route, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get((route, stage))
+            if histogram is None:
+                histogram = self._stages[(route, stage)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def observe_request(self, route, status, seconds):
+        with self._lock:
+            histogram = self._requests.get(route)
+            if histogram is None:
+                histogram = self._requests[route] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            key = (route, str(status))
+            self._request_counts[key] = self._request_counts.get(key, 0) + 1
+
+    def count_error(self, route, stage):
+        with self._lock:
+            self._errors[(route, stage)] = self._errors.get((route, stage), 0) + 1
+
+    def add_gauges(self, prefix, metrics_fn):
+        """Export the numeric entries of metrics_fn() as {namespace}_{prefix}_{key} gauges."""
+        self._gauges.append((prefix, metrics_fn))
+
+    def _render_histogram(self, lines, name, histogram, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    def render(self):
+        ns = self.namespace
+        lines = []
+        with self._lock:
+            lines += [f"# HELP {ns}_stage_duration_seconds Time spent in each request stage.",
+                      f"# TYPE {ns}_stage_duration_seconds histogram"]
+            for (route, stage), histogram in sorted(self._stages.items()):
+                self._render_histogram(lines, f"{ns}_stage_duration_seconds", histogram, _labels(route=route, stage=stage))
+            lines += [f"# HELP {ns}_request_duration_seconds End-to-end request time.",
+                      f"# TYPE {ns}_request_duration_seconds histogram"]
+            for route, histogram in sorted(self._requests.items()):
+                self._render_histogram(lines, f"{ns}_request_duration_seconds", histogram, _labels(route=route))
+            lines += [f"# HELP {ns}_requests_total Requests by route and status.",
+                      f"# TYPE {ns}_requests_total counter"]
+            for (route, status), count in sorted(self._request_counts.items()):
+                lines.append(f"{ns}_requests_total{{{_labels(route=route, status=status)}}} {count}")
+            lines += [f"# HELP {ns}_stage_errors_total Exceptions raised inside a request stage.",
+                      f"# TYPE {ns}_stage_errors_total counter"]
+            for (route, stage), count in sorted(self._errors.items()):
+                lines.append(f"{ns}_stage_errors_total{{{_labels(route=route, stage=stage)}}} {count}")
+        for prefix, metrics_fn in self._gauges:
+            for key, value in metrics_fn().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {ns}_{prefix}_{key} gauge")
+                    lines.append(f"{ns}_{prefix}_{key} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class StartupReport:
+    """Times each startup step and records which heavy dependencies ended up imported."""
+
+    heavy_modules = ("pandas", "sklearn", "pymongo", "mongomock", "confluent_kafka", "redis", "motor")
+
+    def __init__(self, features):
+        self.features = features
+        self.started = time.perf_counter()
+        self.steps = []
+        self.total_seconds = None
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        modules_before = len(sys.modules)
+        try:
+            yield
+        finally:
+            self.steps.append({
+                "step": name,
+                "seconds": round(time.perf_counter() - started, 3),
+                "modules_imported": len(sys.modules) - modules_before,
+            })
+
+    def finish(self):
+        self.total_seconds = round(time.perf_counter() - self.started, 3)
+        print(self.render())
+        return self
+
+    def summary(self):
+        return {
+            "features": sorted(self.features),
+            "steps": self.steps,
+            "total_seconds": self.total_seconds,
+            "peak_rss_mb": peak_rss_mb(),
+            "imported": {name: name in sys.modules for name in self.heavy_modules},
+        }
+
+    def render(self):
+        summary = self.summary()
+        imported = [name for name, loaded in summary["imported"].items() if loaded]
+        lines = [f"Started in {summary['total_seconds']}s, peak RSS {summary['peak_rss_mb']} MB, "
+                 f"features: {', '.join(summary['features']) or 'none'}"]
+        for step in self.steps:
+            lines.append(f"  {step['step']}: {step['seconds']}s, {step['modules_imported']} modules imported")
+        lines.append(f"  heavy dependencies loaded: {', '.join(imported) or 'none'}")
+        return "\n".join(lines)
+
+
+class RequestProfiler:
+    """cProfiles a random fraction of requests and dumps each profile to output_dir.
+
+    Only one request is profiled at a time; a sampled request that arrives
+    while another is being profiled runs unprofiled.
+    """
+
+    def __init__(self, sample_rate=0.0, output_dir="profiles"):
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self._busy = threading.Lock()
+        self.profiles_written = 0
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter.
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        try:
+            profile.disable()
+            os.makedirs(self.output_dir, exist_ok=True)
+            safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_") or "request"
+            profile.dump_stats(os.path.join(self.output_dir, f"{safe_name}-{time.time_ns()}.prof"))
+            self.profiles_written += 1
+        finally:
+            self._busy.release()
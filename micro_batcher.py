@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item calls into one batched call.
+
+    submit() queues an item and returns a Future. A scheduler thread takes
+    the first waiting item, keeps collecting for at most max_wait_us
+    microseconds or until max_batch_size items are queued, then calls
+    fn(items) once and resolves each Future with its row of the result.
+    fn must return one result per item, in order.
+    """
+
+    def __init__(self, fn, max_batch_size=64, max_wait_us=500, max_queue_size=10000):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_us / 1e6
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._failed_batches = 0
+        self._max_batch = 0
+        self._size_buckets = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="predict-micro-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, item):
+        future = Future()
+        if self._thread is None:
+            # Not started (or closed): score on the caller's thread.
+            self._score([(item, future, time.monotonic())])
+        else:
+            self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.05)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _score(self, batch):
+        started = time.monotonic()
+        try:
+            results = self.fn([item for item, _, _ in batch])
+        except Exception as e:
+            results = None
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        waits = [started - enqueued_at for _, _, enqueued_at in batch]
+        # Batch sizes rounded up to a power of two: "1", "2", "4", ...
+        bucket = str(1 << (len(batch) - 1).bit_length())
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._failed_batches += results is None
+            self._max_batch = max(self._max_batch, len(batch))
+            self._size_buckets[bucket] = self._size_buckets.get(bucket, 0) + 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._score(batch)
+
+    def close(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while True:
+            try:
+                batch = [self._queue.get_nowait()]
+            except queue.Empty:
+                return
+            self._score(batch)
+
+    def metrics(self):
+        with self._lock:
+            batches, items = self._batches, self._items
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_us": round(self.max_wait * 1e6),
+                "batches": batches,
+                "items": items,
+                "failed_batches": self._failed_batches,
+                "batch_size_avg": round(items / batches, 3) if batches else 0.0,
+                "batch_size_max": self._max_batch,
+                "batch_size_buckets": dict(sorted(self._size_buckets.items(), key=lambda kv: int(kv[0]))),
+                "queue_wait_avg_us": round(self._wait_total / items * 1e6, 1) if items else 0.0,
+                "queue_wait_max_us": round(self._wait_max * 1e6, 1),
+            }
@@ -0,0 +1,188 @@
+import os
+import re
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from neighbors import normalize_queries
+from encoder import CompiledEncoder
+from snapshot import default_snapshot_root, current_snapshot_dir, read_manifest, snapshot_problem, load_snapshot
+
+version_pattern = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+class ModelVersion:
+    """One loaded reference snapshot with its encoder and search backend."""
+
+    def __init__(self, index, backend, strict_numeric=True):
+        self.version = index.version
+        self.index = index
+        self.encoder = index.encoder
+        if not strict_numeric:
+            self.encoder = CompiledEncoder(
+                index.encoder.columns, index.encoder.vocabularies,
+                strict_numeric=False, multi_hot=index.encoder.multi_hot
+            )
+        self.backend = backend
+        self.loaded_at = datetime.utcnow()
+        self.refs = 0
+        self.retired = False
+
+
+class ModelRegistry:
+    """Holds the serving reference model and swaps in new snapshots without downtime.
+
+    Requests take the current model with acquire() and keep it until they
+    finish, so a swap never changes the model under a request. A replaced
+    model is released once its last in-flight request drops it.
+    """
+
+    def __init__(self, expected_columns, make_backend, root=default_snapshot_root, on_swap=None, strict_numeric=True):
+        self.expected_columns = expected_columns
+        self.strict_numeric = strict_numeric
+        self.make_backend = make_backend
+        self.root = root
+        self.on_swap = on_swap
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current = None
+        self._draining = []
+        self.swaps = 0
+        self.last_error = None
+
+    @property
+    def current(self):
+        return self._current
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            model = self._current
+            model.refs += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                model.refs -= 1
+                if model.retired and model.refs == 0:
+                    self._release(model)
+
+    def _release(self, model):
+        # Called with _lock held.
+        if model in self._draining:
+            self._draining.remove(model)
+        model.backend = None
+        model.index = None
+        print(f"Released reference model {model.version}")
+
+    def validate(self, index):
+        if index.encoder is None:
+            raise ValueError(f"snapshot {index.version} has no encoder")
+        if list(index.encoder.columns) != list(index.columns):
+            raise ValueError(f"snapshot {index.version}: encoder columns do not match the feature columns")
+        if index.features.shape != (len(index.targets), len(index.columns)):
+            raise ValueError(f"snapshot {index.version}: feature block shape {index.features.shape} does not match "
+                             f"{len(index.targets)} rows x {len(index.columns)} columns")
+
+    def install(self, index):
+        """Validate index, build its backend and make it the serving model."""
+        self.validate(index)
+        backend = self.make_backend(index)
+        # Probe the full request path once before any request can see it.
+        backend.search(normalize_queries(index.encoder.encode({})), 1)
+        model = ModelVersion(index, backend, self.strict_numeric)
+        with self._lock:
+            previous, self._current = self._current, model
+            if previous is not None:
+                previous.retired = True
+                if previous.refs == 0:
+                    self._release(previous)
+                else:
+                    self._draining.append(previous)
+            self.swaps += 1
+        if self.on_swap:
+            self.on_swap(model)
+        print(f"Serving reference model {model.version}")
+        return model
+
+    def snapshot_dir(self, version):
+        """The directory of a published version; version must name a snapshot directly under root."""
+        if not version_pattern.match(version):
+            raise ValueError(f"invalid snapshot version '{version}'")
+        root = os.path.realpath(self.root)
+        snapshot_dir = os.path.realpath(os.path.join(root, version))
+        if os.path.dirname(snapshot_dir) != root or not os.path.isdir(snapshot_dir):
+            raise ValueError(f"no snapshot '{version}' under '{self.root}'")
+        return snapshot_dir
+
+    def load(self, version=None, force=False):
+        """Load a published snapshot (CURRENT by default) and swap it in if it differs."""
+        with self._load_lock:
+            snapshot_dir = self.snapshot_dir(version) if version else current_snapshot_dir(self.root)
+            if snapshot_dir is None:
+                raise ValueError(f"no snapshot published under '{self.root}'")
+            manifest = read_manifest(snapshot_dir)
+            if not force and self._current is not None and manifest and manifest.get("version") == self._current.version:
+                return self._current
+            problem = snapshot_problem(manifest, self.expected_columns)
+            if problem:
+                raise ValueError(f"snapshot '{snapshot_dir}' failed validation: {problem}")
+            index = load_snapshot(snapshot_dir, self.expected_columns)
+            if index is None:
+                raise ValueError(f"snapshot '{snapshot_dir}' could not be read")
+            return self.install(index)
+
+    def reload_async(self, version=None, force=False):
+        """Start a background load; returns False if one is already running.
+
+        An unknown or malformed version raises ValueError before anything starts.
+        """
+        if version:
+            self.snapshot_dir(version)
+        if self._load_lock.locked():
+            return False
+
+        def run():
+            try:
+                self.load(version, force)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Reference model reload failed: {e}")
+
+        threading.Thread(target=run, name="model-reload", daemon=True).start()
+        return True
+
+    def start_watch(self, interval=30):
+        """Poll the snapshot CURRENT pointer and load whatever it points at."""
+        def run():
+            rejected = None
+            while not stop.wait(interval):
+                snapshot_dir = current_snapshot_dir(self.root)
+                version = os.path.basename(snapshot_dir) if snapshot_dir else None
+                # A snapshot that failed validation is not retried until CURRENT moves on.
+                if version is None or version in (self._current.version, rejected):
+                    continue
+                try:
+                    self.load()
+                    self.last_error = None
+                except Exception as e:
+                    rejected = version
+                    self.last_error = str(e)
+                    print(f"Reference model reload failed: {e}")
+        stop = threading.Event()
+        threading.Thread(target=run, name="model-watch", daemon=True).start()
+        return stop
+
+    def status(self):
+        with self._lock:
+            current = self._current
+            return {
+                "version": current.version if current else None,
+                "loaded_at": current.loaded_at.isoformat() if current else None,
+                "rows": int(len(current.index)) if current and current.index is not None else 0,
+                "in_flight": current.refs if current else 0,
+                "draining": [{"version": model.version, "in_flight": model.refs} for model in self._draining],
+                "swaps": self.swaps,
+                "reloading": self._load_lock.locked(),
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,70 @@
+import ast
+from functools import lru_cache
+import numpy as np
+
+# Columns whose values are item lists, e.g. "['Oven', 'Microwave']".
+MULTI_HOT_COLS = ["Recycling", "Cooking_With"]
+
+
+def item_column(col, item):
+    return f"{col}={item}"
+
+
+def source_column(column):
+    # "Recycling=Metal" -> "Recycling"; every other column maps to itself.
+    col, sep, _ = column.partition("=")
+    return col if sep and col in MULTI_HOT_COLS else column
+
+
+def source_columns(columns):
+    return list(dict.fromkeys(source_column(col) for col in columns))
+
+
+@lru_cache(maxsize=4096)
+def _parse_string(value):
+    value = value.strip()
+    if value.startswith("["):
+        try:
+            parsed = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed = value.strip("[]").split(",")
+    else:
+        parsed = value.split(",")
+    if isinstance(parsed, str):
+        parsed = [parsed]
+    return tuple(dict.fromkeys(str(item).strip().strip("'\"") for item in parsed if str(item).strip()))
+
+
+def parse_items(value):
+    """Accept a list/tuple/set of items or its string form; return a tuple of item names."""
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return _parse_string(value)
+    if isinstance(value, (list, tuple, set)):
+        return tuple(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+    return ()
+
+
+def expand_multi_hot(df, cols=MULTI_HOT_COLS):
+    """Replace each item-list column with one 0/1 column per item, in place of the original.
+
+    Returns the new frame and the item vocabulary of every expanded column.
+    """
+    vocabularies = {}
+    for col in cols:
+        if col not in df.columns:
+            continue
+        parsed = df[col].map(parse_items)
+        items = sorted({item for row in parsed for item in row})
+        vocabularies[col] = items
+        position = {item: j for j, item in enumerate(items)}
+        bits = np.zeros((len(df), len(items)), dtype=np.uint8)
+        for i, row in enumerate(parsed):
+            for item in row:
+                bits[i, position[item]] = 1
+        at = df.columns.get_loc(col)
+        df = df.drop(columns=[col])
+        for j, item in enumerate(items):
+            df.insert(at + j, item_column(col, item), bits[:, j])
+    return df, vocabularies
@@ -0,0 +1,183 @@
+import numpy as np
+
+
+def normalize_queries(encoded_matrix):
+    queries = np.array(encoded_matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return queries / norms
+
+
+def _merge_top_k(best_scores, best_idx, scores, idx, k):
+    scores = np.concatenate([best_scores, scores], axis=1)
+    idx = np.concatenate([best_idx, idx], axis=1)
+    # Keep earlier (lower) indices on ties, like argmax does.
+    order = np.lexsort((idx, -scores), axis=1)[:, :k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+
+def _top_k_rows(scores, k):
+    k = min(k, scores.shape[1])
+    if k == 1:
+        idx = np.argmax(scores, axis=1)[:, None]
+    else:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, idx, axis=1), idx
+
+
+def _rerank(features, queries, candidates, k):
+    # Exact cosine on a handful of candidate rows per query.
+    exact = np.einsum("qcd,qd->qc", np.asarray(features[candidates.ravel()], dtype=np.float32)
+                      .reshape(candidates.shape + (-1,)), queries)
+    order = np.lexsort((candidates, -exact), axis=1)[:, :k]
+    return np.take_along_axis(exact, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+
+class ExactBackend:
+    """Brute-force cosine scan, blocked over queries and reference rows."""
+
+    name = "exact"
+
+    def __init__(self, index, query_block=256, reference_block=65536):
+        self.index = index
+        self.query_block = query_block
+        self.reference_block = reference_block
+
+    def search(self, queries, k=1):
+        features = self.index.features
+        k = min(k, len(features))
+        scores_out = np.empty((len(queries), k), dtype=np.float32)
+        idx_out = np.empty((len(queries), k), dtype=np.int64)
+        for q_start in range(0, len(queries), self.query_block):
+            q_block = queries[q_start:q_start + self.query_block]
+            best_scores = np.full((len(q_block), 0), -np.inf, dtype=np.float32)
+            best_idx = np.zeros((len(q_block), 0), dtype=np.int64)
+            for r_start in range(0, len(features), self.reference_block):
+                tile = q_block @ features[r_start:r_start + self.reference_block].T
+                tile_scores, tile_idx = _top_k_rows(tile, k)
+                best_scores, best_idx = _merge_top_k(best_scores, best_idx, tile_scores, tile_idx + r_start, k)
+            scores_out[q_start:q_start + len(q_block)] = best_scores
+            idx_out[q_start:q_start + len(q_block)] = best_idx
+        return idx_out, scores_out
+
+
+class BallTreeBackend:
+    """sklearn BallTree over the non-zero normalized rows.
+
+    For unit vectors euclidean distance is monotonic in cosine similarity,
+    but an all-zero row sits at distance 1 from every query and would beat
+    real rows with cosine below 0.5, so zero rows are kept out of the tree.
+    The tree returns candidates_per_k * k rows, the first k zero rows (score
+    0) are added, and the candidates are re-ranked by exact cosine.
+    """
+
+    name = "balltree"
+
+    def __init__(self, index, leaf_size=40, candidates_per_k=4):
+        from sklearn.neighbors import BallTree
+        self.index = index
+        self.candidates_per_k = candidates_per_k
+        features = np.asarray(index.features)
+        nonzero = features.any(axis=1)
+        self.tree_rows = np.flatnonzero(nonzero)
+        self.zero_rows = np.flatnonzero(~nonzero)
+        self.tree = BallTree(features[self.tree_rows], leaf_size=leaf_size) if len(self.tree_rows) else None
+
+    def search(self, queries, k=1):
+        n_candidates = min(len(self.tree_rows), k * self.candidates_per_k)
+        candidates = np.zeros((len(queries), 0), dtype=np.int64)
+        if n_candidates:
+            _, tree_idx = self.tree.query(queries, k=n_candidates)
+            candidates = self.tree_rows[tree_idx]
+        zero_rows = np.broadcast_to(self.zero_rows[:k], (len(queries), min(k, len(self.zero_rows))))
+        candidates = np.concatenate([candidates, zero_rows], axis=1)
+        idx_scores = _rerank(self.index.features, queries, candidates, min(k, candidates.shape[1]))
+        return idx_scores[1], idx_scores[0]
+
+
+class QuantizedBackend:
+    """Scans an int8 or float16 copy of the reference block, then re-ranks exactly.
+
+    int8 codes use one scale per column, folded into the query at search
+    time. The quantization error of every approximate score is bounded per
+    query. Rows whose approximate score is within twice that bound of the
+    k-th best are re-scored against the full-precision block, so the result
+    matches ExactBackend. Only those candidate rows are read.
+    """
+
+    name = "quantized"
+
+    def __init__(self, index, dtype="int8", reference_block=65536):
+        self.index = index
+        self.reference_block = reference_block
+        features = np.asarray(index.features)
+        max_abs = np.abs(features).max(axis=0) if len(features) else np.zeros(features.shape[1])
+        max_abs = np.where(max_abs > 0, max_abs, 1.0).astype(np.float32)
+        if dtype == "int8":
+            self.column_scale = max_abs / 127.0
+            self.codes = np.round(features / self.column_scale).astype(np.int8)
+            self.column_error = self.column_scale / 2
+        elif dtype == "float16":
+            self.column_scale = np.ones(features.shape[1], dtype=np.float32)
+            self.codes = features.astype(np.float16)
+            self.column_error = max_abs * 2.0 ** -11
+        else:
+            raise ValueError(f"Unsupported quantized dtype: {dtype}")
+
+    def _approx_blocks(self, queries):
+        scaled_queries = queries * self.column_scale
+        for r_start in range(0, len(self.codes), self.reference_block):
+            block = self.codes[r_start:r_start + self.reference_block].astype(np.float32)
+            yield r_start, scaled_queries @ block.T
+
+    def search(self, queries, k=1):
+        features = self.index.features
+        k = min(k, len(self.codes))
+        error = np.abs(queries) @ self.column_error + 1e-6
+
+        # Pass 1: k-th best approximate score per query.
+        kth_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        kth_idx = np.zeros((len(queries), 0), dtype=np.int64)
+        for r_start, tile in self._approx_blocks(queries):
+            tile_scores, tile_idx = _top_k_rows(tile, k)
+            kth_scores, kth_idx = _merge_top_k(kth_scores, kth_idx, tile_scores, tile_idx + r_start, k)
+        threshold = kth_scores[:, -1] - 2 * error
+
+        # Pass 2: exact scores for rows that could still make the top k.
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(queries), 0), dtype=np.int64)
+        for r_start, tile in self._approx_blocks(queries):
+            rows = np.flatnonzero((tile >= threshold[:, None]).any(axis=0))
+            if len(rows) == 0:
+                continue
+            exact = queries @ np.asarray(features[rows + r_start], dtype=np.float32).T
+            tile_scores, tile_idx = _top_k_rows(exact, k)
+            best_scores, best_idx = _merge_top_k(best_scores, best_idx, tile_scores, rows[tile_idx] + r_start, k)
+        return best_idx, best_scores
+
+
+backends = {
+    ExactBackend.name: ExactBackend,
+    BallTreeBackend.name: BallTreeBackend,
+    QuantizedBackend.name: QuantizedBackend,
+}
+
+
+def make_backend(name, index, **options):
+    try:
+        backend_cls = backends[name]
+    except KeyError:
+        raise ValueError(f"Unknown nearest-neighbour backend '{name}', expected one of {sorted(backends)}")
+    return backend_cls(index, **options)
+
+
+def footprints_from_neighbours(targets, idx, scores, weighted=False):
+    neighbour_footprints = np.asarray(targets[idx.ravel()], dtype=np.float64).reshape(idx.shape)
+    if idx.shape[1] == 1:
+        return neighbour_footprints[:, 0]
+    if not weighted:
+        return neighbour_footprints.mean(axis=1)
+    weights = np.clip(scores, 0, None).astype(np.float64)
+    totals = weights.sum(axis=1)
+    weighted_mean = (neighbour_footprints * weights).sum(axis=1) / np.where(totals > 0, totals, 1)
+    return np.where(totals > 0, weighted_mean, neighbour_footprints.mean(axis=1))
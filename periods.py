@@ -0,0 +1,23 @@
+from datetime import datetime
+
+# Reporting periods for submissions and their rollups. Kept free of database
+# imports so services without storage can stamp events with them.
+
+periods = ("month", "year")
+month_numbers = {datetime(2000, m, 1).strftime("%B"): m for m in range(1, 13)}
+
+
+def submission_period(now=None):
+    """month/year stamped on a submission; taken per request, not once at import."""
+    now = now or datetime.now()
+    return now.strftime("%B"), now.year
+
+
+def period_buckets(doc):
+    month, year = doc.get("month"), doc.get("year")
+    if year is None:
+        return {}
+    buckets = {"year": str(year)}
+    if month in month_numbers:
+        buckets["month"] = f"{year}-{month_numbers[month]:02d}"
+    return buckets
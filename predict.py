@@ -1,72 +1,213 @@
+"""Offline re-scoring of a user file against the reference snapshot.
+
+Splits the input (CSV or JSONL) into shards, scores every shard in a process
+pool against the memory-mapped reference block, and writes each user's
+predicted footprint plus their top-N most similar reference users to one
+part file per shard. Finished parts are skipped on restart.
+
+    python predict.py --input users.jsonl --output rescore-2024-05 --workers 16
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from sklearn.metrics.pairwise import cosine_similarity
-
-# Step 1: Load Data
-def load_data(file_path):
-    df = pd.read_csv(file_path)
-    return df
-
-# Step 2: Encode Categorical Features
-def preprocess_data(df):
-    # Print column names to check
-    print("Available Columns:", df.columns.tolist())
-
-# Use only existing columns"
-    existing_cols = ["Body Type","Sex","Diet","How Often Shower","Heating Energy Source","Transport","Vehicle Type","Social Activity","Monthly Grocery Bill","Frequency of Traveling by Air","Vehicle Monthly Distance Km","Waste Bag Size","Waste Bag Weekly Count","How Long TV PC Daily Hour","How Many New Clothes Monthly","How Long Internet Daily Hour","Energy efficiency","Recycling","Cooking_With"]
-    categorical_cols = [col for col in existing_cols if col in df.columns]  
-    
-    label_encoders = {}
-    for col in categorical_cols:
-        label_encoders[col] = LabelEncoder()
-        df[col] = label_encoders[col].fit_transform(df[col])
-    
-    df.fillna(0, inplace=True)  # Handle missing values
-    return df
-
-# Step 3: Compute Similarity Matrix
-def compute_similarity_matrix(df):
-    numeric_df = df.select_dtypes(include=[np.number])  # Use only numerical columns
-    similarity_matrix = cosine_similarity(numeric_df)
-    return similarity_matrix
-
-# Step 4: Recommend Users with Similar Footprints
-def recommend_users(user_id, df, similarity_matrix, top_n=5):
-    """Recommend similar users based on similarity scores."""
-    user_idx = df.index.get_loc(user_id)
-    similar_users = np.argsort(similarity_matrix[user_idx])[::-1][1:top_n+1]
-    return df.iloc[similar_users]
-
-# Step 5: Predict Carbon Footprint for a New User
-def predict_carbon_footprint(new_user_data, df, similarity_matrix):
-    df_numeric = df.select_dtypes(include=[np.number])
-    new_user_df = pd.DataFrame([new_user_data], columns=df_numeric.columns)
-    
-    new_user_similarity = cosine_similarity(new_user_df, df_numeric)
-    most_similar_user_idx = np.argmax(new_user_similarity)
-    
-    predicted_carbon = df.iloc[most_similar_user_idx]["Total_Carbon_Footprint"]
-    return predicted_carbon
-
-# Load and preprocess data
-dataset_path = "cleaned_individual_footprint.csv"  # Update with actual path
-df = load_data(dataset_path)
-df = preprocess_data(df)
-
-# Compute similarity matrix
-similarity_matrix = compute_similarity_matrix(df)
-
-# Example: Recommend users similar to user at index 10
-recommended_users = recommend_users(10, df, similarity_matrix)
-print("Recommended Similar Users:")
-print(recommended_users)
-
-# Example: Predict carbon footprint for a new user
-new_user_data = [1, 0, 2, 1, 3, 2, 150, 2500, 3, 7, 2, 1, 1, 2700]  # 14 values
-  # Example input
-print("Number of numerical columns in dataset:", len(df.select_dtypes(include=[np.number]).columns))
-print("Columns:", df.select_dtypes(include=[np.number]).columns.tolist())
-
-predicted_footprint = predict_carbon_footprint(new_user_data, df, similarity_matrix)
-print(f"Predicted Carbon Footprint: {predicted_footprint}")
+from reference_index import load_reference_index
+from encoder import CompiledEncoder
+from neighbors import ExactBackend, normalize_queries, footprints_from_neighbours
+from snapshot import default_snapshot_root, load_or_build_snapshot, build_from_csv, current_snapshot_dir, source_fingerprint
+
+feature_cols = ["Body Type","Sex","Diet","How Often Shower","Heating Energy Source","Transport","Vehicle Type","Social Activity","Monthly Grocery Bill","Frequency of Traveling by Air","Vehicle Monthly Distance Km","Waste Bag Size","Waste Bag Weekly Count","How Long TV PC Daily Hour","How Many New Clothes Monthly","How Long Internet Daily Hour","Energy efficiency","Recycling","Cooking_With"]
+
+
+# Offline batch scoring
+_worker = {}
+
+
+def _init_worker(snapshot_dir):
+    # Every worker maps the same snapshot files, so the reference block is
+    # shared through the page cache instead of copied per process.
+    index = load_reference_index(snapshot_dir)
+    _worker["index"] = index
+    _worker["backend"] = ExactBackend(index)
+    _worker["encoder"] = CompiledEncoder(
+        index.encoder.columns, index.encoder.vocabularies,
+        strict_numeric=False, multi_hot=index.encoder.multi_hot
+    )
+
+
+def read_shards(input_path, shard_size):
+    """Yield lists of {"username", "user_data"} records, shard_size at a time."""
+    if input_path.endswith(".jsonl") or input_path.endswith(".json"):
+        with open(input_path) as f:
+            row = 0
+            while True:
+                lines = [line for line in islice(f, shard_size)]
+                if not lines:
+                    return
+                shard = []
+                for line in lines:
+                    if line.strip():
+                        record = json.loads(line)
+                        user_data = record.get("user_data", record)
+                        shard.append({"username": record.get("username", f"row{row}"), "user_data": user_data})
+                    row += 1
+                yield shard
+    else:
+        row = 0
+        for chunk in pd.read_csv(input_path, chunksize=shard_size):
+            usernames = chunk.pop("username") if "username" in chunk.columns else None
+            user_data_list = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+            yield [
+                {"username": str(usernames.iloc[i]) if usernames is not None else f"row{row + i}", "user_data": user_data}
+                for i, user_data in enumerate(user_data_list)
+            ]
+            row += len(chunk)
+
+
+def count_rows(input_path):
+    with open(input_path, "rb") as f:
+        lines = sum(1 for line in f if line.strip())
+    return lines if input_path.endswith((".jsonl", ".json")) else max(lines - 1, 0)
+
+
+def part_path(output_dir, shard_no, fmt):
+    return os.path.join(output_dir, f"part-{shard_no:05d}.{fmt}")
+
+
+def score_shard(shard_no, records, output_dir, fmt, k, top_n, weighted):
+    index, backend, encoder = _worker["index"], _worker["backend"], _worker["encoder"]
+    queries = normalize_queries(encoder.encode_batch([record["user_data"] for record in records]))
+    # One search serves both the prediction (first k) and the recommendations (first top_n).
+    idx, scores = backend.search(queries, max(k, top_n))
+    predicted = footprints_from_neighbours(index.targets, idx[:, :k], scores[:, :k], weighted)
+    similar_footprints = np.asarray(index.targets[idx[:, :top_n].ravel()], dtype=np.float64).reshape(len(records), -1)
+
+    path = part_path(output_dir, shard_no, fmt)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if fmt == "parquet":
+        pd.DataFrame({
+            "username": [record["username"] for record in records],
+            "predicted_footprint": predicted,
+            "similar_indices": list(idx[:, :top_n]),
+            "similar_scores": list(scores[:, :top_n]),
+            "similar_footprints": list(similar_footprints),
+        }).to_parquet(tmp_path, index=False)
+    else:
+        with open(tmp_path, "w") as f:
+            for i, record in enumerate(records):
+                f.write(json.dumps({
+                    "username": record["username"],
+                    "predicted_footprint": float(predicted[i]),
+                    "similar": [
+                        {"index": int(j), "similarity": float(score), "footprint": float(footprint)}
+                        for j, score, footprint in zip(idx[i, :top_n], scores[i, :top_n], similar_footprints[i])
+                    ]
+                }) + "\n")
+    # Parts appear atomically, so a part on disk is always a finished shard.
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def prepare_output(args, snapshot_version):
+    job = {
+        "input": source_fingerprint(args.input),
+        "shard_size": args.shard_size,
+        "format": args.format,
+        "k": args.k,
+        "top_n": args.top_n,
+        "weighted": args.weighted,
+        "snapshot_version": snapshot_version,
+    }
+    job_path = os.path.join(args.output, "_job.json")
+    if args.restart and os.path.exists(args.output):
+        shutil.rmtree(args.output)
+    os.makedirs(args.output, exist_ok=True)
+    if os.path.exists(job_path):
+        with open(job_path) as f:
+            previous = json.load(f)
+        if previous != job:
+            sys.exit(f"Error: '{args.output}' holds a run with different input or settings; use --restart to discard it.")
+    else:
+        with open(job_path, "w") as f:
+            json.dump(job, f, indent=2)
+
+
+def run(args):
+    index = load_or_build_snapshot(args.dataset, feature_cols, lambda: build_from_csv(args.dataset), args.snapshot_root)
+    snapshot_dir = current_snapshot_dir(args.snapshot_root)
+    if index is None or snapshot_dir is None:
+        sys.exit("Error: no reference snapshot available; run snapshot.py first.")
+    prepare_output(args, index.version)
+
+    total_rows = count_rows(args.input)
+    total_shards = -(-total_rows // args.shard_size)
+    started = time.monotonic()
+    done_rows, skipped_rows, skipped_shards = 0, 0, 0
+    pending = {}
+
+    def report():
+        elapsed = time.monotonic() - started
+        rate = done_rows / elapsed if elapsed > 0 else 0.0
+        remaining = total_rows - done_rows - skipped_rows
+        eta = f"{remaining / rate:.0f}s" if rate > 0 else "?"
+        print(f"{done_rows + skipped_rows}/{total_rows} rows, {rate:.0f} rows/s, eta {eta}",
+              file=sys.stderr)
+
+    def collect(return_when):
+        nonlocal done_rows
+        finished, _ = wait(pending, return_when=return_when)
+        for future in finished:
+            pending.pop(future)
+            done_rows += future.result()
+            report()
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(snapshot_dir,)) as pool:
+        for shard_no, shard in enumerate(read_shards(args.input, args.shard_size)):
+            if os.path.exists(part_path(args.output, shard_no, args.format)):
+                skipped_shards += 1
+                skipped_rows += len(shard)
+                continue
+            # Keep a couple of shards per worker in flight so memory stays bounded.
+            while len(pending) >= args.workers * 2:
+                collect(FIRST_COMPLETED)
+            future = pool.submit(score_shard, shard_no, shard, args.output, args.format,
+                                 args.k, args.top_n, args.weighted)
+            pending[future] = shard_no
+        while pending:
+            collect(FIRST_COMPLETED)
+
+    print(f"Scored {done_rows} rows in {time.monotonic() - started:.1f}s "
+          f"({skipped_shards} of {total_shards} shards already done) into '{args.output}'", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score a user file and precompute similar-user recommendations.")
+    parser.add_argument("--input", required=True, help="CSV or JSONL of questionnaires (optional 'username' field)")
+    parser.add_argument("--output", required=True, help="directory for part files")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=10000)
+    parser.add_argument("--top-n", type=int, default=5, help="similar reference users to keep per user")
+    parser.add_argument("--k", type=int, default=1, help="neighbours averaged into the predicted footprint")
+    parser.add_argument("--weighted", action="store_true", help="similarity-weighted average over the k neighbours")
+    parser.add_argument("--dataset", default="cleaned_individual_footprint.csv")
+    parser.add_argument("--snapshot-root", default=default_snapshot_root)
+    parser.add_argument("--restart", action="store_true", help="discard existing output and start over")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not os.path.exists(args.input):
+        sys.exit(f"Error: File '{args.input}' not found.")
+    if args.format == "parquet":
+        import importlib.util
+        if importlib.util.find_spec("pyarrow") is None:
+            sys.exit("Error: --format parquet needs pyarrow installed.")
+    run(args)
@@ -0,0 +1,143 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class LocalCacheBackend:
+    """In-process LRU map with a per-entry TTL."""
+
+    # get/set never wait on the network
+    blocking = False
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {"entries": len(self._entries), "evictions": self.evictions, "expirations": self.expirations}
+
+
+class RedisCacheBackend:
+    """Shared cache for several workers; Redis applies the TTL and its own eviction policy.
+
+    Entry counts, evictions and expirations live in Redis (INFO), so
+    metrics() does not report them.
+    """
+
+    blocking = True
+
+    def __init__(self, url, ttl=3600, prefix="carbon"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(f"{self.prefix}:{key}")
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(f"{self.prefix}:{key}", json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def clear(self):
+        # Entries of an old version are keyed apart and expire on their own.
+        pass
+
+    def metrics(self):
+        return {"backend": "redis"}
+
+
+def make_cache_backend(url=None, max_entries=10000, ttl=3600, prefix="carbon"):
+    """url=None or "local" keeps the cache in-process; redis://... shares it between workers."""
+    if url and url != "local":
+        return RedisCacheBackend(url, ttl=ttl, prefix=prefix)
+    return LocalCacheBackend(max_entries=max_entries, ttl=ttl)
+
+
+class ResultCache:
+    """Counts hits and misses in front of a cache backend, scoped to one reference version.
+
+    Keys include the version, so a new snapshot never serves results computed
+    against the old one; set_version() also drops the stale local entries.
+    """
+
+    def __init__(self, backend, version=None):
+        self.backend = backend
+        self.version = version
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def set_version(self, version):
+        if version != self.version:
+            self.version = version
+            self.backend.clear()
+            with self._lock:
+                self.invalidations += 1
+
+    def key(self, *parts):
+        digest = hashlib.sha1(str(self.version).encode())
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(np.ascontiguousarray(part, dtype=np.float32).tobytes())
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict({
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }, **self.backend.metrics())
@@ -0,0 +1,195 @@
+import threading
+from collections import Counter, OrderedDict
+from pymongo import UpdateOne
+from db import get_database
+
+EXCLUDED_KEYS = {"Sex"}
+
+
+def canonical_value(value):
+    # Two values count as "unchanged" when they are numerically equal, or
+    # failing that, equal as trimmed lower-case strings.
+    try:
+        return ("n", float(value))
+    except Exception:
+        return ("s", str(value).strip().lower())
+
+
+MISSING_VALUE = canonical_value(None)
+
+
+def _amount_above(histogram, footprint):
+    # Sum of (fp_i - footprint) over earlier entries with fp_i > footprint.
+    amount = 0.0
+    for fp, count in histogram.items():
+        if fp > footprint:
+            amount += (fp - footprint) * count
+    return amount
+
+
+class ReductionState:
+    """Running reduction totals for one user's submissions, in sequence order.
+
+    Equivalent to comparing every earlier entry i with every later entry j:
+    earlier entries are kept as footprint histograms (overall, per key and
+    per key value), so adding entry j costs O(keys * distinct footprints)
+    instead of O(n * keys).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_seq = 0
+        self.count = 0
+        self.total_reduction = 0.0
+        self.contributions = {}
+        self.footprints = {}
+        self.key_footprints = {}
+        self.value_footprints = {}
+
+    def add(self, entry):
+        footprint = float(entry.get("predicted_footprint", 0))
+        user_data = entry.get("user_data", {}) or {}
+        base_amount = _amount_above(self.footprints, footprint)
+        canonical = {key: canonical_value(user_data[key]) for key in user_data if key not in EXCLUDED_KEYS}
+
+        if base_amount > 0:
+            self.total_reduction += base_amount
+            for key, value in canonical.items():
+                unchanged_amount = _amount_above(self.value_footprints.get(key, {}).get(value, {}), footprint)
+                if value == MISSING_VALUE:
+                    # Earlier entries without this key compare as None.
+                    unchanged_amount += base_amount - _amount_above(self.key_footprints.get(key, {}), footprint)
+                changed_amount = base_amount - unchanged_amount
+                if changed_amount > 1e-9:
+                    self.contributions[key] = self.contributions.get(key, 0) + changed_amount
+
+        self.footprints[footprint] = self.footprints.get(footprint, 0) + 1
+        for key, value in canonical.items():
+            key_histogram = self.key_footprints.setdefault(key, {})
+            key_histogram[footprint] = key_histogram.get(footprint, 0) + 1
+            value_histogram = self.value_footprints.setdefault(key, {}).setdefault(value, {})
+            value_histogram[footprint] = value_histogram.get(footprint, 0) + 1
+        self.count += 1
+        self.last_seq = entry.get("seq") or self.last_seq
+
+    def result(self, username):
+        total_reduction = self.total_reduction
+        percent_features = [
+            {k: round((v / total_reduction) * 100, 2)}
+            for k, v in sorted(self.contributions.items(), key=lambda x: -x[1])[:5]
+        ] if total_reduction > 0 else []
+        return {
+            "username": username,
+            "reduced_amount": round(total_reduction, 2),
+            "reducing_attributes": percent_features
+        }
+
+
+class ReductionTracker:
+    """Keeps reduction_insights current as submissions arrive.
+
+    States live in a bounded in-process LRU. Submissions are folded in the
+    order of their per-user seq (see db.assign_sequences); update() only
+    reads those past the last seq it has folded. A submission that lands
+    after a later seq was already folded (another worker's insert finishing
+    late) shows up as a count mismatch, and the state is rebuilt in seq
+    order. An evicted user is rebuilt from their history once.
+    """
+
+    projection = {"predicted_footprint": 1, "user_data": 1, "seq": 1}
+    order = [("seq", 1), ("_id", 1)]
+
+    def __init__(self, users_collection, reduction_collection, max_users=10000):
+        self.users_collection = users_collection
+        self.reduction_collection = reduction_collection
+        self.max_users = max_users
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _state(self, username):
+        with self._lock:
+            state = self._states.pop(username, None) or ReductionState()
+            self._states[username] = state
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+            return state
+
+    def update(self, username):
+        state = self._state(username)
+        with state.lock:
+            query = {"username": username}
+            if state.count:
+                query["seq"] = {"$gt": state.last_seq}
+            changed = False
+            for entry in self.users_collection.find(query, self.projection).sort(self.order):
+                state.add(entry)
+                changed = True
+            if state.count != self.users_collection.count_documents({"username": username}):
+                state = self._rebuild(username)
+                changed = True
+            if not changed or state.count < 2:
+                return None
+            result = state.result(username)
+        self.reduction_collection.update_one({"username": username}, {"$set": result}, upsert=True)
+        return result
+
+    def _rebuild(self, username):
+        state = ReductionState()
+        for entry in self.users_collection.find({"username": username}, self.projection).sort(self.order):
+            state.add(entry)
+        with self._lock:
+            if username in self._states:
+                state.lock = self._states[username].lock
+                self._states[username] = state
+        return state
+
+    def rebuild_all(self, batch_size=1000):
+        """Recompute reductions for every user in one pass over the users collection."""
+        cursor = self.users_collection.find({}, dict(self.projection, username=1)).sort([("username", 1)] + self.order)
+        writes = []
+        updated = 0
+        username, state = None, None
+
+        def finish():
+            if state is not None and state.count >= 2:
+                writes.append(UpdateOne({"username": username}, {"$set": state.result(username)}, upsert=True))
+
+        for entry in cursor:
+            if entry["username"] != username:
+                finish()
+                username, state = entry["username"], ReductionState()
+                if len(writes) >= batch_size:
+                    self.reduction_collection.bulk_write(writes, ordered=False)
+                    updated += len(writes)
+                    writes = []
+            state.add(entry)
+        finish()
+        if writes:
+            self.reduction_collection.bulk_write(writes, ordered=False)
+            updated += len(writes)
+        with self._lock:
+            self._states.clear()
+        return updated
+
+
+def recommend_actions(similar_usernames, reduction_entries):
+    """Most common reducing attributes among the similar users' reduction entries."""
+    reduction_entries = {entry["username"]: entry for entry in reduction_entries}
+    similar_users_recommendations = []
+    for sim_user in similar_usernames:
+        reduction_entry = reduction_entries.get(sim_user)
+        if reduction_entry:
+            for item in reduction_entry.get("reducing_attributes", []):
+                for attr, _ in item.items():
+                    similar_users_recommendations.append(attr)
+    return [
+        {"attribute": attr, "count": count}
+        for attr, count in Counter(similar_users_recommendations).most_common(5)
+    ]
+
+
+if __name__ == '__main__':
+    # MONGO_URI / MONGO_DB select the database, as for the service.
+    db = get_database()
+    tracker = ReductionTracker(db['users'], db['reduction_insights'])
+    print(f"Recomputed reductions for {tracker.rebuild_all()} users")
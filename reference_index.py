@@ -0,0 +1,67 @@
+import os
+import json
+import numpy as np
+from encoder import CompiledEncoder
+
+TARGET_COL = "Total_Carbon_Footprint"
+NON_FEATURE_COLS = ["Total_Carbon_Footprint", "Footprint_Category"]
+
+
+class ReferenceIndex:
+    """L2-normalized float32 reference block with a parallel footprint array."""
+
+    def __init__(self, features, targets, columns, encoder=None, version=None):
+        self.features = features
+        self.targets = targets
+        self.columns = list(columns)
+        self.encoder = encoder
+        self.version = version
+
+    def __len__(self):
+        return len(self.targets)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def build_reference_index(df, label_encoders=None, multi_hot=None):
+    if df is None:
+        return None
+    feature_df = df.drop(columns=NON_FEATURE_COLS, errors='ignore')
+    features = np.ascontiguousarray(feature_df.to_numpy(dtype=np.float32))
+    targets = df[TARGET_COL].to_numpy(dtype=np.float32)
+    encoder = CompiledEncoder.from_label_encoders(label_encoders, feature_df.columns, multi_hot=multi_hot) if label_encoders is not None else None
+    return ReferenceIndex(normalize_rows(features), targets, feature_df.columns, encoder)
+
+
+def save_index_metadata(index_dir, columns, encoder=None):
+    with open(os.path.join(index_dir, "columns.json"), "w") as f:
+        json.dump(list(columns), f)
+    if encoder is not None:
+        encoder.save(os.path.join(index_dir, "encoder.json"))
+
+
+def save_reference_index(index, index_dir):
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "features.npy"), np.ascontiguousarray(index.features, dtype=np.float32))
+    np.save(os.path.join(index_dir, "targets.npy"), np.asarray(index.targets, dtype=np.float32))
+    save_index_metadata(index_dir, index.columns, index.encoder)
+
+
+def load_reference_index(index_dir):
+    try:
+        features = np.load(os.path.join(index_dir, "features.npy"), mmap_mode='r')
+        targets = np.load(os.path.join(index_dir, "targets.npy"), mmap_mode='r')
+        with open(os.path.join(index_dir, "columns.json")) as f:
+            columns = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        encoder = CompiledEncoder.load(os.path.join(index_dir, "encoder.json"))
+    except (FileNotFoundError, ValueError):
+        encoder = None
+    return ReferenceIndex(features, targets, columns, encoder)
@@ -0,0 +1,146 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from db import index_specs, get_database
+from aggregates import categorical_cols, field_key, field_value, merge_update
+from periods import periods, period_buckets
+
+# Rollup documents look like
+#   {"username": name or None (global), "period": "month" | "year", "bucket": "2024-05" | "2024",
+#    "count": n, "sum": total, "min": ..., "max": ...,
+#    "categories": {col: {value: {"count": n, "sum": total}}}, "updated_at": ...}
+# one per user and period bucket plus a global one, kept current with $inc/$min/$max.
+
+
+def rollup_increments(doc):
+    footprint = float(doc.get("predicted_footprint", 0))
+    user_data = doc.get("user_data", {}) or {}
+    increments = {"count": 1, "sum": footprint}
+    for col in categorical_cols:
+        value = field_key(user_data.get(col))
+        increments[f"categories.{col}.{value}.count"] = 1
+        increments[f"categories.{col}.{value}.sum"] = footprint
+    return increments, footprint
+
+
+def rollup_changes(doc, now=None):
+    """(filter, update) for every rollup one submission touches, global rollups included."""
+    increments, footprint = rollup_increments(doc)
+    update = {
+        "$inc": increments,
+        "$min": {"min": footprint},
+        "$max": {"max": footprint},
+        "$set": {"updated_at": now or datetime.utcnow()}
+    }
+    return [
+        ({"username": username, "period": period, "bucket": bucket}, update)
+        for period, bucket in period_buckets(doc).items()
+        for username in (doc.get("username"), None)
+    ]
+
+
+def rollup_updates(docs):
+    """One UpdateOne per touched (username, period, bucket)."""
+    merged = {}
+    now = datetime.utcnow()
+    for doc in docs:
+        for rollup_filter, update in rollup_changes(doc, now):
+            key = tuple(rollup_filter.values())
+            if key in merged:
+                merged[key] = (rollup_filter, merge_update(merged[key][1], update))
+            else:
+                merged[key] = (rollup_filter, update)
+    return [UpdateOne(rollup_filter, update, upsert=True) for rollup_filter, update in merged.values()]
+
+
+def apply_rollups(collection, docs):
+    updates = rollup_updates(docs)
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def materialize_rollup(doc, breakdown=None):
+    count = doc.get("count", 0)
+    rollup = {
+        "bucket": doc["bucket"],
+        "count": count,
+        "mean": round(doc.get("sum", 0) / count, 2) if count else None,
+        "min": doc.get("min"),
+        "max": doc.get("max"),
+    }
+    if breakdown:
+        values = doc.get("categories", {}).get(breakdown, {})
+        rollup["categories"] = {
+            field_value(key): {"count": stats["count"], "mean": round(stats["sum"] / stats["count"], 2)}
+            for key, stats in values.items() if stats.get("count")
+        }
+    return rollup
+
+
+def trend_options(args):
+    """period / limit / breakdown from query-string args; raises ValueError on bad input."""
+    period = args.get("period", "month")
+    breakdown = args.get("by")
+    if period not in periods:
+        raise ValueError(f"period must be one of {list(periods)}")
+    if breakdown and breakdown not in categorical_cols:
+        raise ValueError(f"Unknown breakdown column '{breakdown}'")
+    try:
+        limit = min(max(int(args.get("limit", 12)), 1), 120)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    return {"period": period, "limit": limit, "breakdown": breakdown}
+
+
+def footprint_trend(collection, username=None, period="month", limit=12, breakdown=None):
+    """The last `limit` buckets for one user (or everyone when username is None), oldest first."""
+    projection = {"_id": 0, "bucket": 1, "count": 1, "sum": 1, "min": 1, "max": 1}
+    if breakdown:
+        projection[f"categories.{breakdown}"] = 1
+    docs = collection.find({"username": username, "period": period}, projection).sort("bucket", -1).limit(limit)
+    return [materialize_rollup(doc, breakdown) for doc in reversed(list(docs))]
+
+
+def rebuild_rollups(users_collection, rollups_collection, batch_size=5000):
+    """Recompute every rollup from the stored submissions (backfill or repair).
+
+    The rollups are built in a scratch collection that then replaces the
+    live one in a single rename, so readers never see a half-built trend.
+    The consumer's per-partition offsets are carried over, so events
+    redelivered after the rebuild are still recognised. Submissions stored
+    while the rebuild runs may be missed; pause the writers for an exact result.
+    """
+    scratch = rollups_collection.database[f"{rollups_collection.name}_rebuild"]
+    scratch.drop()
+    for keys, options in index_specs["footprint_rollups"]:
+        scratch.create_index(keys, **options)
+    projection = {"_id": 0, "username": 1, "user_data": 1, "predicted_footprint": 1, "month": 1, "year": 1}
+    batch = []
+    written = 0
+    for doc in users_collection.find({}, projection):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            written += apply_rollups(scratch, batch)
+            batch = []
+    if batch:
+        written += apply_rollups(scratch, batch)
+
+    offsets = [
+        UpdateOne(
+            {"username": doc.get("username"), "period": doc["period"], "bucket": doc["bucket"]},
+            {"$max": {f"offsets.{guard}": offset for guard, offset in doc["offsets"].items()}}
+        )
+        for doc in rollups_collection.find({"offsets": {"$exists": True}},
+                                           {"_id": 0, "username": 1, "period": 1, "bucket": 1, "offsets": 1})
+        if doc["offsets"]
+    ]
+    for start in range(0, len(offsets), batch_size):
+        scratch.bulk_write(offsets[start:start + batch_size], ordered=False)
+    scratch.rename(rollups_collection.name, dropTarget=True)
+    return written
+
+
+if __name__ == '__main__':
+    # MONGO_URI / MONGO_DB select the database, as for the service.
+    db = get_database()
+    print(f"Wrote {rebuild_rollups(db['users'], db['footprint_rollups'])} rollup updates")
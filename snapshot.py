@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from datetime import datetime
+import numpy as np
+from reference_index import NON_FEATURE_COLS, TARGET_COL, build_reference_index, save_reference_index, load_reference_index
+from multi_hot import expand_multi_hot, source_columns
+
+# Bump when the on-disk layout changes; older snapshots then fail validation.
+# 2: Recycling and Cooking_With stored as one 0/1 column per item.
+SNAPSHOT_FORMAT = 2
+default_snapshot_root = "reference_snapshots"
+
+
+def feature_columns(columns):
+    # Expanded item columns count as their source column, so the schema tracks the CSV layout.
+    return [col for col in source_columns(columns) if col not in NON_FEATURE_COLS]
+
+
+def schema_hash(columns):
+    schema = {"format": SNAPSHOT_FORMAT, "columns": feature_columns(columns), "target": TARGET_COL}
+    return hashlib.sha256(json.dumps(schema).encode()).hexdigest()[:16]
+
+
+def source_fingerprint(dataset_path):
+    try:
+        stat = os.stat(dataset_path)
+    except FileNotFoundError:
+        return None
+    return {"path": os.path.abspath(dataset_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def content_hash(index, block_rows=1 << 16):
+    # Hashed in row blocks so a memory-mapped block is never copied whole.
+    digest = hashlib.sha256()
+    for start in range(0, len(index.features), block_rows):
+        digest.update(np.ascontiguousarray(index.features[start:start + block_rows]).tobytes())
+    digest.update(np.ascontiguousarray(index.targets).tobytes())
+    if index.encoder is not None:
+        digest.update(json.dumps(index.encoder.to_dict(), sort_keys=True).encode())
+    return digest.hexdigest()[:12]
+
+
+def read_manifest(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def current_snapshot_dir(root=default_snapshot_root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, version) if version else None
+
+
+def write_snapshot(index, dataset_path, root=default_snapshot_root, build_dir=None):
+    """Write index as a new versioned snapshot and point CURRENT at it.
+
+    build_dir names a directory under root that already holds the index
+    files (see ingest.py); it is renamed into place instead of re-saved.
+    """
+    version = f"{schema_hash(index.columns)[:8]}-{content_hash(index)}"
+    snapshot_dir = os.path.join(root, version)
+    manifest = {
+        "version": version,
+        "format": SNAPSHOT_FORMAT,
+        "schema_hash": schema_hash(index.columns),
+        "columns": index.columns,
+        "rows": len(index),
+        "source": source_fingerprint(dataset_path),
+        "created_at": datetime.utcnow().isoformat()
+    }
+    if os.path.exists(snapshot_dir):
+        # Same content from a touched or copied CSV: only refresh the source fingerprint.
+        if build_dir:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        tmp_manifest = os.path.join(snapshot_dir, f".manifest.{os.getpid()}.tmp")
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_manifest, os.path.join(snapshot_dir, "manifest.json"))
+    else:
+        # Build in a private directory, then rename: readers never see a partial snapshot.
+        tmp_dir = build_dir or os.path.join(root, f".{version}.{os.getpid()}.tmp")
+        if not build_dir:
+            save_reference_index(index, tmp_dir)
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        try:
+            os.rename(tmp_dir, snapshot_dir)
+        except OSError:
+            # Another worker published the same version first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_current = os.path.join(root, f".CURRENT.{os.getpid()}.tmp")
+    with open(tmp_current, "w") as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, "CURRENT"))
+    return snapshot_dir
+
+
+def snapshot_problem(manifest, expected_columns, dataset_path=None):
+    if manifest is None:
+        return "missing"
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        return "format"
+    if manifest.get("schema_hash") != schema_hash(expected_columns):
+        return "schema"
+    source = source_fingerprint(dataset_path) if dataset_path else None
+    recorded = manifest.get("source")
+    if source and recorded and (source["size"], source["mtime_ns"]) != (recorded["size"], recorded["mtime_ns"]):
+        return "stale"
+    return None
+
+
+def load_snapshot(snapshot_dir, expected_columns, dataset_path=None):
+    if snapshot_dir is None or snapshot_problem(read_manifest(snapshot_dir), expected_columns, dataset_path):
+        return None
+    index = load_reference_index(snapshot_dir)
+    if index is not None:
+        index.version = read_manifest(snapshot_dir)["version"]
+    return index
+
+
+def load_or_build_snapshot(dataset_path, expected_columns, build, root=default_snapshot_root):
+    """Memory-map the current snapshot, or rebuild it from the CSV when missing or stale."""
+    snapshot_dir = current_snapshot_dir(root)
+    index = load_snapshot(snapshot_dir, expected_columns, dataset_path)
+    if index is not None:
+        return index
+    problem = snapshot_problem(read_manifest(snapshot_dir) if snapshot_dir else None, expected_columns, dataset_path)
+    print(f"Reference snapshot {problem}, rebuilding from '{dataset_path}'")
+    index = build()
+    if index is None:
+        return None
+    if index.version is not None:
+        # The builder published the snapshot itself (stream_build).
+        return index
+    try:
+        return load_snapshot(write_snapshot(index, dataset_path, root), expected_columns) or index
+    except OSError as e:
+        print(f"Could not write reference snapshot: {e}")
+        return index
+
+
+def build_from_csv(dataset_path):
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder
+
+    df, multi_hot = expand_multi_hot(pd.read_csv(dataset_path))
+    label_encoders = {}
+    for col in df.columns:
+        if df[col].dtype == 'object':
+            label_encoders[col] = LabelEncoder()
+            df[col] = label_encoders[col].fit_transform(df[col])
+    df.fillna(0, inplace=True)
+    return build_reference_index(df, label_encoders, multi_hot)
+
+
+def stream_build(dataset_path, root=default_snapshot_root, chunk_size=200000):
+    """Build and publish a snapshot with the chunked ingestion path; returns it memory-mapped."""
+    from ingest import stream_reference_index
+
+    os.makedirs(root, exist_ok=True)
+    build_dir = os.path.join(root, f".build.{os.getpid()}.tmp")
+    shutil.rmtree(build_dir, ignore_errors=True)
+    try:
+        index = stream_reference_index(dataset_path, build_dir, chunk_size)
+        snapshot_dir = write_snapshot(index, dataset_path, root, build_dir=build_dir)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    index = load_reference_index(snapshot_dir)
+    index.version = read_manifest(snapshot_dir)["version"]
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a memory-mappable snapshot of the reference dataset.")
+    parser.add_argument("--dataset", default="cleaned_individual_footprint.csv")
+    parser.add_argument("--root", default=default_snapshot_root)
+    parser.add_argument("--stream", action="store_true",
+                        help="encode in chunks straight to disk; for datasets larger than memory")
+    parser.add_argument("--chunk-size", type=int, default=200000)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset):
+        sys.exit(f"Error: File '{args.dataset}' not found.")
+    if args.stream:
+        snapshot_dir = os.path.join(args.root, stream_build(args.dataset, args.root, args.chunk_size).version)
+    else:
+        snapshot_dir = write_snapshot(build_from_csv(args.dataset), args.dataset, args.root)
+    manifest = read_manifest(snapshot_dir)
+    print(f"Wrote snapshot {manifest['version']} ({manifest['rows']} rows) to {snapshot_dir}")
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules live at the repository root rather than in an installed package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# db reads its settings at import; tests never talk to a real server or broker.
+os.environ.setdefault("MONGO_URI", "mongomock://")
+os.environ.setdefault("KAFKA_PRODUCER", "memory")
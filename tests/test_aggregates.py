@@ -0,0 +1,139 @@
+import pytest
+from pymongo.errors import BulkWriteError
+from db import ensure_indexes
+from aggregates import (
+    apply_aggregate, apply_aggregates_bulk, materialize_aggregate, migrate_aggregates, migrate_history_document
+)
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def collection():
+    db = mongomock.MongoClient().db
+    ensure_indexes(db)
+    return db.aggregate
+
+
+def test_missing_answers_read_back_as_none(collection):
+    apply_aggregate(collection, "u", {"Diet": "vegan"})
+    apply_aggregate(collection, "u", {"Monthly Grocery Bill": 100})
+    aggregated = apply_aggregate(collection, "u", {"Monthly Grocery Bill": 200})
+    assert aggregated["Diet"] is None
+    assert aggregated["Transport"] is None
+    assert aggregated["Monthly Grocery Bill"] == 100.0
+
+
+def test_mode_keeps_escaped_values_and_first_on_ties(collection):
+    apply_aggregate(collection, "u", {"Diet": "v.e$gan%"})
+    apply_aggregate(collection, "u", {"Diet": "omnivore"})
+    assert materialize_aggregate(collection.find_one({"username": "u"}))["Diet"] == "v.e$gan%"
+
+
+def legacy_document(username="old"):
+    # Legacy aggregates stored means and modes, and every *_history list but one
+    # skipped the first submission: here three submissions, two of them vegan.
+    return {
+        "username": username,
+        "Monthly Grocery Bill": 150.0,
+        "Vehicle Monthly Distance Km": "n/a",
+        "Diet": "vegan",
+        "Diet_history": ["omnivore", "vegan"],
+        "Transport_history": ["public"],
+        "Transport": "public",
+    }
+
+
+def test_migrate_history_document_counts_the_dropped_first_submission():
+    update = migrate_history_document(legacy_document())
+    increments = update["$inc"]
+    assert increments["count"] == 3
+    assert increments["sums.Monthly Grocery Bill"] == 450.0
+    assert increments["sums.Vehicle Monthly Distance Km"] == 0.0
+    assert increments["counts.Diet.omnivore"] == 1
+    assert increments["counts.Diet.vegan"] == 1
+    assert increments["counts.Transport.public"] == 1
+    # Columns without a history fall back to the stored mode.
+    assert increments["counts.Body Type.None"] == 1
+    assert {"Diet", "Diet_history", "Monthly Grocery Bill"} <= set(update["$unset"])
+    assert update["$currentDate"] == {"updated_at": True}
+
+
+def test_migrate_history_document_without_histories():
+    update = migrate_history_document({"username": "old", "Monthly Grocery Bill": 80, "Diet": "vegan"})
+    assert update["$inc"]["count"] == 1
+    assert update["$inc"]["sums.Monthly Grocery Bill"] == 80.0
+    assert update["$inc"]["counts.Diet.vegan"] == 1
+
+
+def test_migrate_aggregates_keeps_counters_added_after_the_upgrade(collection):
+    collection.insert_one(legacy_document())
+    collection.insert_one(legacy_document("other"))
+    # New code already $inc'ed one submission into the legacy document.
+    apply_aggregate(collection, "old", {"Monthly Grocery Bill": 350, "Diet": "omnivore"})
+
+    assert migrate_aggregates(collection, batch_size=1) == 2
+    assert migrate_aggregates(collection) == 0
+
+    doc = collection.find_one({"username": "old"})
+    assert doc["count"] == 4
+    assert doc["sums"]["Monthly Grocery Bill"] == 800.0
+    assert doc["counts"]["Diet"] == {"omnivore": 2, "vegan": 1}
+    assert not {"Diet", "Diet_history", "Monthly Grocery Bill"} & set(doc)
+    assert materialize_aggregate(doc)["Monthly Grocery Bill"] == 200.0
+    assert collection.find_one({"username": "other"})["count"] == 3
+
+
+def test_apply_aggregates_bulk_merges_records_per_user(collection):
+    result = apply_aggregates_bulk(collection, [
+        {"username": "a", "user_data": {"Monthly Grocery Bill": 100, "Diet": "vegan"}},
+        {"username": "b", "user_data": {"Monthly Grocery Bill": 50}},
+        {"username": "a", "user_data": {"Monthly Grocery Bill": 300, "Diet": "vegan"}},
+    ])
+    assert result["a"]["count"] == 2
+    assert result["a"]["Monthly Grocery Bill"] == 200.0
+    assert result["a"]["Diet"] == "vegan"
+    assert result["b"]["count"] == 1
+    assert apply_aggregates_bulk(collection, []) == {}
+
+
+class RacingCollection:
+    """The first bulk_write loses an upsert race: another writer creates the document first."""
+
+    def __init__(self, collection, username):
+        self.collection = collection
+        self.username = username
+        self.raced = False
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    def bulk_write(self, writes, ordered=True):
+        if self.raced:
+            return self.collection.bulk_write(writes, ordered=ordered)
+        self.raced = True
+        apply_aggregate(self.collection, self.username, {"Monthly Grocery Bill": 100})
+        index = next(i for i, write in enumerate(writes) if write._filter == {"username": self.username})
+        self.collection.bulk_write([write for i, write in enumerate(writes) if i != index], ordered=False)
+        raise BulkWriteError({"writeErrors": [{"index": index, "code": 11000, "errmsg": "E11000 duplicate key"}],
+                              "nUpserted": len(writes) - 1})
+
+
+def test_apply_aggregates_bulk_retries_a_lost_upsert_race(collection):
+    racing = RacingCollection(collection, "raced")
+    result = apply_aggregates_bulk(racing, [
+        {"username": "fresh", "user_data": {"Monthly Grocery Bill": 10}},
+        {"username": "raced", "user_data": {"Monthly Grocery Bill": 300}},
+    ])
+    assert result["raced"]["count"] == 2
+    assert result["raced"]["Monthly Grocery Bill"] == 200.0
+    assert result["fresh"]["count"] == 1
+
+
+def test_apply_aggregates_bulk_raises_other_write_errors(collection):
+    class Failing(RacingCollection):
+        def bulk_write(self, writes, ordered=True):
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 2, "errmsg": "bad update"}]})
+
+    with pytest.raises(BulkWriteError):
+        apply_aggregates_bulk(Failing(collection, "u"), [{"username": "u", "user_data": {}}])
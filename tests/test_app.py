@@ -0,0 +1,137 @@
+import os
+import json
+import asyncio
+import importlib
+import pytest
+from rollups import apply_rollups
+
+pytest.importorskip("flask")
+pytest.importorskip("mongomock")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def service():
+    with pytest.MonkeyPatch.context() as patch:
+        # The service reads its dataset and snapshots relative to the repository root.
+        patch.chdir(ROOT)
+        patch.setenv("MODEL_WATCH_INTERVAL", "0")
+        patch.setenv("STRICT_NUMERIC", "1")
+        patch.delenv("FEATURES", raising=False)
+        patch.delenv("WRITE_PATH", raising=False)
+        yield importlib.import_module("app")
+
+
+@pytest.fixture
+def client(service):
+    return service.app.test_client()
+
+
+@pytest.fixture
+def user_data(service):
+    return dict(zip(service.all_cols, [
+        "overweight", "male", "omnivore", "more frequently", "wood", "private", "petrol", "never", 138,
+        "never", 2472, "small", 1, 14, 47, 6, "Sometimes", "['Metal']", "['Oven', 'Microwave']"
+    ]))
+
+
+def test_batch_scores_every_record(client, user_data):
+    response = client.post("/predict/batch", json={"records": [
+        {"username": "batch-a", "user_data": user_data},
+        {"username": "batch-b", "user_data": dict(user_data, Diet="vegan")},
+    ]})
+    assert response.status_code == 200
+    assert [result["username"] for result in response.json["results"]] == ["batch-a", "batch-b"]
+
+
+def test_batch_rejects_an_unparseable_number_with_its_position(client, user_data):
+    response = client.post("/predict/batch", json={"records": [
+        {"username": "batch-a", "user_data": user_data},
+        {"username": "batch-b", "user_data": dict(user_data, **{"Monthly Grocery Bill": "lots"})},
+    ]})
+    assert response.status_code == 400
+    assert response.json["error"].startswith("Invalid input at record 1")
+
+
+@pytest.mark.parametrize("record", [{"username": "u"}, {"username": "u", "user_data": ["x"]}, "u", {"user_data": {"Diet": "vegan"}}])
+def test_batch_rejects_malformed_records(client, user_data, record):
+    response = client.post("/predict/batch", json={"records": [{"username": "ok", "user_data": user_data}, record]})
+    assert response.status_code == 400
+    assert response.json["error"] == "Invalid input at record 1"
+
+
+@pytest.fixture(scope="module")
+def trends(service):
+    apply_rollups(service.rollups_collection, [
+        {"username": "trend-user", "user_data": {"Diet": diet}, "predicted_footprint": footprint, "month": month, "year": 2019}
+        for diet, footprint, month in [("vegan", 1000.0, "March"), ("omnivore", 3000.0, "March"), ("vegan", 2000.0, "April")]
+    ])
+
+
+def test_user_trend(client, trends):
+    response = client.get("/trends/trend-user?by=Diet")
+    assert response.status_code == 200
+    assert response.json["username"] == "trend-user"
+    assert response.json["period"] == "month"
+    march, april = response.json["buckets"]
+    assert (march["bucket"], march["count"], march["mean"]) == ("2019-03", 2, 2000.0)
+    assert march["categories"] == {"vegan": {"count": 1, "mean": 1000.0}, "omnivore": {"count": 1, "mean": 3000.0}}
+    assert (april["bucket"], april["min"], april["max"]) == ("2019-04", 2000.0, 2000.0)
+
+
+def test_global_trend(client, trends):
+    response = client.get("/trends?period=year&limit=120")
+    assert response.status_code == 200
+    assert response.json["username"] is None
+    assert {"bucket": "2019", "count": 3, "mean": 2000.0, "min": 1000.0, "max": 3000.0} in response.json["buckets"]
+
+
+@pytest.mark.parametrize("query", ["period=week", "by=nope", "limit=ten"])
+def test_trend_rejects_bad_options(client, query):
+    response = client.get(f"/trends/trend-user?{query}")
+    assert response.status_code == 400
+    assert "error" in response.json
+
+
+def asgi_get(path, query_string=b""):
+    # Imported after the service fixture has set up the environment.
+    import asgi
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [], "query_string": query_string}
+    asyncio.run(asgi.app(scope, receive, send))
+    return messages[0]["status"], json.loads(messages[1]["body"])
+
+
+def test_asgi_trends_match_flask(client, trends):
+    status, payload = asgi_get("/trends/trend-user", b"by=Diet&limit=2")
+    assert status == 200
+    assert payload == client.get("/trends/trend-user?by=Diet&limit=2").json
+    assert asgi_get("/trends", b"period=fortnight")[0] == 400
+
+
+def test_profiler_is_released_when_a_view_raises(service, client, monkeypatch, tmp_path):
+    def broken():
+        raise RuntimeError("metrics unavailable")
+
+    monkeypatch.setattr(service.request_profiler, "sample_rate", 1.0)
+    monkeypatch.setattr(service.request_profiler, "output_dir", str(tmp_path))
+    written = service.request_profiler.profiles_written
+    with monkeypatch.context() as patch:
+        patch.setattr(service.predict_batcher, "metrics", broken)
+        # As under app.run(debug=True): the exception propagates and after_request never runs.
+        patch.setitem(service.app.config, "PROPAGATE_EXCEPTIONS", True)
+        with pytest.raises(RuntimeError):
+            client.get("/predict/metrics")
+
+    # The next sampled request can take the profiler again.
+    assert client.get("/cache/metrics").status_code == 200
+    assert service.request_profiler.profiles_written == written + 2
+    assert len(list(tmp_path.iterdir())) == 2
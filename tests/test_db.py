@@ -0,0 +1,108 @@
+import pytest
+from db import WriteBehindBuffer, assign_sequences
+
+mongomock = pytest.importorskip("mongomock")
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+class FlakyCollection:
+    """Fails the first `failures` inserts, then writes through."""
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+        self.attempts = 0
+
+    def _attempt(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise RuntimeError("connection reset")
+
+    def insert_one(self, doc):
+        self._attempt()
+        return self.collection.insert_one(doc)
+
+    def insert_many(self, docs, ordered=True):
+        self._attempt()
+        return self.collection.insert_many(docs, ordered=ordered)
+
+
+def test_close_flushes_queued_documents_in_batches(db):
+    flushed = []
+    writer = WriteBehindBuffer(db.users, durability="buffered", max_batch=4, flush_interval=60, on_flush=flushed.append)
+    writer.insert_many([{"username": "u", "n": n} for n in range(10)])
+    writer.insert({"username": "u", "n": 10})
+    writer.close()
+
+    assert sorted(doc["n"] for doc in db.users.find()) == list(range(11))
+    assert sum(len(docs) for docs in flushed) == 11
+    assert all(len(docs) <= 4 for docs in flushed)
+    metrics = writer.metrics()
+    assert metrics["documents_written"] == 11
+    assert metrics["queue_depth"] == 0
+
+
+def test_failed_batches_are_retried(db):
+    flaky = FlakyCollection(db.users, failures=2)
+    writer = WriteBehindBuffer(flaky, durability="buffered", flush_interval=60, max_retries=3)
+    writer.insert({"username": "u"})
+    writer.close()
+
+    assert db.users.count_documents({}) == 1
+    metrics = writer.metrics()
+    assert metrics["write_retries"] == 2
+    assert metrics["batches_failed"] == metrics["documents_dropped"] == 0
+
+
+def test_batches_that_keep_failing_are_dropped_and_counted(db):
+    writer = WriteBehindBuffer(FlakyCollection(db.users, failures=100), durability="buffered",
+                               flush_interval=60, max_retries=1)
+    writer.insert({"username": "u"})
+    writer.close()
+
+    metrics = writer.metrics()
+    assert metrics["write_retries"] == 1
+    assert metrics["batches_failed"] == 1
+    assert metrics["documents_dropped"] == 1
+    assert metrics["documents_written"] == 0
+
+
+def test_a_retried_insert_that_already_landed_is_not_duplicated(db):
+    writer = WriteBehindBuffer(db.users)
+    docs = [{"username": "u", "n": 1}, {"username": "u", "n": 2}]
+    db.users.insert_one(docs[0])
+    writer.insert_many(docs)
+    assert db.users.count_documents({}) == 2
+
+
+def test_on_flush_failures_do_not_undo_the_insert(db):
+    def refresh(docs):
+        raise RuntimeError("rollups unavailable")
+
+    writer = WriteBehindBuffer(db.users, on_flush=refresh)
+    writer.insert({"username": "u"})
+    assert db.users.count_documents({}) == 1
+    assert writer.metrics()["on_flush_failures"] == 1
+    assert writer.metrics()["documents_written"] == 1
+
+
+def test_documents_get_per_user_sequence_numbers(db):
+    writer = WriteBehindBuffer(db.users, durability="buffered", flush_interval=60, sequences=db.user_sequences)
+    writer.insert_many([{"username": name} for name in ["a", "b", "a", "a"]])
+    writer.close()
+    writer = WriteBehindBuffer(db.users, sequences=db.user_sequences)
+    writer.insert({"username": "b"})
+
+    seqs = {}
+    for doc in db.users.find().sort("_id", 1):
+        seqs.setdefault(doc["username"], []).append(doc["seq"])
+    assert seqs == {"a": [1, 2, 3], "b": [1, 2]}
+
+
+def test_assign_sequences_keeps_existing_numbers(db):
+    docs = assign_sequences(db.user_sequences, [{"username": "a", "seq": 7}, {"username": "a"}])
+    assert [doc["seq"] for doc in docs] == [7, 1]
@@ -0,0 +1,163 @@
+import json
+import pytest
+from event_emitter import InMemoryBroker, InMemoryProducer, InMemoryConsumer
+from pymongo.errors import BulkWriteError
+from db import ensure_indexes
+from rollups import rollup_changes
+from event_consumer import EventConsumer, consumer_conf, guarded_writes
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def prediction(username, footprint, diet, event_id):
+    return {
+        "event_type": "prediction",
+        "event_id": event_id,
+        "username": username,
+        "user_data": {"Diet": diet, "Monthly Grocery Bill": 150},
+        "predicted_footprint": footprint,
+        "month": "May",
+        "year": 2024
+    }
+
+
+def snapshot(db):
+    return {
+        name: sorted((dict(doc, _id=None) for doc in db[name].find()), key=repr)
+        for name in ("users", "aggregate", "footprint_rollups", "reduction_insights")
+    }
+
+
+def make_consumer(broker, db, group):
+    consumer = EventConsumer(InMemoryConsumer(broker, consumer_conf(group)), db, topic="events", poll_timeout=0.01)
+    consumer.consumer.subscribe(["events"])
+    return consumer
+
+
+@pytest.fixture
+def published():
+    broker = InMemoryBroker(partitions=2)
+    producer = InMemoryProducer({}, broker)
+    events = [
+        prediction("alice", 3000.0, "omnivore", "e1"),
+        prediction("bob", 2500.0, "omnivore", "e2"),
+        prediction("alice", 2000.0, "vegan", "e3"),
+        prediction("bob", 2600.0, "vegetarian", "e4"),
+        prediction("alice", 1500.0, "vegan", "e5"),
+    ]
+    for event in events:
+        producer.produce("events", key=event["username"], value=json.dumps(event))
+    producer.produce("events", key="alice", value=json.dumps(dict(events[0], predicted_footprint=None)))
+    producer.produce("events", key="alice", value=b"not json")
+    producer.flush()
+    return broker, events
+
+
+def drain(consumer):
+    while consumer.run_once():
+        pass
+
+
+def test_consumer_writes_each_event_once(published):
+    broker, events = published
+    db = mongomock.MongoClient().db
+    consumer = make_consumer(broker, db, "g1")
+    drain(consumer)
+
+    assert db.users.count_documents({}) == len(events)
+    assert sorted(doc["seq"] for doc in db.users.find({"username": "alice"})) == [1, 2, 3]
+    alice = db.aggregate.find_one({"username": "alice"})
+    assert alice["count"] == 3
+    assert db.reduction_insights.find_one({"username": "alice"})["reduced_amount"] == 3000.0
+    metrics = consumer.metrics()
+    assert metrics["events"] == len(events)
+    assert metrics["invalid"] == 2
+    assert sum(metrics["lag"].values()) == 0
+
+
+def test_redelivered_events_change_nothing(published):
+    broker, _ = published
+    db = mongomock.MongoClient().db
+    drain(make_consumer(broker, db, "g1"))
+    before = snapshot(db)
+
+    # A fresh group starts from the earliest offset, as a member does when it
+    # crashes after writing a batch but before committing it.
+    redelivery = make_consumer(broker, db, "g2")
+    drain(redelivery)
+
+    assert snapshot(db) == before
+    assert redelivery.metrics()["duplicates_skipped"] == 5
+
+
+def test_reprocessing_a_batch_is_idempotent(published):
+    broker, _ = published
+    db = mongomock.MongoClient().db
+    consumer = make_consumer(broker, db, "g1")
+    messages = consumer.consumer.consume(num_messages=100, timeout=0.01)
+    consumer.process(messages)
+    before = snapshot(db)
+    consumer.process(messages)
+    assert snapshot(db) == before
+
+
+class RacingCollection:
+    """Lets another consumer create the target documents between our read and our upsert.
+
+    The first bulk_write runs `competitor` and then fails every upsert with
+    E11000, as the server does when two upserts insert the same new document.
+    """
+
+    def __init__(self, collection, competitor):
+        self.collection = collection
+        self.competitor = competitor
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    def bulk_write(self, writes, ordered=True):
+        if self.competitor is None:
+            return self.collection.bulk_write(writes, ordered=ordered)
+        competitor, self.competitor = self.competitor, None
+        competitor()
+        raise BulkWriteError({
+            "writeErrors": [{"index": i, "code": 11000, "errmsg": "E11000 duplicate key"} for i in range(len(writes))],
+            "nUpserted": 0,
+        })
+
+
+def global_bucket_changes(guard, offset, footprint):
+    event = prediction(f"user-{guard}", footprint, "vegan", f"{guard}-{offset}")
+    return [(guard, offset, rollup_filter, update)
+            for rollup_filter, update in rollup_changes(event) if rollup_filter["username"] is None]
+
+
+def test_two_partitions_creating_the_same_global_bucket():
+    db = mongomock.MongoClient().db
+    ensure_indexes(db)
+    rollups = db.footprint_rollups
+    racing = RacingCollection(rollups, lambda: guarded_writes(rollups, global_bucket_changes("p1", 7, 1000.0)))
+
+    guarded_writes(racing, global_bucket_changes("p0", 3, 3000.0))
+
+    month = rollups.find_one({"username": None, "period": "month"})
+    assert month["count"] == 2
+    assert month["sum"] == 4000.0
+    assert month["offsets"] == {"p0": 3, "p1": 7}
+    assert rollups.find_one({"username": None, "period": "year"})["count"] == 2
+
+
+def test_duplicate_key_on_an_applied_offset_changes_nothing():
+    db = mongomock.MongoClient().db
+    ensure_indexes(db)
+    rollups = db.footprint_rollups
+    guarded_writes(rollups, global_bucket_changes("p0", 3, 3000.0))
+    before = snapshot(db)
+
+    class StaleRead(RacingCollection):
+        def find(self, *args, **kwargs):
+            return iter(())
+
+    # Without the offsets read, the upsert reaches the server and hits the unique index.
+    guarded_writes(StaleRead(rollups, None), global_bucket_changes("p0", 3, 3000.0))
+    assert snapshot(db) == before
@@ -0,0 +1,72 @@
+import json
+from event_emitter import EventEmitter, InMemoryBroker, InMemoryProducer, InMemoryConsumer
+
+
+def test_emitted_events_are_delivered_in_order():
+    producer = InMemoryProducer()
+    emitter = EventEmitter(producer, "events", max_queue_size=100, batch_size=7, poll_interval=0.01).start()
+    for i in range(50):
+        assert emitter.emit(f"user-{i % 3}", {"n": i})
+    emitter.close()
+
+    assert [json.loads(message.value())["n"] for message in producer.messages] == list(range(50))
+    assert [message.offset() for message in producer.messages] == list(range(50))
+    metrics = emitter.metrics()
+    assert metrics["enqueued"] == metrics["delivered"] == 50
+    assert metrics["dropped"] == metrics["failed"] == 0
+    assert metrics["queue_depth"] == metrics["producer_in_flight"] == 0
+
+
+def test_events_reach_consumers_through_the_broker():
+    broker = InMemoryBroker(partitions=3)
+    emitter = EventEmitter(InMemoryProducer({}, broker), "events")
+    for i in range(10):
+        emitter.emit("alice" if i % 2 else "bob", {"n": i})
+    emitter.flush()
+
+    consumer = InMemoryConsumer(broker, {"group.id": "readers"})
+    consumer.subscribe(["events"])
+    messages = consumer.consume(num_messages=100, timeout=0.01)
+    by_key = {}
+    for message in messages:
+        by_key.setdefault(message.key(), set()).add(message.partition())
+        assert message.offset() < broker.watermarks("events", message.partition())[1]
+    assert len(messages) == 10
+    # Every event for a user lands on one partition, so it is consumed in order.
+    assert all(len(partitions) == 1 for partitions in by_key.values())
+
+
+def test_full_queue_drops_instead_of_blocking():
+    producer = InMemoryProducer()
+    # No pump thread, so nothing drains the queue until flush().
+    emitter = EventEmitter(producer, "events", max_queue_size=2)
+    assert emitter.emit("u", {"n": 1})
+    assert emitter.emit("u", {"n": 2})
+    assert not emitter.emit("u", {"n": 3})
+
+    metrics = emitter.metrics()
+    assert metrics["enqueued"] == 2
+    assert metrics["dropped"] == 1
+    assert metrics["queue_depth"] == 2
+
+    emitter.flush()
+    assert [json.loads(message.value())["n"] for message in producer.messages] == [1, 2]
+    assert emitter.emit("u", {"n": 4})
+
+
+class FailingProducer(InMemoryProducer):
+    def poll(self, timeout=0):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for message, callback in pending:
+            callback("broker unavailable", message)
+        return len(pending)
+
+
+def test_delivery_failures_are_counted():
+    emitter = EventEmitter(FailingProducer(), "events")
+    emitter.emit("u", {"n": 1})
+    emitter.flush()
+    metrics = emitter.metrics()
+    assert metrics["failed"] == 1
+    assert metrics["delivered"] == 0
@@ -0,0 +1,47 @@
+import re
+import pytest
+from features import parse_features, all_features, requirements
+
+
+@pytest.mark.parametrize("value", [None, "all", " all "])
+def test_all_features_by_default(value):
+    assert parse_features(value) == set(all_features)
+
+
+@pytest.mark.parametrize("value", ["none", "", " , ", "none,"])
+def test_no_features(value):
+    assert parse_features(value) == set()
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("storage", {"storage"}),
+    ("kafka", {"kafka"}),
+    (" storage , trends ", {"storage", "trends"}),
+    ("storage,reductions,recommendations", {"storage", "reductions", "recommendations"}),
+    ("none,storage", {"storage"}),
+])
+def test_feature_lists(value, expected):
+    assert parse_features(value) == expected
+
+
+@pytest.mark.parametrize("value, message", [
+    ("trends", "'trends' needs ['storage']"),
+    ("recommendations", "'recommendations' needs ['storage', 'reductions']"),
+    ("storage,recommendations", "'recommendations' needs ['reductions']"),
+    ("kafka,reductions", "'reductions' needs ['storage']"),
+])
+def test_features_need_their_requirements(value, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        parse_features(value)
+
+
+@pytest.mark.parametrize("value", ["storage,mongo", "Storage", "all,storage"])
+def test_unknown_features_are_rejected(value):
+    with pytest.raises(ValueError, match="Unknown FEATURES"):
+        parse_features(value)
+
+
+def test_every_requirement_is_a_known_feature():
+    for name, required in requirements.items():
+        assert {name, *required} <= set(all_features)
+        assert parse_features(",".join((name,) + required)) == {name, *required}
@@ -0,0 +1,88 @@
+import time
+import threading
+import pytest
+from micro_batcher import MicroBatcher
+
+
+class GatedScorer:
+    """Records batch sizes; the first batch blocks until release() so later items pile up."""
+
+    def __init__(self, fail=False):
+        self.sizes = []
+        self.fail = fail
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, items):
+        self.sizes.append(len(items))
+        if len(self.sizes) == 1:
+            self.started.set()
+            self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError(f"scoring failed for {len(items)} items")
+        return [item * 10 for item in items]
+
+    def release(self):
+        self.gate.set()
+
+
+def test_batches_fill_up_to_max_size():
+    scorer = GatedScorer()
+    batcher = MicroBatcher(scorer, max_batch_size=4, max_wait_us=200000).start()
+    try:
+        first = batcher.submit(0)
+        assert scorer.started.wait(5)
+        futures = [batcher.submit(n) for n in range(1, 11)]
+        scorer.release()
+        assert first.result(5) == 0
+        assert [future.result(5) for future in futures] == [n * 10 for n in range(1, 11)]
+    finally:
+        batcher.close()
+    assert scorer.sizes == [1, 4, 4, 2]
+    metrics = batcher.metrics()
+    assert metrics["batches"] == 4
+    assert metrics["items"] == 11
+    assert metrics["batch_size_max"] == 4
+    assert metrics["batch_size_buckets"] == {"1": 1, "2": 1, "4": 2}
+
+
+def test_partial_batch_flushes_after_the_wait():
+    sizes = []
+
+    def score(items):
+        sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(score, max_batch_size=64, max_wait_us=50000).start()
+    try:
+        started = time.monotonic()
+        assert batcher(7, timeout=5) == 7
+        elapsed = time.monotonic() - started
+    finally:
+        batcher.close()
+    assert sizes == [1]
+    assert 0.04 <= elapsed < 2
+
+
+def test_a_failed_batch_fails_every_waiter():
+    scorer = GatedScorer(fail=True)
+    batcher = MicroBatcher(scorer, max_batch_size=8, max_wait_us=100000).start()
+    try:
+        first = batcher.submit(0)
+        assert scorer.started.wait(5)
+        futures = [batcher.submit(n) for n in range(1, 6)]
+        scorer.release()
+        for future in [first] + futures:
+            with pytest.raises(RuntimeError):
+                future.result(5)
+    finally:
+        batcher.close()
+    assert scorer.sizes == [1, 5]
+    assert futures[0].exception() is futures[-1].exception()
+    assert batcher.metrics()["failed_batches"] == 2
+
+
+def test_without_a_scheduler_items_are_scored_inline():
+    batcher = MicroBatcher(lambda items: [item + 1 for item in items])
+    assert batcher(1) == 2
+    assert batcher.metrics()["batches"] == 1
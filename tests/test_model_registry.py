@@ -0,0 +1,99 @@
+import threading
+import numpy as np
+import pytest
+from encoder import CompiledEncoder
+from model_registry import ModelRegistry
+from neighbors import ExactBackend
+from reference_index import ReferenceIndex, normalize_rows
+
+COLUMNS = ["Diet", "Monthly Grocery Bill", "Vehicle Monthly Distance Km"]
+
+
+def make_index(version, rows=20, seed=0):
+    rng = np.random.default_rng(seed)
+    features = normalize_rows(rng.uniform(0.1, 1.0, size=(rows, len(COLUMNS))).astype(np.float32))
+    encoder = CompiledEncoder(COLUMNS, {"Diet": ["omnivore", "vegan", "vegetarian"]})
+    return ReferenceIndex(features, rng.uniform(500, 5000, size=rows), COLUMNS, encoder=encoder, version=version)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    swapped = []
+    registry = ModelRegistry(COLUMNS, ExactBackend, root=str(tmp_path), on_swap=swapped.append)
+    registry.swapped = swapped
+    return registry
+
+
+def test_replaced_model_drains_before_release(registry):
+    first = registry.install(make_index("a"))
+    with registry.acquire() as held:
+        with registry.acquire():
+            registry.install(make_index("b", seed=1))
+            assert registry.current.version == "b"
+            assert held is first and first.retired and first.refs == 2
+            assert first.backend is not None
+            assert registry.status()["draining"] == [{"version": "a", "in_flight": 2}]
+        assert first.backend is not None
+        assert registry.status()["draining"] == [{"version": "a", "in_flight": 1}]
+
+    assert first.refs == 0
+    assert first.backend is None and first.index is None
+    status = registry.status()
+    assert status["draining"] == []
+    assert status["version"] == "b" and status["in_flight"] == 0
+    assert status["swaps"] == 2
+    assert [model.version for model in registry.swapped] == ["a", "b"]
+
+
+def test_idle_model_is_released_on_swap(registry):
+    first = registry.install(make_index("a"))
+    with registry.acquire():
+        pass
+    registry.install(make_index("b", seed=1))
+    assert first.backend is None
+    assert registry.status()["draining"] == []
+
+
+def test_refcount_under_concurrent_requests(registry):
+    registry.install(make_index("a"))
+    start = threading.Barrier(9)
+    versions = []
+
+    def request():
+        start.wait()
+        for _ in range(200):
+            with registry.acquire() as model:
+                assert model.backend is not None
+                versions.append(model.version)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    for i in range(20):
+        registry.install(make_index(f"v{i}", seed=i))
+    for thread in threads:
+        thread.join()
+
+    status = registry.status()
+    assert status["in_flight"] == 0
+    assert status["draining"] == []
+    assert len(versions) == 8 * 200
+
+
+def test_invalid_index_keeps_the_serving_model(registry):
+    registry.install(make_index("a"))
+    broken = make_index("b")
+    broken.columns = COLUMNS[:2]
+    with pytest.raises(ValueError):
+        registry.install(broken)
+    assert registry.current.version == "a"
+    assert registry.status()["swaps"] == 1
+
+
+@pytest.mark.parametrize("version", ["../etc", "a/b", ".hidden", "missing"])
+def test_reload_rejects_versions_outside_the_root(registry, version):
+    registry.install(make_index("a"))
+    with pytest.raises(ValueError):
+        registry.reload_async(version)
+    assert not registry.status()["reloading"]
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from encoder import CompiledEncoder
+from multi_hot import parse_items, item_column, source_columns, expand_multi_hot
+
+pd = pytest.importorskip("pandas")
+
+
+@pytest.mark.parametrize("value, items", [
+    ("['Oven', 'Microwave']", ("Oven", "Microwave")),
+    ('["Oven","Grill"]', ("Oven", "Grill")),
+    ("Oven, Microwave", ("Oven", "Microwave")),
+    ("['Oven', 'Oven']", ("Oven",)),
+    ("[Oven, Microwave", ("Oven", "Microwave")),
+    ("Metal", ("Metal",)),
+    ("[]", ()),
+    ("", ()),
+    (["Paper", " Glass ", ""], ("Paper", "Glass")),
+    (("Paper",), ("Paper",)),
+    (None, ()),
+    (3, ()),
+])
+def test_parse_items(value, items):
+    assert parse_items(value) == items
+
+
+def test_expand_multi_hot_replaces_each_list_column_in_place():
+    df = pd.DataFrame({
+        "Diet": ["vegan", "omnivore", "vegan"],
+        "Recycling": ["['Metal', 'Paper']", "[]", "['Paper']"],
+        "Cooking_With": ["['Oven']", "['Microwave', 'Oven']", "Grill"],
+        "Monthly Grocery Bill": [100, 200, 300],
+    })
+    expanded, vocabularies = expand_multi_hot(df)
+
+    assert vocabularies == {"Recycling": ["Metal", "Paper"], "Cooking_With": ["Grill", "Microwave", "Oven"]}
+    assert list(expanded.columns) == [
+        "Diet", "Recycling=Metal", "Recycling=Paper",
+        "Cooking_With=Grill", "Cooking_With=Microwave", "Cooking_With=Oven", "Monthly Grocery Bill",
+    ]
+    assert expanded["Recycling=Paper"].tolist() == [1, 0, 1]
+    assert expanded["Cooking_With=Oven"].tolist() == [1, 1, 0]
+    assert source_columns(expanded.columns) == list(df.columns)
+
+
+def make_encoder(strict_numeric=True):
+    multi_hot = {"Recycling": ["Metal", "Paper"]}
+    columns = ["Diet"] + [item_column("Recycling", item) for item in multi_hot["Recycling"]] + ["Monthly Grocery Bill"]
+    return CompiledEncoder(columns, {"Diet": ["omnivore", "vegan"]}, strict_numeric, multi_hot=multi_hot)
+
+
+@pytest.mark.parametrize("recycling", [["Paper", "Metal"], "['Metal', 'Paper']", "Metal, Paper", ("Metal", "Paper", "Glass")])
+def test_encoder_sets_one_bit_per_known_item(recycling):
+    row = make_encoder().encode({"Diet": "vegan", "Recycling": recycling, "Monthly Grocery Bill": "120"})
+    np.testing.assert_array_equal(row, [1, 1, 1, 120])
+
+
+def test_encoder_ignores_unknown_and_missing_items():
+    encoder = make_encoder()
+    np.testing.assert_array_equal(encoder.encode({"Recycling": "['Glass']"}), [0, 0, 0, 0])
+    np.testing.assert_array_equal(encoder.encode({"Diet": "keto"}), [0, 0, 0, 0])
+    np.testing.assert_array_equal(encoder.encode_batch([{"Recycling": ["Paper"]}, {}]), [[0, 0, 1, 0], [0, 0, 0, 0]])
+
+
+def test_strict_numeric_controls_unparseable_numbers():
+    with pytest.raises(ValueError):
+        make_encoder().encode({"Monthly Grocery Bill": "lots"})
+    assert make_encoder(strict_numeric=False).encode({"Monthly Grocery Bill": "lots"})[-1] == 0
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from neighbors import ExactBackend, BallTreeBackend, QuantizedBackend, normalize_queries, make_backend
+from reference_index import ReferenceIndex, normalize_rows
+
+
+def random_index(rng, rows=600, columns=12, zero_rows=0):
+    features = rng.normal(size=(rows, columns)).astype(np.float32)
+    features[:, :4] = np.abs(features[:, :4])
+    features[:zero_rows] = 0
+    targets = rng.uniform(500, 5000, size=rows)
+    return ReferenceIndex(normalize_rows(features), targets, [f"c{i}" for i in range(columns)])
+
+
+def exact_search(index, queries, k):
+    return ExactBackend(index).search(queries, k)
+
+
+@pytest.mark.parametrize("k", [1, 5])
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_quantized_matches_exact(dtype, k):
+    rng = np.random.default_rng(7)
+    index = random_index(rng)
+    queries = normalize_queries(rng.normal(size=(40, 12)))
+
+    idx, scores = QuantizedBackend(index, dtype=dtype, reference_block=128).search(queries, k)
+    expected_idx, expected_scores = exact_search(index, queries, k)
+    np.testing.assert_array_equal(idx, expected_idx)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+def test_quantized_matches_exact_on_tied_rows():
+    # Encoded categorical rows repeat a lot; every tied row must still score exactly.
+    rng = np.random.default_rng(11)
+    features = rng.integers(0, 3, size=(400, 8)).astype(np.float32)
+    index = ReferenceIndex(normalize_rows(features), np.arange(400, dtype=np.float64), list("abcdefgh"))
+    queries = normalize_queries(rng.integers(0, 3, size=(30, 8)))
+
+    _, scores = QuantizedBackend(index).search(queries, 5)
+    _, expected_scores = exact_search(index, queries, 5)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("k", [1, 5])
+def test_balltree_matches_exact(k):
+    pytest.importorskip("sklearn")
+    rng = np.random.default_rng(3)
+    index = random_index(rng, zero_rows=20)
+    queries = normalize_queries(rng.normal(size=(40, 12)))
+
+    idx, scores = BallTreeBackend(index, leaf_size=16).search(queries, k)
+    expected_idx, expected_scores = exact_search(index, queries, k)
+    np.testing.assert_array_equal(idx, expected_idx)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+def test_exact_blocking_matches_single_scan():
+    rng = np.random.default_rng(5)
+    index = random_index(rng)
+    queries = normalize_queries(rng.normal(size=(50, 12)))
+    idx, scores = ExactBackend(index, query_block=7, reference_block=64).search(queries, 5)
+
+    full = queries @ index.features.T
+    expected_idx = np.argsort(-full, axis=1, kind="stable")[:, :5]
+    np.testing.assert_array_equal(idx, expected_idx)
+    np.testing.assert_allclose(scores, np.take_along_axis(full, expected_idx, axis=1), rtol=1e-6)
+
+
+def test_k_larger_than_the_index():
+    rng = np.random.default_rng(1)
+    index = random_index(rng, rows=3)
+    queries = normalize_queries(rng.normal(size=(2, 12)))
+    for backend in (ExactBackend(index), QuantizedBackend(index)):
+        idx, _ = backend.search(queries, 10)
+        assert idx.shape == (2, 3)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        make_backend("annoy", random_index(np.random.default_rng(0), rows=4))
+
+
+def test_balltree_ranks_zero_rows_by_cosine():
+    pytest.importorskip("sklearn")
+    features = np.zeros((30, 3), dtype=np.float32)
+    features[10:, 0] = 1.0
+    features[20:, 1] = 1.0
+    features[10:, 2] = np.linspace(0.1, 2.0, 20)
+    index = ReferenceIndex(normalize_rows(features), np.arange(30, dtype=np.float64), ["a", "b", "c"])
+    # Negative cosine with every real row, so the zero rows are the nearest.
+    queries = normalize_queries([[-1.0, -1.0, 0.0], [1.0, 0.2, 0.0]])
+
+    idx, scores = BallTreeBackend(index, candidates_per_k=1).search(queries, 2)
+    expected_idx, expected_scores = exact_search(index, queries, 2)
+    np.testing.assert_array_equal(idx, expected_idx)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
@@ -0,0 +1,66 @@
+import time
+import numpy as np
+from encoder import CompiledEncoder
+from model_registry import ModelRegistry
+from neighbors import ExactBackend
+from prediction_cache import LocalCacheBackend, ResultCache, make_cache_backend
+from reference_index import ReferenceIndex, normalize_rows
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResultCache(LocalCacheBackend(max_entries=2))
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    metrics = cache.metrics()
+    assert metrics["evictions"] == 1
+    assert metrics["entries"] == 2
+    assert (metrics["hits"], metrics["misses"]) == (3, 1)
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ResultCache(LocalCacheBackend(ttl=0.05))
+    cache.set("a", [1.5, []])
+    assert cache.get("a") == [1.5, []]
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.metrics()["expirations"] == 1
+    assert cache.metrics()["entries"] == 0
+
+
+def test_keys_depend_on_version_and_row_contents():
+    cache = ResultCache(LocalCacheBackend(), version="a")
+    row = np.array([1.0, 2.0], dtype=np.float32)
+    assert cache.key(row, "exact") == cache.key(row.astype(np.float64), "exact")
+    assert cache.key(row, "exact") != cache.key(row, "balltree")
+    assert cache.key(row, "exact") != ResultCache(LocalCacheBackend(), version="b").key(row, "exact")
+
+
+def make_index(version, seed):
+    rng = np.random.default_rng(seed)
+    columns = ["Diet", "Monthly Grocery Bill"]
+    features = normalize_rows(rng.uniform(0.1, 1.0, size=(10, 2)).astype(np.float32))
+    encoder = CompiledEncoder(columns, {"Diet": ["omnivore", "vegan"]})
+    return ReferenceIndex(features, rng.uniform(500, 5000, size=10), columns, encoder=encoder, version=version)
+
+
+def test_model_swap_invalidates_cached_results():
+    cache = ResultCache(make_cache_backend(None, max_entries=100), version="a")
+    registry = ModelRegistry(["Diet", "Monthly Grocery Bill"], ExactBackend,
+                             on_swap=lambda model: cache.set_version(model.version))
+    registry.install(make_index("a", 0))
+    assert cache.metrics()["invalidations"] == 0
+    old_key = cache.key("row")
+    cache.set(old_key, 1234.0)
+
+    registry.install(make_index("b", 1))
+    assert cache.version == "b"
+    assert cache.metrics()["invalidations"] == 1
+    assert cache.metrics()["entries"] == 0
+    assert cache.get(old_key) is None
+    assert cache.key("row") != old_key
@@ -0,0 +1,94 @@
+import random
+import pytest
+from reduction_tracker import ReductionState, ReductionTracker, EXCLUDED_KEYS
+
+
+def pairwise_reduction(entries):
+    """The original O(n^2) comparison of every earlier entry with every later one."""
+    total_reduction = 0.0
+    contributions = {}
+    for i in range(len(entries)):
+        for j in range(i + 1, len(entries)):
+            fp_i = float(entries[i].get("predicted_footprint", 0))
+            fp_j = float(entries[j].get("predicted_footprint", 0))
+            if fp_j >= fp_i:
+                continue
+            amount = fp_i - fp_j
+            total_reduction += amount
+            data_i = entries[i].get("user_data", {})
+            data_j = entries[j].get("user_data", {})
+            for key in data_j:
+                if key in EXCLUDED_KEYS:
+                    continue
+                val_i, val_j = data_i.get(key), data_j.get(key)
+                try:
+                    changed = float(val_i) != float(val_j)
+                except (TypeError, ValueError):
+                    changed = str(val_i).strip().lower() != str(val_j).strip().lower()
+                if changed:
+                    contributions[key] = contributions.get(key, 0) + amount
+    return total_reduction, contributions
+
+
+def random_history(rng, length):
+    values = {
+        "Diet": ["vegan", "Vegan ", "omnivore", None],
+        "Transport": ["public", "private", "walk/bicycle"],
+        "Monthly Grocery Bill": [100, "100", 100.0, 250, "n/a"],
+        "Sex": ["male", "female"],
+    }
+    history = []
+    for _ in range(length):
+        # Some keys are left out so "missing" compares against present values too.
+        user_data = {key: rng.choice(options) for key, options in values.items() if rng.random() < 0.85}
+        history.append({"predicted_footprint": rng.choice([900, 1200.5, 1500, 2000, 2000, 3100.25]),
+                        "user_data": user_data})
+    return history
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_reduction_state_matches_pairwise(seed):
+    rng = random.Random(seed)
+    history = random_history(rng, rng.randint(2, 30))
+    state = ReductionState()
+    for entry in history:
+        state.add(entry)
+
+    total_reduction, contributions = pairwise_reduction(history)
+    assert state.total_reduction == pytest.approx(total_reduction)
+    assert state.contributions.keys() == {key for key, value in contributions.items() if value > 1e-9}
+    for key, value in state.contributions.items():
+        assert value == pytest.approx(contributions[key])
+
+
+def submission(seq, footprint, diet):
+    return {"username": "u", "seq": seq, "predicted_footprint": footprint, "user_data": {"Diet": diet}}
+
+
+def test_tracker_refolds_a_submission_that_lands_late():
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    tracker = ReductionTracker(db.users, db.reduction_insights)
+    db.users.insert_many([submission(2, 4000.0, "y"), submission(3, 10000.0, "z")])
+    tracker.update("u")
+
+    # seq 1 was allocated first but its insert finished last.
+    db.users.insert_one(submission(1, 5000.0, "x"))
+    result = tracker.update("u")
+
+    rebuilt = ReductionTracker(db.users, db.other_insights).update("u")
+    assert result == rebuilt
+    assert result["reduced_amount"] == 1000.0
+    assert db.reduction_insights.find_one({"username": "u"}, {"_id": 0}) == rebuilt
+
+
+def test_tracker_only_reads_new_submissions():
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    tracker = ReductionTracker(db.users, db.reduction_insights)
+    db.users.insert_many([submission(1, 3000.0, "x"), submission(2, 2000.0, "y")])
+    assert tracker.update("u")["reduced_amount"] == 1000.0
+    assert tracker.update("u") is None
+
+    db.users.insert_one(submission(3, 1000.0, "z"))
+    assert tracker.update("u")["reduced_amount"] == 4000.0
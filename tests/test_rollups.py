@@ -0,0 +1,103 @@
+from datetime import datetime
+import pytest
+from rollups import apply_rollups, rebuild_rollups, rollup_updates, materialize_rollup, trend_options, footprint_trend
+
+mongomock = pytest.importorskip("mongomock")
+
+
+def submission(username, footprint, diet, month="May", year=2024):
+    return {"username": username, "user_data": {"Diet": diet}, "predicted_footprint": footprint,
+            "month": month, "year": year}
+
+
+def rollup_docs(collection):
+    return sorted(({key: value for key, value in doc.items() if key not in ("_id", "updated_at")}
+                   for doc in collection.find()), key=repr)
+
+
+def test_rebuild_matches_incremental_rollups_and_keeps_offsets():
+    db = mongomock.MongoClient().db
+    docs = [submission("alice", 3000.0, "vegan"), submission("bob", 2000.0, "omnivore", "June"),
+            submission("alice", 1000.0, "vegan", "January", 2025)]
+    db.users.insert_many([dict(doc) for doc in docs])
+    apply_rollups(db.incremental, docs)
+    # Stale and partial rollups, one carrying a consumer offset guard.
+    db.footprint_rollups.insert_many([
+        {"username": "alice", "period": "year", "bucket": "2024", "count": 7, "offsets": {"events:0": 41}},
+        {"username": "carol", "period": "year", "bucket": "2023", "count": 1},
+    ])
+
+    rebuild_rollups(db.users, db.footprint_rollups, batch_size=2)
+
+    rebuilt = db.footprint_rollups
+    alice_2024 = rebuilt.find_one({"username": "alice", "period": "year", "bucket": "2024"})
+    assert alice_2024["offsets"] == {"events:0": 41}
+    rebuilt.update_one({"_id": alice_2024["_id"]}, {"$unset": {"offsets": ""}})
+    assert rollup_docs(rebuilt) == rollup_docs(db.incremental)
+    assert "footprint_rollups_rebuild" not in db.list_collection_names()
+    assert any(info.get("unique") for info in rebuilt.index_information().values())
+
+
+def test_rollup_updates_merge_per_bucket():
+    updates = rollup_updates([submission("alice", 3000.0, "vegan"), submission("alice", 1000.0, "omnivore"),
+                              submission("bob", 2000.0, "vegan", "June")])
+    merged = {tuple(update._filter.values()): update._doc for update in updates}
+
+    # alice month + year, bob month + year, global May, June and 2024.
+    assert len(updates) == 7
+    alice_may = merged[("alice", "month", "2024-05")]
+    assert alice_may["$inc"]["count"] == 2
+    assert alice_may["$inc"]["sum"] == 4000.0
+    assert alice_may["$min"] == {"min": 1000.0}
+    assert alice_may["$max"] == {"max": 3000.0}
+    assert alice_may["$inc"]["categories.Diet.vegan.sum"] == 3000.0
+    assert alice_may["$inc"]["categories.Diet.omnivore.count"] == 1
+    assert merged[(None, "year", "2024")]["$inc"]["count"] == 3
+    assert merged[(None, "month", "2024-06")]["$inc"]["count"] == 1
+    assert isinstance(alice_may["$set"]["updated_at"], datetime)
+
+
+def test_submissions_without_a_period_touch_no_rollups():
+    assert rollup_updates([{"username": "alice", "predicted_footprint": 1.0, "user_data": {}}]) == []
+    no_month = rollup_updates([submission("alice", 1.0, "vegan", month="Smarch")])
+    assert [update._filter["period"] for update in no_month] == ["year", "year"]
+
+
+def test_materialize_rollup_with_a_breakdown():
+    doc = {
+        "bucket": "2024-05", "count": 3, "sum": 6000.0, "min": 1000.0, "max": 3000.0,
+        "categories": {"Diet": {"vegan": {"count": 2, "sum": 4000.0}, "omni%2Evore": {"count": 1, "sum": 2000.0},
+                                "keto": {"count": 0, "sum": 0.0}}},
+    }
+    assert materialize_rollup(doc) == {"bucket": "2024-05", "count": 3, "mean": 2000.0, "min": 1000.0, "max": 3000.0}
+    assert materialize_rollup(doc, "Diet")["categories"] == {
+        "vegan": {"count": 2, "mean": 2000.0}, "omni.vore": {"count": 1, "mean": 2000.0}
+    }
+    assert materialize_rollup(doc, "Transport")["categories"] == {}
+    assert materialize_rollup({"bucket": "2024"})["mean"] is None
+
+
+@pytest.mark.parametrize("args, options", [
+    ({}, {"period": "month", "limit": 12, "breakdown": None}),
+    ({"period": "year", "limit": "3", "by": "Diet"}, {"period": "year", "limit": 3, "breakdown": "Diet"}),
+    ({"limit": "0"}, {"period": "month", "limit": 1, "breakdown": None}),
+    ({"limit": "1000"}, {"period": "month", "limit": 120, "breakdown": None}),
+])
+def test_trend_options(args, options):
+    assert trend_options(args) == options
+
+
+@pytest.mark.parametrize("args", [{"period": "week"}, {"by": "Monthly Grocery Bill"}, {"by": "nope"}, {"limit": "ten"}])
+def test_trend_options_rejects_bad_input(args):
+    with pytest.raises(ValueError):
+        trend_options(args)
+
+
+def test_footprint_trend_returns_the_latest_buckets_oldest_first():
+    collection = mongomock.MongoClient().db.footprint_rollups
+    apply_rollups(collection, [submission("alice", 1000.0 * m, "vegan", month) for m, month in
+                               enumerate(["January", "February", "March", "April"], start=1)])
+    trend = footprint_trend(collection, "alice", limit=3, breakdown="Diet")
+    assert [bucket["bucket"] for bucket in trend] == ["2024-02", "2024-03", "2024-04"]
+    assert trend[-1]["categories"] == {"vegan": {"count": 1, "mean": 4000.0}}
+    assert [bucket["count"] for bucket in footprint_trend(collection, None, period="year")] == [4]
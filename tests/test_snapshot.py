@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pytest
+from snapshot import build_from_csv, write_snapshot, stream_build, read_manifest, load_snapshot
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cleaned_individual_footprint.csv")
+
+
+@pytest.fixture
+def sample(tmp_path):
+    path = tmp_path / "sample.csv"
+    pd.read_csv(DATASET, nrows=120).to_csv(path, index=False)
+    return str(path)
+
+
+def in_memory_snapshot(dataset_path, root):
+    snapshot_dir = write_snapshot(build_from_csv(dataset_path), dataset_path, str(root))
+    return load_snapshot(snapshot_dir, read_manifest(snapshot_dir)["columns"])
+
+
+def assert_same_index(streamed, built):
+    assert streamed.version == built.version
+    assert streamed.columns == built.columns
+    np.testing.assert_array_equal(np.asarray(streamed.features), np.asarray(built.features))
+    np.testing.assert_array_equal(np.asarray(streamed.targets), np.asarray(built.targets))
+    assert streamed.encoder.to_dict() == built.encoder.to_dict()
+
+
+def test_stream_build_matches_the_in_memory_build(sample, tmp_path):
+    built = in_memory_snapshot(sample, tmp_path / "memory")
+    # A chunk size that does not divide the row count, so vocabularies span chunks.
+    streamed = stream_build(sample, str(tmp_path / "stream"), chunk_size=17)
+    assert_same_index(streamed, built)
+    assert read_manifest(os.path.join(str(tmp_path / "stream"), streamed.version))["rows"] == 120
+    assert not [name for name in os.listdir(tmp_path / "stream") if name.endswith(".tmp")]
+
+
+def test_stream_build_reads_raw_exports(sample, tmp_path):
+    raw = pd.read_csv(sample).rename(columns={"Total_Carbon_Footprint": "CarbonEmission"})
+    raw = raw.drop(columns=["Footprint_Category"]).assign(Notes="unused")
+    # Like the cleaning notebook, rows with missing answers are dropped.
+    incomplete = raw.iloc[:3].copy()
+    incomplete.loc[:, "Vehicle Type"] = None
+    raw_path = str(tmp_path / "raw.csv")
+    pd.concat([incomplete, raw]).to_csv(raw_path, index=False)
+
+    built = in_memory_snapshot(sample, tmp_path / "memory")
+    streamed = stream_build(raw_path, str(tmp_path / "stream"), chunk_size=50)
+    assert_same_index(streamed, built)
+
+
+def test_stream_build_rejects_files_missing_columns(sample, tmp_path):
+    path = str(tmp_path / "partial.csv")
+    pd.read_csv(sample).drop(columns=["Diet"]).to_csv(path, index=False)
+    with pytest.raises(ValueError, match="Diet"):
+        stream_build(path, str(tmp_path / "stream"))
@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+from user_index import UserVectorIndex
+
+
+def make_index(**options):
+    return UserVectorIndex(["bill", "km"], ["diet"], initial_capacity=2, **options)
+
+
+def test_top_k_ranks_by_similarity_and_excludes_the_user():
+    index = make_index()
+    index.update("me", {"bill": 100, "km": 10, "diet": "vegan"})
+    index.update("twin", {"bill": 200, "km": 20, "diet": "vegan"})
+    index.update("close", {"bill": 100, "km": 30, "diet": "vegan"})
+    index.update("far", {"bill": 1, "km": 500, "diet": "vegan"})
+    index.update("other", {"bill": "n/a", "km": None, "diet": "omnivore"})
+
+    assert index.top_k("me", k=3) == ["twin", "close", "far"]
+    assert index.top_k("me", k=10)[:3] == ["twin", "close", "far"]
+    assert len(index.top_k("me", k=10)) == 4
+    assert "me" not in index.top_k("me", k=10)
+    assert index.top_k("nobody") == []
+    assert len(index) == 5
+
+
+def test_updates_replace_the_users_row():
+    index = make_index()
+    index.update("me", {"bill": 100, "km": 10, "diet": "vegan"})
+    index.update("a", {"bill": 100, "km": 10, "diet": "vegan"})
+    index.update("b", {"bill": 10, "km": 100, "diet": "vegan"})
+    assert index.top_k("me", k=1) == ["a"]
+    index.update("me", {"bill": 10, "km": 100, "diet": "vegan"})
+    assert index.top_k("me", k=1) == ["b"]
+    assert len(index) == 3
+
+
+def test_a_single_user_has_no_neighbours():
+    index = make_index()
+    index.update("me", {"bill": 1, "km": 1, "diet": "vegan"})
+    assert index.top_k("me") == []
+
+
+def aggregate(username, bill, updated_at):
+    return {"username": username, "bill": bill, "km": 1, "diet": "vegan", "updated_at": updated_at}
+
+
+def test_sync_cursor_follows_stored_timestamps_with_an_overlap():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.aggregate
+    start = datetime(2024, 5, 1, 12, 0, 0)
+    collection.insert_one(aggregate("a", 1, start))
+    index = make_index(sync_overlap=60).sync(collection)
+    assert index.last_synced == start
+
+    # Written after the last sync, but stamped by a clock running 30s behind.
+    collection.insert_one(aggregate("late", 2, start - timedelta(seconds=30)))
+    # Outside the overlap window: treated as already synced.
+    collection.insert_one(aggregate("stale", 3, start - timedelta(seconds=120)))
+    collection.insert_one(aggregate("b", 4, start + timedelta(seconds=5)))
+    index.sync(collection)
+
+    assert set(index.rows) == {"a", "late", "b"}
+    assert index.last_synced == start + timedelta(seconds=5)
+
+    # Nothing new: the cursor stays on the newest stored timestamp.
+    index.sync(collection)
+    assert index.last_synced == start + timedelta(seconds=5)
+
+
+def test_start_sync_stops_when_its_event_is_set():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.aggregate
+    index = make_index()
+    running = set(threading.enumerate())
+    stop = index.start_sync(collection, interval=0.01)
+    sync_thread, = [thread for thread in threading.enumerate() if thread not in running]
+    assert sync_thread.name == "user-index-sync"
+
+    collection.insert_one(aggregate("a", 1, datetime(2024, 5, 1)))
+    for _ in range(500):
+        if "a" in index.rows:
+            break
+        stop.wait(0.01)
+    assert "a" in index.rows
+
+    stop.set()
+    sync_thread.join(5)
+    assert not sync_thread.is_alive()
@@ -0,0 +1,111 @@
+import threading
+from datetime import timedelta
+import numpy as np
+
+
+class UserVectorIndex:
+    """In-memory vectors of every user's aggregate, kept current as aggregates are upserted.
+
+    Category codes are assigned the first time a value is seen and never
+    change, so updating one user does not re-encode the others. Rows are
+    stored L2-normalized, so a lookup is one matrix-vector product plus an
+    argpartition over the scores.
+    """
+
+    def __init__(self, numerical_cols, categorical_cols, initial_capacity=1024, sync_overlap=60):
+        self.numerical_cols = list(numerical_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.vocab = {col: {} for col in self.categorical_cols}
+        self.usernames = []
+        self.rows = {}
+        self.vectors = np.zeros((initial_capacity, len(self.numerical_cols) + len(self.categorical_cols)), dtype=np.float32)
+        self.last_synced = None
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def _category_code(self, col, value):
+        codes = self.vocab[col]
+        key = str(value)
+        if key not in codes:
+            codes[key] = len(codes)
+        return codes[key]
+
+    def encode(self, aggregated_data):
+        vector = np.empty(self.vectors.shape[1], dtype=np.float32)
+        for j, col in enumerate(self.numerical_cols):
+            try:
+                vector[j] = float(aggregated_data.get(col) or 0)
+            except (TypeError, ValueError):
+                vector[j] = 0
+        offset = len(self.numerical_cols)
+        for j, col in enumerate(self.categorical_cols):
+            vector[offset + j] = self._category_code(col, aggregated_data.get(col))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def update(self, username, aggregated_data):
+        with self._lock:
+            vector = self.encode(aggregated_data)
+            row = self.rows.get(username)
+            if row is None:
+                row = len(self.usernames)
+                if row == len(self.vectors):
+                    grown = np.zeros((2 * len(self.vectors), self.vectors.shape[1]), dtype=np.float32)
+                    grown[:row] = self.vectors
+                    self.vectors = grown
+                self.rows[username] = row
+                self.usernames.append(username)
+            self.vectors[row] = vector
+
+    def top_k(self, username, k=3):
+        with self._lock:
+            row = self.rows.get(username)
+            if row is None:
+                return []
+            n_users = len(self.usernames)
+            k = min(k, n_users - 1)
+            if k <= 0:
+                return []
+            scores = self.vectors[:n_users] @ self.vectors[row]
+            scores[row] = -np.inf
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [self.usernames[idx] for idx in ranked]
+
+    def sync(self, collection, transform=None):
+        """Pull aggregates upserted by other workers since the last sync.
+
+        The cursor is the newest updated_at read back from the collection,
+        never this host's clock, and each sync re-reads sync_overlap seconds
+        before it, so updates committed late or stamped by a lagging clock
+        are still picked up. Re-applying an aggregate is harmless.
+        """
+        query = {"updated_at": {"$gt": self.last_synced - self.sync_overlap}} if self.last_synced else {}
+        newest = self.last_synced
+        for doc in collection.find(query, {"_id": 0}):
+            self.update(doc["username"], transform(doc) if transform else doc)
+            updated_at = doc.get("updated_at")
+            if updated_at is not None and (newest is None or updated_at > newest):
+                newest = updated_at
+        self.last_synced = newest
+        return self
+
+    @classmethod
+    def from_collection(cls, collection, numerical_cols, categorical_cols, transform=None):
+        return cls(numerical_cols, categorical_cols).sync(collection, transform)
+
+    def start_sync(self, collection, interval=30, transform=None):
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.sync(collection, transform)
+                except Exception as e:
+                    print(f"User index sync failed: {e}")
+        stop = threading.Event()
+        threading.Thread(target=run, name="user-index-sync", daemon=True).start()
+        return stop